@@ -1,15 +1,18 @@
 import os
+import re
 import logging
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.ext.asyncio import AsyncAttrs
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
+from config import DB_MODE, DB_POOL_SIZE
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class Base(DeclarativeBase):
+class Base(AsyncAttrs, DeclarativeBase):
     pass
 
 # Initialize SQLAlchemy with the Base class
@@ -37,8 +40,51 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_recycle": 300,
     "pool_pre_ping": True,
 }
+if not database_url.startswith("sqlite"):
+    # One connection per database thread of the bot, plus room for the web views and background flushes
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"].update(pool_size=DB_POOL_SIZE, max_overflow=10)
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
+def async_database_url(url: str) -> str:
+    """
+    Turn a PostgreSQL URL into one for the asyncpg driver
+    
+    Args:
+        url: The database URL
+        
+    Returns:
+        The URL with the asyncpg driver, or None if it is not a PostgreSQL URL
+    """
+    if not re.match(r"postgres(ql)?(\+\w+)?://", url):
+        return None
+    url = re.sub(r"^postgres(ql)?(\+\w+)?://", "postgresql+asyncpg://", url)
+    # asyncpg takes the libpq sslmode values under the name ssl
+    return url.replace("sslmode=", "ssl=")
+
+# Async engine for the bot's database work in DB_MODE "async"; the Flask views keep the sync engine
+async_engine = None
+async_session = None
+if DB_MODE == "async":
+    try:
+        import asyncpg  # noqa: F401
+    except ImportError:
+        asyncpg = None
+    if asyncpg is None:
+        logger.warning("DB_MODE is async but asyncpg is not installed, using the database thread pool")
+    elif not async_database_url(database_url):
+        logger.warning("DB_MODE is async but the database is not PostgreSQL, using the database thread pool")
+    else:
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+        async_engine = create_async_engine(
+            async_database_url(database_url),
+            pool_recycle=300,
+            pool_pre_ping=True,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=10,
+        )
+        # Objects are read after the unit of work ends, so keep their loaded values
+        async_session = async_sessionmaker(async_engine, expire_on_commit=False)
+
 # Initialize the app with the extension
 db.init_app(app)
 
@@ -47,4 +93,12 @@ with app.app_context():
     import models
     # Create all tables
     db.create_all()
+    # Make sure the partitioned messages table can take this month's messages
+    from bot.archive import ensure_partitions
+    try:
+        ensure_partitions()
+    except Exception as e:
+        # New messages still land in an existing partition or the default one
+        db.session.rollback()
+        logger.error(f"Failed to prepare message partitions: {e}")
     logger.info("Database tables created successfully")
@@ -0,0 +1,110 @@
+"""
+ASGI entry point: one event loop for the web server and the bot
+
+Run with:
+    uvicorn asgi:app --host 0.0.0.0 --port $PORT
+
+The bot is initialized and started once in the server's startup hook, which
+uvicorn completes before it accepts requests. Webhook updates are then handed
+to the update dispatcher from the same loop. Requests this module does not
+handle itself (/about, /api/docs, the webhook management routes, ...) are
+passed on to the Flask app in main.py.
+"""
+import contextlib
+import logging
+import os
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+from telegram import Update
+
+from app import app as flask_app
+from bot import build_bot, is_ready, start_bot, stop_bot
+from bot.dedup import update_deduplicator
+from bot.dispatcher import update_dispatcher
+from config import UPDATE_MODE
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+token = os.environ.get("TELEGRAM_BOT_TOKEN")
+
+# Build the bot before main is imported, so main's setup_bot reuses it instead of starting its own loop
+bot = build_bot(token) if token else None
+import main  # noqa: E402,F401  Registers the Flask routes
+
+async def index(request: Request) -> JSONResponse:
+    return JSONResponse({
+        'status': 'success',
+        'message': 'Telegram Dating Bot API is running',
+        'service': 'Ethiopian University Dating Bot'
+    })
+
+async def ping(request: Request) -> JSONResponse:
+    return JSONResponse({
+        'status': 'success',
+        'message': 'Bot is running'
+    })
+
+async def health(request: Request) -> JSONResponse:
+    if not is_ready():
+        return JSONResponse({'status': 'starting', 'message': 'Bot is starting'}, status_code=503)
+    return JSONResponse({'status': 'success', 'message': 'Bot is ready'})
+
+async def webhook(request: Request) -> JSONResponse:
+    """Hand an incoming Telegram update to its chat's worker"""
+    if request.method == "GET":
+        return JSONResponse({"status": "success", "message": "Webhook endpoint is active"})
+
+    # Bad updates are acknowledged anyway, since Telegram would only send them again
+    try:
+        update_data = await request.json()
+    except ValueError as e:
+        logger.error(f"Failed to parse update JSON: {e}")
+        return JSONResponse({"status": "success", "message": "Could not parse update data"})
+
+    # Drop updates Telegram sent again before doing any work on them
+    update_id = update_data.get("update_id") if isinstance(update_data, dict) else None
+    if update_id is not None and not update_deduplicator.claim(update_id):
+        return JSONResponse({"status": "success", "message": "Duplicate update"})
+
+    try:
+        update = Update.de_json(update_data, bot.bot)
+    except Exception as e:
+        logger.error(f"Failed to convert update: {e}")
+        return JSONResponse({"status": "success", "message": "Invalid update format"})
+
+    # A full queue means we are behind; a non-2xx status makes Telegram retry later
+    if not update_dispatcher.submit(update):
+        update_deduplicator.release(update_id)
+        return JSONResponse({"status": "error", "message": "Too many pending updates"}, status_code=503)
+    return JSONResponse({"status": "success"})
+
+@contextlib.asynccontextmanager
+async def lifespan(_: Starlette):
+    if bot is None:
+        logger.warning("TELEGRAM_BOT_TOKEN not set, running in API-only mode")
+        yield
+        return
+
+    # Handlers use Flask-SQLAlchemy; tasks started from here inherit the app context
+    with flask_app.app_context():
+        await start_bot(bot)
+        try:
+            yield
+        finally:
+            await stop_bot(bot)
+
+routes = [
+    Route('/', index),
+    Route('/ping', ping),
+    Route('/health', health),
+]
+if bot is not None and UPDATE_MODE == "webhook":
+    routes.append(Route(f"/webhook/{token}", webhook, methods=["GET", "POST"]))
+routes.append(Mount('/', WSGIMiddleware(flask_app)))
+
+app = Starlette(routes=routes, lifespan=lifespan)
@@ -1,4 +1,5 @@
-from telegram.ext import ApplicationBuilder, Application
+from telegram.ext import ApplicationBuilder, Application, ContextTypes
+from config import STARTUP_BUFFER_SIZE, TELEGRAM_API_BASE_URL, UPDATE_MODE
 import logging
 
 # Initialize logger
@@ -6,6 +7,8 @@ logger = logging.getLogger(__name__)
 
 # Bot instance
 bot_app = None
+# Event loop that runs the bot once it has started, see start_bot
+bot_loop = None
 
 async def initialize_bot(bot_app: Application) -> None:
     """
@@ -19,47 +22,206 @@ async def initialize_bot(bot_app: Application) -> None:
     
     if not getattr(bot_app, "running", False):
         await bot_app.start()
+        
+        # Start the periodic flushes of write-behind buffers
+        from bot.background import start_background_tasks
+        start_background_tasks(bot_app)
     
 import asyncio
 import threading
 
-def setup_bot(token: str) -> Application:
+# Set once the bot has started and takes updates
+_ready = threading.Event()
+# Updates that arrived before the bot was ready, guarded by _pending_lock
+_pending = []
+_pending_lock = threading.Lock()
+
+def build_bot(token: str) -> Application:
     """
-    Set up the Telegram bot application
-    
+    Build the Telegram bot application and register its handlers
+
+    Nothing is initialized; the caller decides on which event loop the
+    application runs.
+
     Args:
         token: The Telegram bot token
-        
+
     Returns:
         The configured Application instance
     """
     global bot_app
     
-    logger.info("Setting up the bot application...")
-    
-    # Build the application with token
-    bot_app = ApplicationBuilder().token(token).build()
+    # Build the application with token; bot.dispatcher feeds it updates and
+    # handlers get the update's UpdateContext through BotContext
+    from bot.update_context import BotContext
+    bot_app = (
+        ApplicationBuilder()
+        .token(token)
+        .base_url(TELEGRAM_API_BASE_URL)
+        .context_types(ContextTypes(context=BotContext))
+        .build()
+    )
     
     # Import handlers here to avoid circular imports
     from bot.handlers import register_handlers
     register_handlers(bot_app)
     
-    # Start initialization in a background thread to avoid blocking
-    def init_bot_async():
+    # The bot's ID is the part of the token before the colon
+    from bot.dedup import update_deduplicator
+    update_deduplicator.load(int(token.split(":")[0]))
+    return bot_app
+
+def setup_bot(token: str) -> Application:
+    """
+    Set up the Telegram bot application
+    
+    Args:
+        token: The Telegram bot token
+        
+    Returns:
+        The configured Application instance
+    """
+    # The ASGI server builds and starts the bot itself before importing main
+    if bot_app is not None:
+        return bot_app
+    
+    logger.info("Setting up the bot application...")
+    build_bot(token)
+    
+    # Run the bot on its own event loop in a background thread for the life of the worker
+    def run_bot_loop():
+        from app import app
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         
-        try:
-            loop.run_until_complete(initialize_bot(bot_app))
-            logger.info("Bot initialized successfully")
-        except Exception as e:
-            logger.error(f"Error initializing bot: {e}")
+        # Handlers use Flask-SQLAlchemy; tasks started on this loop inherit the app context
+        with app.app_context():
+            try:
+                loop.run_until_complete(start_bot(bot_app))
+                logger.info("Bot initialized successfully")
+            except Exception as e:
+                logger.error(f"Error initializing bot: {e}")
+                return
+            loop.run_forever()
     
-    threading.Thread(target=init_bot_async, daemon=True).start()
+    threading.Thread(target=run_bot_loop, name="bot-loop", daemon=True).start()
     
     logger.info("Bot setup complete")
     return bot_app
 
+async def start_bot(bot_app: Application) -> None:
+    """
+    Initialize and start the bot on the running event loop
+
+    Called exactly once per worker: by the ASGI server's startup hook, by
+    the bot thread of the WSGI stack, or by poll.py. Updates are then fed
+    to the update dispatcher's workers on this loop, from the webhook or,
+    with UPDATE_MODE=polling, from getUpdates.
+
+    Args:
+        bot_app: The bot application to start
+    """
+    global bot_loop, _pending
+    await initialize_bot(bot_app)
+    bot_loop = asyncio.get_running_loop()
+    from bot.dispatcher import update_dispatcher
+    update_dispatcher.start(bot_app)
+    
+    # Hand over the updates that arrived during startup, in arrival order;
+    # more may arrive while waiting for queue room, so repeat until none are left
+    while True:
+        with _pending_lock:
+            updates, _pending = _pending, []
+            if not updates:
+                _ready.set()
+                break
+        logger.info(f"Queueing {len(updates)} updates received during startup")
+        for update in updates:
+            await update_dispatcher.put(update)
+    
+    if UPDATE_MODE == "polling":
+        from bot.polling import start_polling
+        await start_polling(bot_app)
+    logger.info("Bot started")
+
+async def stop_bot(bot_app: Application) -> None:
+    """
+    Finish queued updates, flush buffered writes, then stop and shut down the bot
+
+    Args:
+        bot_app: The bot application to stop
+    """
+    global bot_loop
+    _ready.clear()
+    bot_loop = None
+    from bot.polling import stop_polling
+    await stop_polling()
+    from bot.dispatcher import update_dispatcher
+    await update_dispatcher.stop()
+    from bot.background import stop_background_tasks
+    await stop_background_tasks()
+    from bot.db_pool import close_db
+    await close_db()
+    if bot_app.running:
+        await bot_app.stop()
+    await bot_app.shutdown()
+    logger.info("Bot stopped")
+
+def is_ready() -> bool:
+    """
+    Check whether the bot has started and processes updates
+
+    Returns:
+        True once start_bot has completed, False before and after shutdown
+    """
+    return _ready.is_set()
+
+def submit_update(update) -> bool:
+    """
+    Queue an update for processing from a thread other than the bot's loop
+
+    Updates that arrive before the bot is ready are held, up to
+    STARTUP_BUFFER_SIZE of them, and queued once it has started.
+
+    Args:
+        update: The Telegram update
+
+    Returns:
+        True if the update was accepted, False if the startup buffer or the
+        update's worker queue is full
+    """
+    with _pending_lock:
+        if not _ready.is_set():
+            if len(_pending) >= STARTUP_BUFFER_SIZE:
+                return False
+            _pending.append(update)
+            return True
+    return asyncio.run_coroutine_threadsafe(_dispatch(update), bot_loop).result(5)
+
+async def _dispatch(update) -> bool:
+    from bot.dispatcher import update_dispatcher
+    return update_dispatcher.submit(update)
+
+def run_on_bot_loop(coro, timeout: float = 30):
+    """
+    Run a coroutine from synchronous code, such as a Flask view, and wait for it
+
+    Once the bot has started, the coroutine runs on the bot's loop so it can
+    use the bot's HTTP client. Before that a fresh event loop is used.
+
+    Args:
+        coro: The coroutine to run
+        timeout: Seconds to wait for the result on the bot's loop
+
+    Returns:
+        The coroutine's result
+    """
+    if bot_loop is not None:
+        return asyncio.run_coroutine_threadsafe(coro, bot_loop).result(timeout)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    return loop.run_until_complete(coro)
+
 def get_bot() -> Application:
     """
     Get the bot application instance
@@ -3,6 +3,9 @@ from telegram.ext import ContextTypes, ConversationHandler
 from sqlalchemy import desc
 from app import db
 from models import User, Report, Match, UserState, Confession
+from bot.db_pool import run_db
+from bot.discovery import user_changed, user_removed
+from bot.sessions import chat_sessions
 from config import ADMIN_IDS, STATES, STATE_IDS
 import logging
 from datetime import datetime
@@ -51,6 +54,23 @@ async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         parse_mode="Markdown"
     )
 
+def _recent_reports() -> list:
+    """
+    Load the latest unresolved reports with both users
+    
+    Returns:
+        A list of (report, reporter, reported) tuples, skipping reports
+        whose users no longer exist
+    """
+    reports = Report.query.filter_by(is_resolved=False).order_by(desc(Report.created_at)).limit(10).all()
+    rows = []
+    for report in reports:
+        reporter = User.query.get(report.reporter_id)
+        reported = User.query.get(report.reported_user_id)
+        if reporter and reported:
+            rows.append((report, reporter, reported))
+    return rows
+
 async def view_reports(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Show recent user reports
@@ -69,7 +89,7 @@ async def view_reports(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         return
     
     # Get recent reports
-    reports = Report.query.filter_by(is_resolved=False).order_by(desc(Report.created_at)).limit(10).all()
+    reports = await run_db(_recent_reports)
     
     if not reports:
         await update.message.reply_text(
@@ -78,13 +98,7 @@ async def view_reports(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         return
     
     # Display each report
-    for report in reports:
-        reporter = User.query.get(report.reporter_id)
-        reported = User.query.get(report.reported_user_id)
-        
-        if not reporter or not reported:
-            continue
-        
+    for report, reporter, reported in reports:
         report_text = (
             f"📝 *Report #{report.id}*\n\n"
             f"*Reporter:* {reporter.full_name} (ID: {reporter.id})\n"
@@ -108,6 +122,9 @@ async def view_reports(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             reply_markup=keyboard
         )
 
+def _banned_users() -> list:
+    return User.query.filter_by(is_banned=True).all()
+
 async def view_banned_users(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Show banned users
@@ -126,7 +143,7 @@ async def view_banned_users(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return
     
     # Get banned users
-    banned_users = User.query.filter_by(is_banned=True).all()
+    banned_users = await run_db(_banned_users)
     
     if not banned_users:
         await update.message.reply_text(
@@ -144,6 +161,43 @@ async def view_banned_users(update: Update, context: ContextTypes.DEFAULT_TYPE)
         parse_mode="Markdown"
     )
 
+def _ban(user_id: int):
+    """
+    Ban a user and end all of their active matches
+    
+    Args:
+        user_id: The ID of the user to ban
+        
+    Returns:
+        A (full_name, telegram_id, peers) tuple, where peers lists the
+        (ID, Telegram ID) of each user whose match was ended, or None if
+        the user was not found
+    """
+    ban_user = User.query.get(user_id)
+    if not ban_user:
+        return None
+    
+    # Ban the user
+    ban_user.is_banned = True
+    db.session.commit()
+    user_removed(ban_user.id)
+    
+    # End all active matches
+    active_matches = Match.for_user(ban_user.id).all()
+    peers = []
+    for match in active_matches:
+        match.is_active = False
+        match.ended_at = datetime.utcnow()
+        other_user = User.query.get(match.peer_id(ban_user.id))
+        if other_user:
+            peers.append((other_user.id, other_user.telegram_id))
+    
+    db.session.commit()
+    chat_sessions.discard(ban_user.telegram_id)
+    for match in active_matches:
+        chat_sessions.discard_match(match.id)
+    return ban_user.full_name, ban_user.telegram_id, peers
+
 async def ban_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Ban a user
@@ -170,61 +224,49 @@ async def ban_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     
     user_id = int(context.args[0])
     
-    # Get the user to ban
-    ban_user = User.query.get(user_id)
-    if not ban_user:
+    # Ban the user and end their matches
+    banned = await run_db(_ban, user_id)
+    if not banned:
         await update.message.reply_text(
             f"User with ID {user_id} not found."
         )
         return
+    full_name, telegram_id, peers = banned
     
-    # Ban the user
-    ban_user.is_banned = True
-    db.session.commit()
-    
-    # End all active matches
-    active_matches = Match.query.filter(
-        (
-            (Match.user1_id == ban_user.id) | 
-            (Match.user2_id == ban_user.id)
-        ),
-        Match.is_active == True
-    ).all()
-    
-    for match in active_matches:
-        match.is_active = False
-        match.ended_at = datetime.utcnow()
-        
-        # Notify the other user
-        other_user_id = match.user2_id if match.user1_id == ban_user.id else match.user1_id
-        other_user = User.query.get(other_user_id)
-        
-        if other_user:
-            try:
-                await context.bot.send_message(
-                    chat_id=other_user.telegram_id,
-                    text=f"Your match with {ban_user.full_name} has been ended "
-                         f"because they have been banned from the service."
-                )
-            except Exception as e:
-                logger.error(f"Failed to notify user {other_user.id}: {e}")
-    
-    db.session.commit()
+    # Notify the other users
+    for other_user_id, other_telegram_id in peers:
+        try:
+            await context.bot.send_message(
+                chat_id=other_telegram_id,
+                text=f"Your match with {full_name} has been ended "
+                     f"because they have been banned from the service."
+            )
+        except Exception as e:
+            logger.error(f"Failed to notify user {other_user_id}: {e}")
     
     # Notify the banned user
     try:
         await context.bot.send_message(
-            chat_id=ban_user.telegram_id,
+            chat_id=telegram_id,
             text="You have been banned from using this service due to a violation of our terms. "
                  "If you believe this is a mistake, please contact an administrator."
         )
     except Exception as e:
-        logger.error(f"Failed to notify banned user {ban_user.id}: {e}")
+        logger.error(f"Failed to notify banned user {user_id}: {e}")
     
     await update.message.reply_text(
-        f"✅ User {ban_user.full_name} (ID: {ban_user.id}) has been banned."
+        f"✅ User {full_name} (ID: {user_id}) has been banned."
     )
 
+def _unban(user_id: int):
+    unban_user = User.query.get(user_id)
+    if not unban_user:
+        return None
+    unban_user.is_banned = False
+    db.session.commit()
+    user_changed(unban_user)
+    return unban_user.full_name, unban_user.telegram_id
+
 async def unban_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Unban a user
@@ -251,31 +293,60 @@ async def unban_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     
     user_id = int(context.args[0])
     
-    # Get the user to unban
-    unban_user = User.query.get(user_id)
-    if not unban_user:
+    # Unban the user
+    unbanned = await run_db(_unban, user_id)
+    if not unbanned:
         await update.message.reply_text(
             f"User with ID {user_id} not found."
         )
         return
-    
-    # Unban the user
-    unban_user.is_banned = False
-    db.session.commit()
+    full_name, telegram_id = unbanned
     
     # Notify the unbanned user
     try:
         await context.bot.send_message(
-            chat_id=unban_user.telegram_id,
+            chat_id=telegram_id,
             text="Your account has been unbanned. You can now use all features of the service again."
         )
     except Exception as e:
-        logger.error(f"Failed to notify unbanned user {unban_user.id}: {e}")
+        logger.error(f"Failed to notify unbanned user {user_id}: {e}")
     
     await update.message.reply_text(
-        f"✅ User {unban_user.full_name} (ID: {unban_user.id}) has been unbanned."
+        f"✅ User {full_name} (ID: {user_id}) has been unbanned."
     )
 
+def _start_report(telegram_id: int, reported_user_id: int):
+    """
+    Put a user in report state for another user
+    
+    Args:
+        telegram_id: The Telegram ID of the reporter
+        reported_user_id: The ID of the reported user
+        
+    Returns:
+        The reported user's name, or None if either user was not found
+    """
+    # Get the users
+    reporter = User.by_telegram_id(telegram_id)
+    reported = User.query.get(reported_user_id)
+    if not reporter or not reported:
+        return None
+    
+    # Update user state
+    user_state = UserState.by_telegram_id(telegram_id)
+    if user_state:
+        user_state.state = STATES["REPORT"]
+        user_state.data = {"reported_user_id": reported_user_id}
+    else:
+        user_state = UserState(
+            telegram_id=telegram_id,
+            state=STATES["REPORT"],
+            data={"reported_user_id": reported_user_id}
+        )
+        db.session.add(user_state)
+    db.session.commit()
+    return reported.full_name
+
 async def handle_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """
     Handle a user report
@@ -294,11 +365,9 @@ async def handle_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     data = query.data  # report_user_<user_id>
     reported_user_id = int(data.split('_')[-1])
     
-    # Get the users
-    reporter = User.query.filter_by(telegram_id=user.id).first()
-    reported = User.query.get(reported_user_id)
-    
-    if not reporter or not reported:
+    # Check the users and put the reporter in report state
+    reported_name = await run_db(_start_report, user.id, reported_user_id)
+    if not reported_name:
         await query.edit_message_text(
             "Error: User not found."
         )
@@ -307,74 +376,42 @@ async def handle_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     # Store the reported user ID in context
     context.user_data['reported_user_id'] = reported_user_id
     
-    # Update user state
-    user_state = UserState.query.filter_by(telegram_id=user.id).first()
-    if user_state:
-        user_state.state = STATES["REPORT"]
-        user_state.data = {"reported_user_id": reported_user_id}
-        db.session.commit()
-    else:
-        user_state = UserState(
-            telegram_id=user.id,
-            state=STATES["REPORT"],
-            data={"reported_user_id": reported_user_id}
-        )
-        db.session.add(user_state)
-        db.session.commit()
-    
     await query.edit_message_text(
-        f"You are reporting {reported.full_name}.\n"
+        f"You are reporting {reported_name}.\n"
         "Please provide a reason for your report.\n\n"
         "Be specific and provide details about what happened."
     )
     
     return STATE_IDS["REPORT_REASON"]
 
-async def process_report_reason(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+def _file_report(telegram_id: int, reason: str) -> tuple:
     """
-    Process the reason for a user report
+    Store a report for the user the reporter chose and reset their state
     
     Args:
-        update: The update object
-        context: The context object
+        telegram_id: The Telegram ID of the reporter
+        reason: The reason given for the report
         
     Returns:
-        The next state in the conversation
+        A (users, error) tuple; users is (reporter_id, reporter_name,
+        reported_id, reported_name), error is a message for the user when
+        the report cannot be filed, and users is None then
     """
-    user = update.effective_user
-    reason = update.message.text.strip()
-    
-    # Check if reason is too short
-    if len(reason) < 10:
-        await update.message.reply_text(
-            "Please provide a more detailed reason for your report."
-        )
-        return STATE_IDS["REPORT_REASON"]
-    
     # Get user state
-    user_state = UserState.query.filter_by(telegram_id=user.id).first()
+    user_state = UserState.by_telegram_id(telegram_id)
     if not user_state or user_state.state != STATES["REPORT"]:
-        await update.message.reply_text(
-            "Error: Report session not found. Please try again."
-        )
-        return ConversationHandler.END
+        return None, "Error: Report session not found. Please try again."
     
     reported_user_id = user_state.data.get("reported_user_id")
     if not reported_user_id:
-        await update.message.reply_text(
-            "Error: Reported user not found. Please try again."
-        )
-        return ConversationHandler.END
+        return None, "Error: Reported user not found. Please try again."
     
     # Get the users
-    reporter = User.query.filter_by(telegram_id=user.id).first()
+    reporter = User.by_telegram_id(telegram_id)
     reported = User.query.get(reported_user_id)
     
     if not reporter or not reported:
-        await update.message.reply_text(
-            "Error: User not found."
-        )
-        return ConversationHandler.END
+        return None, "Error: User not found."
     
     # Create the report
     report = Report(
@@ -383,12 +420,40 @@ async def process_report_reason(update: Update, context: ContextTypes.DEFAULT_TY
         reason=reason
     )
     db.session.add(report)
-    db.session.commit()
     
     # Reset user state
     user_state.state = STATES["IDLE"]
     user_state.data = {}
     db.session.commit()
+    return (reporter.id, reporter.full_name, reported.id, reported.full_name), None
+
+async def process_report_reason(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """
+    Process the reason for a user report
+    
+    Args:
+        update: The update object
+        context: The context object
+        
+    Returns:
+        The next state in the conversation
+    """
+    user = update.effective_user
+    reason = update.message.text.strip()
+    
+    # Check if reason is too short
+    if len(reason) < 10:
+        await update.message.reply_text(
+            "Please provide a more detailed reason for your report."
+        )
+        return STATE_IDS["REPORT_REASON"]
+    
+    # Store the report and reset the user's state
+    filed, error = await run_db(_file_report, user.id, reason)
+    if error:
+        await update.message.reply_text(error)
+        return ConversationHandler.END
+    reporter_id, reporter_name, reported_id, reported_name = filed
     
     # Notify the user
     await update.message.reply_text(
@@ -404,8 +469,8 @@ async def process_report_reason(update: Update, context: ContextTypes.DEFAULT_TY
                 chat_id=admin_id,
                 text=(
                     f"🚨 *New User Report*\n\n"
-                    f"*Reporter:* {reporter.full_name} (ID: {reporter.id})\n"
-                    f"*Reported User:* {reported.full_name} (ID: {reported.id})\n"
+                    f"*Reporter:* {reporter_name} (ID: {reporter_id})\n"
+                    f"*Reported User:* {reported_name} (ID: {reported_id})\n"
                     f"*Reason:* {reason}\n"
                 ),
                 parse_mode="Markdown"
@@ -415,6 +480,9 @@ async def process_report_reason(update: Update, context: ContextTypes.DEFAULT_TY
     
     return ConversationHandler.END
 
+def _pending_confessions() -> list:
+    return Confession.query.filter_by(is_approved=False, is_posted=False).all()
+
 async def view_pending_confessions(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Show pending confessions for approval
@@ -433,7 +501,7 @@ async def view_pending_confessions(update: Update, context: ContextTypes.DEFAULT
         return
     
     # Get pending confessions
-    pending_confessions = Confession.query.filter_by(is_approved=False, is_posted=False).all()
+    pending_confessions = await run_db(_pending_confessions)
     
     if not pending_confessions:
         await update.message.reply_text(
@@ -0,0 +1,250 @@
+from datetime import datetime
+from functools import lru_cache
+from sqlalchemy import text
+from app import db
+from models import Message
+from config import ARCHIVE_DIR, MESSAGE_ARCHIVE_AFTER_MONTHS, MESSAGE_PARTITIONS_AHEAD, ARCHIVE_CACHE_SIZE
+import gzip
+import json
+import logging
+import os
+import re
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Monthly partitions are named messages_y<year>m<month>
+PARTITION_NAME = re.compile(r"^messages_y(\d{4})m(\d{2})$")
+ARCHIVE_SUFFIX = ".jsonl.gz"
+INDEX_SUFFIX = ".index.json"
+ARCHIVED_COLUMNS = (
+    "id", "match_id", "sender_id", "receiver_id", "content", "media_type", "file_id",
+    "sent_at", "is_read", "relay_failed"
+)
+
+def _add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+def _month_start(moment: datetime) -> datetime:
+    return datetime(moment.year, moment.month, 1)
+
+def partition_name(month: datetime) -> str:
+    """
+    Get the name of the partition holding a month's messages
+
+    Args:
+        month: Any moment in the month
+
+    Returns:
+        The partition table name
+    """
+    return f"messages_y{month.year:04d}m{month.month:02d}"
+
+def _is_partitioned() -> bool:
+    if db.engine.dialect.name != "postgresql":
+        return False
+    return bool(db.session.execute(text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'messages'::regclass"
+    )).first())
+
+def _relation_exists(name: str) -> bool:
+    return db.session.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name}).scalar()
+
+def create_partition(month: datetime) -> None:
+    """
+    Create the partition for one month if it does not exist yet
+
+    Messages of the month that already landed in messages_default are moved
+    into the new partition, since PostgreSQL refuses to add a partition whose
+    rows sit in the default one. The caller commits.
+
+    Args:
+        month: Any moment in the month
+    """
+    start = _month_start(month)
+    name = partition_name(start)
+    bounds = f"FROM ('{start:%Y-%m-%d}') TO ('{_add_months(start, 1):%Y-%m-%d}')"
+    # Serialize with other processes preparing partitions at the same time
+    db.session.execute(text("SELECT pg_advisory_xact_lock(hashtext('messages_partitions'))"))
+    if _relation_exists(name):
+        return
+    if not _relation_exists("messages_default"):
+        db.session.execute(text(f"CREATE TABLE {name} PARTITION OF messages FOR VALUES {bounds}"))
+        return
+
+    # Build the partition as a plain table, move the month's rows out of the
+    # default partition and attach it once the ranges no longer overlap
+    db.session.execute(text(f"CREATE TABLE {name} (LIKE messages INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    moved = db.session.execute(text(f"""
+        WITH moved AS (
+            DELETE FROM messages_default
+            WHERE sent_at >= :start AND sent_at < :end
+            RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """), {"start": start, "end": _add_months(start, 1)}).rowcount
+    db.session.execute(text(f"ALTER TABLE messages ATTACH PARTITION {name} FOR VALUES {bounds}"))
+    if moved:
+        logger.info(f"Moved {moved} messages from messages_default into {name}")
+
+def ensure_partitions(months_ahead: int = MESSAGE_PARTITIONS_AHEAD) -> None:
+    """
+    Create the partitions for the current month and the next few months
+
+    Does nothing unless the messages table is partitioned, so plain
+    databases (e.g. SQLite in development) keep working. A partition that
+    cannot be created is logged and skipped; its messages go to the default
+    partition until a later run creates it.
+
+    Args:
+        months_ahead: How many months after the current one to prepare
+    """
+    if not _is_partitioned():
+        return
+
+    this_month = _month_start(datetime.utcnow())
+    for offset in range(months_ahead + 1):
+        month = _add_months(this_month, offset)
+        try:
+            create_partition(month)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Failed to create partition {partition_name(month)}: {e}")
+    # Catches rows outside every monthly range so inserts never fail
+    db.session.execute(text("CREATE TABLE IF NOT EXISTS messages_default PARTITION OF messages DEFAULT"))
+    db.session.commit()
+
+def _monthly_partitions() -> list:
+    rows = db.session.execute(text("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = 'messages'
+    """)).scalars().all()
+    partitions = []
+    for name in rows:
+        found = PARTITION_NAME.match(name)
+        if found:
+            partitions.append((datetime(int(found.group(1)), int(found.group(2)), 1), name))
+    return sorted(partitions)
+
+def _export_partition(name: str) -> int:
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    archive_path = os.path.join(ARCHIVE_DIR, name + ARCHIVE_SUFFIX)
+    index_path = os.path.join(ARCHIVE_DIR, name + INDEX_SUFFIX)
+    counts = {}
+
+    rows = db.session.execute(
+        text(f"SELECT {', '.join(ARCHIVED_COLUMNS)} FROM {name} ORDER BY match_id, sent_at, id"),
+        execution_options={"stream_results": True, "yield_per": 1000}
+    )
+    # Write under temporary names so a crash never leaves a partial archive
+    with gzip.open(archive_path + ".tmp", "wt", encoding="utf-8") as archive:
+        for row in rows.mappings():
+            record = dict(row)
+            record["sent_at"] = record["sent_at"].isoformat()
+            archive.write(json.dumps(record, ensure_ascii=False) + "\n")
+            counts[record["match_id"]] = counts.get(record["match_id"], 0) + 1
+    with open(index_path + ".tmp", "w") as index:
+        json.dump({str(match_id): count for match_id, count in counts.items()}, index)
+
+    os.replace(index_path + ".tmp", index_path)
+    os.replace(archive_path + ".tmp", archive_path)
+    return sum(counts.values())
+
+def archive_old_partitions(after_months: int = MESSAGE_ARCHIVE_AFTER_MONTHS) -> list:
+    """
+    Export old monthly partitions to gzipped JSONL files and drop them
+
+    Args:
+        after_months: Partitions for months that ended more than this many
+            months ago are archived
+
+    Returns:
+        The names of the archived partitions
+    """
+    if not _is_partitioned():
+        logger.warning("The messages table is not partitioned; nothing to archive")
+        return []
+
+    cutoff = _add_months(_month_start(datetime.utcnow()), -after_months)
+    archived = []
+    for month, name in _monthly_partitions():
+        if _add_months(month, 1) > cutoff:
+            break
+        count = _export_partition(name)
+        db.session.execute(text(f"ALTER TABLE messages DETACH PARTITION {name}"))
+        db.session.execute(text(f"DROP TABLE {name}"))
+        db.session.commit()
+        logger.info(f"Archived {count} messages from {name}")
+        archived.append(name)
+    return archived
+
+def _archive_names() -> tuple:
+    if not os.path.isdir(ARCHIVE_DIR):
+        return ()
+    return tuple(sorted(
+        name[:-len(ARCHIVE_SUFFIX)] for name in os.listdir(ARCHIVE_DIR) if name.endswith(ARCHIVE_SUFFIX)
+    ))
+
+@lru_cache(maxsize=8)
+def _archived_matches(names: tuple) -> dict:
+    # Match IDs present in each archive, from the small index files
+    matches = {}
+    for name in names:
+        try:
+            with open(os.path.join(ARCHIVE_DIR, name + INDEX_SUFFIX)) as index:
+                matches[name] = {int(match_id) for match_id in json.load(index)}
+        except OSError:
+            matches[name] = None  # No index; the archive has to be scanned
+    return matches
+
+def has_archive(match_id: int) -> bool:
+    """
+    Check whether any of a match's messages have been archived
+
+    Args:
+        match_id: The ID of the match
+
+    Returns:
+        True if at least one archive holds messages of the match
+    """
+    return any(
+        members is None or match_id in members
+        for members in _archived_matches(_archive_names()).values()
+    )
+
+@lru_cache(maxsize=ARCHIVE_CACHE_SIZE)
+def _load_archived(match_id: int, names: tuple) -> tuple:
+    messages = []
+    for name, members in _archived_matches(names).items():
+        if members is not None and match_id not in members:
+            continue
+        with gzip.open(os.path.join(ARCHIVE_DIR, name + ARCHIVE_SUFFIX), "rt", encoding="utf-8") as archive:
+            for line in archive:
+                record = json.loads(line)
+                if record["match_id"] != match_id:
+                    continue
+                record["sent_at"] = datetime.fromisoformat(record["sent_at"])
+                messages.append(Message(**record))
+    messages.sort(key=lambda message: (message.sent_at, message.id))
+    return tuple(messages)
+
+def archived_messages(match_id: int) -> tuple:
+    """
+    Load a match's archived messages, oldest first
+
+    The result is cached, so paging through old history reads each archive
+    file only once. The returned Message objects are not attached to the
+    database session.
+
+    Args:
+        match_id: The ID of the match
+
+    Returns:
+        A tuple of Message objects
+    """
+    return _load_archived(match_id, _archive_names())
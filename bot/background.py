@@ -0,0 +1,159 @@
+from telegram.ext import Application
+from app import app, db
+from bot.db_pool import run_db
+from config import DEAD_LETTER_DIR
+import asyncio
+import atexit
+import json
+import logging
+import os
+import threading
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Registered write-behind flushers: (name, flush function, interval in seconds, after-flush hook)
+_flushers = []
+_tasks = []
+# Events that wake a flusher before its interval is up, by flusher name
+_wakeups = {}
+_bot_app = None
+# The loop the flush tasks run on; their wakeup events may only be set from it
+_loop = None
+_dead_letter_lock = threading.Lock()
+
+# Longest wait between retries of a flusher whose writes keep failing
+MAX_RETRY_DELAY = 60
+
+def register_flusher(name: str, flush, interval: float, after_flush=None) -> None:
+    """
+    Register a write-behind buffer to be flushed periodically and on shutdown
+
+    Args:
+        name: A short name used in log messages
+        flush: A synchronous function that persists buffered state
+        interval: Seconds between periodic flushes
+        after_flush: Optional coroutine function called with the bot
+            application after each flush, e.g. to send notifications
+    """
+    _flushers.append((name, flush, interval, after_flush))
+
+def flush_soon(name: str) -> None:
+    """
+    Ask a flusher to run now instead of waiting for its interval
+
+    Safe to call from any thread, e.g. from a unit of work on the database
+    threads.
+
+    Args:
+        name: The name the flusher was registered with
+    """
+    wakeup = _wakeups.get(name)
+    if wakeup is None:
+        return
+    try:
+        # asyncio.Event is not thread-safe, so set it on its own loop
+        _loop.call_soon_threadsafe(wakeup.set)
+    except RuntimeError:
+        pass  # The loop has closed; the final flush_all picks the rows up
+
+def dead_letter(name: str, rows: list, reason: str) -> None:
+    """
+    Save buffered rows that are being given up on, so they can be replayed by hand
+
+    Rows are appended as JSON lines to a file per flusher in DEAD_LETTER_DIR.
+    If that fails too, the rows are written to the log instead.
+
+    Args:
+        name: The name the flusher was registered with
+        rows: The rows being dropped, as dicts
+        reason: Why they are dropped, for the log
+    """
+    if not rows:
+        return
+    path = os.path.join(DEAD_LETTER_DIR, name.replace(" ", "_") + ".jsonl")
+    logger.error(f"Dropping {len(rows)} buffered {name} after {reason}; saving them to {path}")
+    try:
+        with _dead_letter_lock:
+            os.makedirs(DEAD_LETTER_DIR, exist_ok=True)
+            with open(path, "a", encoding="utf-8") as dead_letters:
+                for row in rows:
+                    dead_letters.write(json.dumps(row, default=str, ensure_ascii=False) + "\n")
+    except OSError as e:
+        logger.error(f"Could not save dropped {name} ({e}): {rows}")
+
+def _flush_safely(name: str, flush) -> None:
+    with app.app_context():
+        try:
+            flush()
+        except Exception as e:
+            logger.error(f"Error flushing {name}: {e}")
+            db.session.rollback()
+
+async def _after_flush_safely(name: str, after_flush) -> None:
+    if after_flush is None or _bot_app is None:
+        return
+    with app.app_context():
+        try:
+            await after_flush(_bot_app)
+        except Exception as e:
+            logger.error(f"Error after flushing {name}: {e}")
+
+async def _flush_periodically(name: str, flush, interval: float, after_flush) -> None:
+    wakeup = _wakeups[name]
+    failures = 0
+    while True:
+        try:
+            await asyncio.wait_for(wakeup.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+        wakeup.clear()
+        # Flushes run on the database threads so they never block the event loop
+        try:
+            await run_db(flush)
+            failures = 0
+        except Exception as e:
+            failures += 1
+            logger.error(f"Error flushing {name} ({failures} in a row): {e}")
+        await _after_flush_safely(name, after_flush)
+        if failures:
+            # Back off while the database keeps failing; a full buffer's
+            # wakeups would otherwise retry it as fast as they arrive
+            await asyncio.sleep(min(interval * 2 ** failures, MAX_RETRY_DELAY))
+
+def start_background_tasks(bot_app: Application) -> None:
+    """
+    Start the periodic flush task of every registered buffer
+
+    Args:
+        bot_app: The running bot application
+    """
+    global _bot_app, _loop
+    if _tasks:
+        return
+
+    _bot_app = bot_app
+    _loop = asyncio.get_running_loop()
+    for name, flush, interval, after_flush in _flushers:
+        _wakeups[name] = asyncio.Event()
+        _tasks.append(bot_app.create_task(_flush_periodically(name, flush, interval, after_flush)))
+    logger.info(f"Started {len(_tasks)} background flush tasks")
+
+async def stop_background_tasks() -> None:
+    """Cancel the periodic tasks and flush every buffer one last time"""
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
+    _wakeups.clear()
+    flush_all()
+    for name, _, _, after_flush in _flushers:
+        await _after_flush_safely(name, after_flush)
+
+def flush_all() -> None:
+    """Flush every registered buffer synchronously"""
+    for name, flush, _, _ in _flushers:
+        _flush_safely(name, flush)
+
+# Make sure buffered writes reach the database when the process exits
+atexit.register(flush_all)
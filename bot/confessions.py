@@ -2,6 +2,7 @@ import re
 from telegram import Update
 from telegram.ext import ContextTypes, ConversationHandler
 from app import db
+from bot.db_pool import run_db
 from models import User, Confession, BannedWord, UserState
 from config import STATES, STATE_IDS, CONFESSION_CHANNEL_ID, REQUIRE_CONFESSION_APPROVAL
 import logging
@@ -9,6 +10,20 @@ import logging
 # Initialize logger
 logger = logging.getLogger(__name__)
 
+def _enter_confession(telegram_id: int) -> None:
+    user_state = UserState.by_telegram_id(telegram_id)
+    if user_state:
+        user_state.state = STATES["CONFESSION"]
+        db.session.commit()
+    else:
+        user_state = UserState(
+            telegram_id=telegram_id,
+            state=STATES["CONFESSION"],
+            data={}
+        )
+        db.session.add(user_state)
+        db.session.commit()
+
 async def confess_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """
     Start the confession submission process
@@ -23,7 +38,7 @@ async def confess_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     user = update.effective_user
     
     # Check if user is registered
-    db_user = User.query.filter_by(telegram_id=user.id).first()
+    db_user = await run_db(User.by_telegram_id, user.id)
     if not db_user or not db_user.registration_complete:
         await update.message.reply_text(
             "You need to complete your registration first.\n"
@@ -39,18 +54,7 @@ async def confess_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return ConversationHandler.END
     
     # Update user state
-    user_state = UserState.query.filter_by(telegram_id=user.id).first()
-    if user_state:
-        user_state.state = STATES["CONFESSION"]
-        db.session.commit()
-    else:
-        user_state = UserState(
-            telegram_id=user.id,
-            state=STATES["CONFESSION"],
-            data={}
-        )
-        db.session.add(user_state)
-        db.session.commit()
+    await run_db(_enter_confession, user.id)
     
     await update.message.reply_text(
         "💌 *UniMatchConfessions*\n\n"
@@ -63,6 +67,37 @@ async def confess_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     return STATE_IDS["CONFESSION_TEXT"]
 
+def _save_confession(telegram_id: int, content: str):
+    """
+    Store a confession and put its author back in idle state
+    
+    Args:
+        telegram_id: The Telegram ID of the author
+        content: The filtered confession text
+        
+    Returns:
+        The ID of the new confession, or None if the author is not registered
+    """
+    # Get the user from the database
+    db_user = User.by_telegram_id(telegram_id)
+    if not db_user:
+        return None
+    
+    # Create the confession in the database
+    confession = Confession(
+        user_id=db_user.id,
+        content=content,
+        is_approved=not REQUIRE_CONFESSION_APPROVAL  # Auto-approve if not requiring approval
+    )
+    db.session.add(confession)
+    
+    # Update user state
+    user_state = UserState.by_telegram_id(telegram_id)
+    if user_state:
+        user_state.state = STATES["IDLE"]
+    db.session.commit()
+    return confession.id
+
 async def process_confession_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """
     Process the confession text submitted by the user
@@ -90,35 +125,20 @@ async def process_confession_text(update: Update, context: ContextTypes.DEFAULT_
         )
         return STATE_IDS["CONFESSION_TEXT"]
     
-    # Get the user from the database
-    db_user = User.query.filter_by(telegram_id=user.id).first()
-    if not db_user:
+    # Filter offensive words
+    filtered_text = await filter_offensive_words(confession_text)
+    
+    # Store the confession and leave confession state
+    confession_id = await run_db(_save_confession, user.id, filtered_text)
+    if confession_id is None:
         await update.message.reply_text(
             "Error: Your user profile was not found. Please use /start to register."
         )
         return ConversationHandler.END
     
-    # Filter offensive words
-    filtered_text = await filter_offensive_words(confession_text)
-    
-    # Create the confession in the database
-    confession = Confession(
-        user_id=db_user.id,
-        content=filtered_text,
-        is_approved=not REQUIRE_CONFESSION_APPROVAL  # Auto-approve if not requiring approval
-    )
-    db.session.add(confession)
-    db.session.commit()
-    
-    # Update user state
-    user_state = UserState.query.filter_by(telegram_id=user.id).first()
-    if user_state:
-        user_state.state = STATES["IDLE"]
-        db.session.commit()
-    
     # Post to channel if auto-approved
     if not REQUIRE_CONFESSION_APPROVAL:
-        await post_confession_to_channel(context, confession)
+        await post_confession_to_channel(context, confession_id, filtered_text)
         await update.message.reply_text(
             "✅ *Success!* Your confession has been posted anonymously to the UniMatchConfessions channel.\n"
             "Thank you for sharing your thoughts with the Ethiopian university community! 💭",
@@ -134,6 +154,15 @@ async def process_confession_text(update: Update, context: ContextTypes.DEFAULT_
     
     return ConversationHandler.END
 
+def _banned_words() -> list:
+    banned_words = BannedWord.query.all()
+    
+    # If no banned words in DB, use the default list
+    if not banned_words:
+        from config import DEFAULT_BANNED_WORDS
+        return DEFAULT_BANNED_WORDS
+    return [word.word for word in banned_words]
+
 async def filter_offensive_words(text: str) -> str:
     """
     Filter offensive words from the confession text
@@ -145,14 +174,7 @@ async def filter_offensive_words(text: str) -> str:
         The filtered text
     """
     # Get banned words from the database
-    banned_words = BannedWord.query.all()
-    
-    # If no banned words in DB, use the default list
-    if not banned_words:
-        from config import DEFAULT_BANNED_WORDS
-        banned_words_list = DEFAULT_BANNED_WORDS
-    else:
-        banned_words_list = [word.word for word in banned_words]
+    banned_words_list = await run_db(_banned_words)
     
     # Replace offensive words with asterisks
     filtered_text = text
@@ -164,13 +186,21 @@ async def filter_offensive_words(text: str) -> str:
     
     return filtered_text
 
-async def post_confession_to_channel(context: ContextTypes.DEFAULT_TYPE, confession: Confession) -> None:
+def _mark_posted(confession_id: int, message_id: int) -> None:
+    confession = Confession.query.get(confession_id)
+    if confession:
+        confession.is_posted = True
+        confession.channel_message_id = message_id
+        db.session.commit()
+
+async def post_confession_to_channel(context: ContextTypes.DEFAULT_TYPE, confession_id: int, content: str) -> None:
     """
     Post a confession to the channel
     
     Args:
         context: The context object
-        confession: The confession to post
+        confession_id: The ID of the confession to post
+        content: The confession text
     """
     if not CONFESSION_CHANNEL_ID:
         logger.error("CONFESSION_CHANNEL_ID not set, cannot post confession")
@@ -179,20 +209,40 @@ async def post_confession_to_channel(context: ContextTypes.DEFAULT_TYPE, confess
     try:
         message = await context.bot.send_message(
             chat_id=CONFESSION_CHANNEL_ID,
-            text=f"💌 *UniMatchConfessions #{confession.id}*\n\n{confession.content}\n\n"
+            text=f"💌 *UniMatchConfessions #{confession_id}*\n\n{content}\n\n"
                  f"🎓 _Share your own thoughts anonymously through the @UniMatch_Ethiopia bot_",
             parse_mode="Markdown"
         )
         
         # Update confession with message ID
-        confession.is_posted = True
-        confession.channel_message_id = message.message_id
-        db.session.commit()
+        await run_db(_mark_posted, confession_id, message.message_id)
         
-        logger.info(f"Posted confession #{confession.id} to channel")
+        logger.info(f"Posted confession #{confession_id} to channel")
     except Exception as e:
         logger.error(f"Failed to post confession to channel: {e}")
 
+def _review_confession(confession_id: int, approve: bool):
+    """
+    Approve a confession, or delete it when rejected
+    
+    Args:
+        confession_id: The ID of the confession
+        approve: Whether the confession was approved
+        
+    Returns:
+        The confession text, or None if the confession was not found
+    """
+    confession = Confession.query.get(confession_id)
+    if not confession:
+        return None
+    content = confession.content
+    if approve:
+        confession.is_approved = True
+    else:
+        db.session.delete(confession)
+    db.session.commit()
+    return content
+
 async def handle_confession(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Admin function to approve or reject a confession
@@ -218,29 +268,23 @@ async def handle_confession(update: Update, context: ContextTypes.DEFAULT_TYPE)
     action, _, confession_id = data.split('_', 2)
     confession_id = int(confession_id)
     
-    # Get the confession from the database
-    confession = Confession.query.get(confession_id)
-    if not confession:
+    # Approve or delete the confession in the database
+    content = await run_db(_review_confession, confession_id, action == "approve")
+    if content is None:
         await query.edit_message_text(
             "Error: Confession not found."
         )
         return
     
     if action == "approve":
-        confession.is_approved = True
-        db.session.commit()
-        
         # Post to channel
-        await post_confession_to_channel(context, confession)
+        await post_confession_to_channel(context, confession_id, content)
         
         await query.edit_message_text(
             f"✅ Confession #{confession_id} approved and posted to UniMatchConfessions channel.\n\n"
             f"Thank you for helping maintain a positive community experience!"
         )
     else:  # reject
-        db.session.delete(confession)
-        db.session.commit()
-        
         await query.edit_message_text(
             f"❌ Confession #{confession_id} rejected and deleted.\n\n"
             f"Thank you for helping maintain a positive community experience!"
@@ -0,0 +1,63 @@
+from concurrent.futures import ThreadPoolExecutor
+from app import app, db, async_engine, async_session
+from config import DB_POOL_SIZE
+import asyncio
+import functools
+import logging
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Threads that run database work for the bot; the engine's connection pool is sized to match in app.py
+_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
+
+def _unit_of_work(fn, args, kwargs):
+    # A fresh app context gives the unit its own session, removed when the context ends
+    with app.app_context():
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            db.session.rollback()
+            raise
+
+def _async_unit_of_work(session, fn, args, kwargs):
+    # Runs inside AsyncSession.run_sync; db.session is pointed at the async
+    # session's sync facade, whose queries are awaited on the event loop
+    with app.app_context():
+        db.session.registry.set(session)
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            session.rollback()
+            raise
+
+async def run_db(fn, *args, **kwargs):
+    """
+    Run blocking database work off the event loop and wait for it
+
+    The function runs as one unit of work with its own session, so a slow
+    query only holds up the update that issued it instead of the whole
+    event loop. With DB_MODE "async" it runs on the event loop through an
+    asyncpg AsyncSession, otherwise on the database thread pool. It must
+    commit its own writes; anything left uncommitted is rolled back. ORM
+    objects it returns are detached: their loaded columns can be read, but
+    lazy relationships cannot be loaded and changes to them are not saved.
+
+    Args:
+        fn: A synchronous function that uses the Flask-SQLAlchemy session
+        *args: Positional arguments for fn
+        **kwargs: Keyword arguments for fn
+
+    Returns:
+        Whatever fn returns
+    """
+    if async_session is not None:
+        async with async_session() as session:
+            return await session.run_sync(_async_unit_of_work, fn, args, kwargs)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(_unit_of_work, fn, args, kwargs))
+
+async def close_db() -> None:
+    """Close the async engine's connections, which belong to the running event loop"""
+    if async_engine is not None:
+        await async_engine.dispose()
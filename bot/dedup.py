@@ -0,0 +1,135 @@
+from collections import deque
+from datetime import datetime
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+from app import app, db
+from models import UpdateMark
+from bot.background import register_flusher
+from config import DEDUP_WINDOW, DEDUP_PERSIST, DEDUP_FLUSH_INTERVAL
+import logging
+import threading
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+class UpdateDeduplicator:
+    """
+    Drops updates Telegram delivers more than once, by update_id
+
+    The last DEDUP_WINDOW update IDs are kept in a ring buffer. With
+    DEDUP_PERSIST the highest update ID taken is also written to the
+    update_marks table, and on startup every ID up to the stored mark counts
+    as a duplicate, which catches redeliveries after a restart. Telegram
+    numbers updates sequentially, but webhook deliveries can overtake each
+    other, so an update still in flight at shutdown may be dropped as well.
+    """
+
+    def __init__(self, window: int = DEDUP_WINDOW, persist: bool = DEDUP_PERSIST):
+        self.window = window
+        self.persist = persist
+        self._lock = threading.Lock()
+        self._recent = deque()
+        self._seen = set()
+        self.bot_id = None
+        # IDs up to here were taken before this process started
+        self.low_water = 0
+        self.high_water = 0
+        self._stored = 0
+        self.accepted = 0
+        self.duplicates = 0
+
+    def load(self, bot_id: int) -> None:
+        """
+        Load the bot's stored high-water mark, if persistence is enabled
+
+        Args:
+            bot_id: The bot's user ID, the part of the token before the colon
+        """
+        self.bot_id = bot_id
+        if not self.persist:
+            return
+        with app.app_context():
+            last_update_id = db.session.query(UpdateMark.last_update_id).filter_by(bot_id=bot_id).scalar()
+        if last_update_id is not None:
+            with self._lock:
+                self.low_water = self._stored = last_update_id
+                self.high_water = max(self.high_water, last_update_id)
+            logger.info(f"Dropping updates up to {last_update_id}, taken before the restart")
+
+    def claim(self, update_id: int) -> bool:
+        """
+        Record an update ID unless it has been taken before
+
+        Args:
+            update_id: The update's update_id
+
+        Returns:
+            True if the update is new and should be processed, False if it is a duplicate
+        """
+        with self._lock:
+            if update_id <= self.low_water or update_id in self._seen:
+                self.duplicates += 1
+                return False
+            self._seen.add(update_id)
+            self._recent.append(update_id)
+            if len(self._recent) > self.window:
+                self._seen.discard(self._recent.popleft())
+            self.high_water = max(self.high_water, update_id)
+            self.accepted += 1
+            return True
+
+    def release(self, update_id: int) -> None:
+        """
+        Forget a claimed update ID, e.g. because the update was refused and Telegram will send it again
+
+        Args:
+            update_id: The update's update_id
+        """
+        with self._lock:
+            if update_id not in self._seen:
+                return
+            self._seen.discard(update_id)
+            self._recent.remove(update_id)
+            self.accepted -= 1
+
+    def stats(self) -> dict:
+        """
+        Get the deduplication counters
+
+        Returns:
+            A dict with the accepted and duplicate counts and the high-water mark
+        """
+        with self._lock:
+            return {
+                "accepted": self.accepted,
+                "duplicates": self.duplicates,
+                "high_water": self.high_water,
+            }
+
+    def flush(self) -> None:
+        """Store the high-water mark if it moved since the last flush"""
+        if not self.persist or self.bot_id is None:
+            return
+        with self._lock:
+            high_water = self.high_water
+        if high_water <= self._stored:
+            return
+
+        statement = insert(UpdateMark.__table__).values(
+            bot_id=self.bot_id, last_update_id=high_water, updated_at=datetime.utcnow()
+        )
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=[UpdateMark.bot_id],
+            set_={
+                "last_update_id": func.greatest(
+                    UpdateMark.__table__.c.last_update_id, statement.excluded.last_update_id
+                ),
+                "updated_at": statement.excluded.updated_at,
+            }
+        ))
+        db.session.commit()
+        self._stored = high_water
+
+# Shared deduplicator for the bot process
+update_deduplicator = UpdateDeduplicator()
+register_flusher("update marks", update_deduplicator.flush, DEDUP_FLUSH_INTERVAL)
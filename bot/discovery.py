@@ -0,0 +1,675 @@
+from collections import OrderedDict, deque
+from sqlalchemy import Integer, all_, exists, func, literal, select
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import aliased
+from app import db
+from models import User, Like, University
+from bot.seen import is_skipped, skip_store
+from bot.likes import like_buffer
+from bot import ranking
+from bot.db_pool import run_db
+from config import (
+    ENABLE_DISCOVERY_INDEX, DISCOVERY_SAMPLE_ATTEMPTS, DISCOVERY_SEEN_CACHE_SIZE,
+    DISCOVERY_SAMPLING_STRATEGY, DISCOVERY_TABLESAMPLE_PERCENT,
+    DISCOVERY_DECK_SIZE, DISCOVERY_DECK_REFILL_AT, DISCOVERY_DECK_TTL, DISCOVERY_DECK_MAX_USERS,
+    ENABLE_CANDIDATE_RANKING, RANKING_BATCH_SIZE, RANKING_SAMPLE_PIVOTS
+)
+import logging
+import random
+import threading
+import time
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+class _Bucket:
+    """A set of user IDs that supports O(1) add, discard and indexed access"""
+
+    def __init__(self):
+        self.ids = []
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, user_id: int) -> None:
+        if user_id in self.positions:
+            return
+        self.positions[user_id] = len(self.ids)
+        self.ids.append(user_id)
+
+    def discard(self, user_id: int) -> None:
+        position = self.positions.pop(user_id, None)
+        if position is None:
+            return
+        # Move the last ID into the freed slot so removal stays O(1)
+        last_id = self.ids.pop()
+        if last_id != user_id:
+            self.ids[position] = last_id
+            self.positions[last_id] = position
+
+class DiscoveryIndex:
+    """
+    In-process index of discoverable users
+
+    Eligible user IDs are bucketed by (gender, interested_in, university), with
+    an extra per-(gender, interested_in) bucket spanning every university, so a
+    random candidate can be drawn without loading any ORM rows.
+    """
+
+    def __init__(self, sample_attempts: int = DISCOVERY_SAMPLE_ATTEMPTS,
+                 seen_cache_size: int = DISCOVERY_SEEN_CACHE_SIZE):
+        self.sample_attempts = sample_attempts
+        self.seen_cache_size = seen_cache_size
+        self.loaded = False
+        self._lock = threading.RLock()
+        self._buckets = {}
+        self._members = {}
+        self._seen = OrderedDict()
+
+    @staticmethod
+    def is_discoverable(user: User) -> bool:
+        """
+        Check whether a user may be shown to others in discovery
+
+        Args:
+            user: The user to check
+
+        Returns:
+            True if the user is eligible for discovery, False otherwise
+        """
+        return bool(user.registration_complete and not user.is_banned and user.photo_id)
+
+    @staticmethod
+    def suits(viewer: User, candidate: User) -> bool:
+        """
+        Check whether a candidate fits the viewer's current preferences
+
+        Mirrors the gender and university conditions of the database query.
+
+        Args:
+            viewer: The user who is discovering profiles
+            candidate: The user who would be shown
+
+        Returns:
+            True if the two match each other's gender preference and university filter
+        """
+        return bool(
+            candidate.id != viewer.id
+            and candidate.gender == viewer.interested_in
+            and candidate.interested_in == viewer.gender
+            and (viewer.university == University.ALL_UNIVERSITIES
+                 or candidate.university in (viewer.university, University.ALL_UNIVERSITIES))
+        )
+
+    def load(self) -> None:
+        """Build the index from the database in a single column-only query"""
+        rows = db.session.query(
+            User.id, User.gender, User.interested_in, User.university
+        ).filter(
+            User.registration_complete == True,
+            User.is_banned == False,
+            User.photo_id.isnot(None)
+        ).all()
+
+        with self._lock:
+            self._buckets.clear()
+            self._members.clear()
+            self._seen.clear()
+            for user_id, gender, interested_in, university in rows:
+                self._add(user_id, (gender, interested_in, university))
+            self.loaded = True
+
+        logger.info(f"Discovery index loaded with {len(rows)} users")
+
+    def _add(self, user_id: int, key: tuple) -> None:
+        gender, interested_in, _ = key
+        self._members[user_id] = key
+        self._buckets.setdefault(key, _Bucket()).add(user_id)
+        self._buckets.setdefault((gender, interested_in, None), _Bucket()).add(user_id)
+
+    def _discard(self, user_id: int) -> None:
+        key = self._members.pop(user_id, None)
+        if key is None:
+            return
+        gender, interested_in, _ = key
+        self._buckets[key].discard(user_id)
+        self._buckets[(gender, interested_in, None)].discard(user_id)
+
+    def refresh_user(self, user: User) -> None:
+        """
+        Add, move or remove a user after their profile or status changed
+
+        Args:
+            user: The user whose discovery entry should be refreshed
+        """
+        if not self.loaded:
+            return
+
+        with self._lock:
+            self._discard(user.id)
+            if self.is_discoverable(user):
+                self._add(user.id, (user.gender, user.interested_in, user.university))
+
+    def remove_user(self, user_id: int) -> None:
+        """
+        Remove a user from the index, e.g. after a ban or profile deletion
+
+        Args:
+            user_id: The ID of the user to remove
+        """
+        with self._lock:
+            self._discard(user_id)
+            self._seen.pop(user_id, None)
+
+    def mark_seen(self, viewer_id: int, user_id: int) -> None:
+        """
+        Record that a viewer has liked a user
+
+        Args:
+            viewer_id: The ID of the user who acted
+            user_id: The ID of the user who was liked
+        """
+        with self._lock:
+            seen = self._seen.get(viewer_id)
+            if seen is not None:
+                seen.add(user_id)
+
+    def _seen_ids(self, viewer_id: int) -> set:
+        with self._lock:
+            seen = self._seen.get(viewer_id)
+            if seen is not None:
+                self._seen.move_to_end(viewer_id)
+                return seen
+
+        seen = {
+            liked_user_id for (liked_user_id,) in
+            db.session.query(Like.liked_user_id).filter(Like.user_id == viewer_id)
+        }
+        seen |= like_buffer.pending_for(viewer_id)
+
+        with self._lock:
+            self._seen[viewer_id] = seen
+            while len(self._seen) > self.seen_cache_size:
+                self._seen.popitem(last=False)
+        return seen
+
+    def _candidate_buckets(self, viewer: User) -> list:
+        # Candidates must be of the gender the viewer is interested in and vice versa
+        gender, interested_in = viewer.interested_in, viewer.gender
+        if viewer.university == University.ALL_UNIVERSITIES:
+            keys = [(gender, interested_in, None)]
+        else:
+            keys = [
+                (gender, interested_in, viewer.university),
+                (gender, interested_in, University.ALL_UNIVERSITIES)
+            ]
+        return [self._buckets[key] for key in keys if self._buckets.get(key)]
+
+    def sample(self, viewer: User):
+        """
+        Pick a random candidate the viewer has not liked or skipped yet
+
+        Liked IDs are cached per viewer here; skips are checked against the
+        viewer's skip list in the skip store.
+
+        Sampling is bounded by ``sample_attempts`` draws, so a viewer who has
+        seen nearly the whole pool gets None and should fall back to the
+        database query.
+
+        Args:
+            viewer: The user who is discovering profiles
+
+        Returns:
+            The ID of a candidate user, or None if no candidate was found
+        """
+        if not self.loaded:
+            self.load()
+
+        # Both may hit the database, so load them before taking the index lock
+        seen = self._seen_ids(viewer.id)
+        skipped = skip_store.skipped_ids(viewer.id)
+
+        with self._lock:
+            buckets = self._candidate_buckets(viewer)
+            total = sum(len(bucket) for bucket in buckets)
+            if not total:
+                return None
+
+            for _ in range(self.sample_attempts):
+                # Draw uniformly over the union of the candidate buckets
+                offset = random.randrange(total)
+                for bucket in buckets:
+                    if offset < len(bucket):
+                        break
+                    offset -= len(bucket)
+                candidate_id = bucket.ids[offset]
+                if (candidate_id != viewer.id and candidate_id not in seen
+                        and not is_skipped(skipped, candidate_id)):
+                    return candidate_id
+
+        return None
+
+SAMPLING_STRATEGIES = ("keyset", "tablesample", "full")
+
+def _eligible_query(viewer: User, model=User, ids_only: bool = False, exclude_ids=()):
+    """
+    Build the query for candidates the viewer may be shown
+
+    Candidates:
+    1. Match the viewer's gender preference
+    2. Have the viewer's gender as their preference
+    3. Match the university filter
+    4. Have not been liked or skipped by the viewer
+    5. Have registration complete
+    6. Are not banned
+    7. Have a profile photo
+
+    Args:
+        viewer: The user who is discovering profiles
+        model: The User entity to query, e.g. a TABLESAMPLE alias
+        ids_only: Whether to select only the candidate IDs
+        exclude_ids: Extra user IDs to leave out, e.g. ones already queued
+
+    Returns:
+        The filtered query
+    """
+    # Anti-join against likes; each probe is served by the _user_liked_user_uc
+    # index, so the cost does not grow with the number of profiles swiped
+    already_interacted = exists().where(
+        Like.user_id == viewer.id,
+        Like.liked_user_id == model.id
+    )
+
+    query = db.session.query(model.id if ids_only else model).filter(
+        model.gender == viewer.interested_in,
+        model.interested_in == viewer.gender,
+        model.id != viewer.id,
+        ~already_interacted,
+        model.registration_complete == True,
+        model.is_banned == False,
+        model.photo_id.isnot(None)
+    )
+
+    # University filter (if not "All Universities")
+    if viewer.university != University.ALL_UNIVERSITIES:
+        query = query.filter(
+            model.university.in_([viewer.university, University.ALL_UNIVERSITIES])
+        )
+
+    # Skips live in the viewer's in-memory skip list, which is bound as one
+    # integer[] parameter whatever the number of skips
+    skipped = skip_store.skipped_ids(viewer.id)
+    if skipped:
+        query = query.filter(model.id != all_(literal(skipped.tolist(), ARRAY(Integer))))
+
+    if exclude_ids:
+        query = query.filter(~model.id.in_(list(exclude_ids)))
+
+    return query
+
+def _sample_keyset(viewer: User, limit: int, ids_only: bool, exclude_ids) -> list:
+    # Start an index scan on users.id at a random pivot between the smallest
+    # and largest ID; the pivot is an uncorrelated subquery evaluated once
+    bounds = select(func.min(User.id).label("low"), func.max(User.id).label("high")).subquery()
+    pivot = select(
+        bounds.c.low + func.floor(func.random() * (bounds.c.high - bounds.c.low + 1))
+    ).scalar_subquery()
+
+    candidates = _eligible_query(viewer, ids_only=ids_only, exclude_ids=exclude_ids).filter(
+        User.id >= pivot
+    ).order_by(User.id).limit(limit).all()
+    if len(candidates) < limit:
+        # Wrap around to the start of the ID range
+        found_ids = set(exclude_ids) | {candidate.id for candidate in candidates}
+        candidates += _eligible_query(viewer, ids_only=ids_only, exclude_ids=found_ids).order_by(
+            User.id
+        ).limit(limit - len(candidates)).all()
+    return candidates
+
+def _sample_keyset_spread(viewer: User, limit: int, ids_only: bool, exclude_ids, pivots: int) -> list:
+    # Several shorter keyset scans from independent pivots, so a large batch
+    # covers the whole ID range instead of one run of neighbouring IDs
+    per_pivot = -(-limit // pivots)
+    found_ids = set(exclude_ids)
+    candidates = []
+    for _ in range(pivots):
+        batch = _sample_keyset(viewer, min(per_pivot, limit - len(candidates)), ids_only, found_ids)
+        if not batch:
+            break
+        candidates += batch
+        found_ids |= {candidate.id for candidate in batch}
+        if len(candidates) >= limit:
+            break
+    return candidates
+
+def _sample_tablesample(viewer: User, limit: int, ids_only: bool, exclude_ids) -> list:
+    sampled = aliased(User, User.__table__.tablesample(
+        func.system(DISCOVERY_TABLESAMPLE_PERCENT)
+    ))
+    candidates = _eligible_query(viewer, sampled, ids_only, exclude_ids).order_by(
+        func.random()
+    ).limit(limit).all()
+    if not candidates:
+        # Small or sparse pools can produce empty samples
+        candidates = _sample_keyset(viewer, limit, ids_only, exclude_ids)
+    return candidates
+
+def _sample_full(viewer: User, limit: int, ids_only: bool, exclude_ids) -> list:
+    potential_matches = _eligible_query(viewer, ids_only=ids_only, exclude_ids=exclude_ids).all()
+    return random.sample(potential_matches, min(limit, len(potential_matches)))
+
+def sample_candidates(viewer: User, limit: int = 1, strategy: str = None,
+                      ids_only: bool = False, exclude_ids=(), pivots: int = 1) -> list:
+    """
+    Pick random eligible candidates inside the database
+
+    Strategies:
+    - keyset: scan the primary key index from a random pivot ID; users that
+      follow large ID gaps are slightly more likely to be picked, and a
+      batch is a run of neighbouring IDs unless ``pivots`` is above 1
+    - tablesample: shuffle a SYSTEM TABLESAMPLE of the users table, falling
+      back to keyset when the sample has no eligible rows
+    - full: load the whole candidate pool and choose in Python
+
+    Args:
+        viewer: The user who is discovering profiles
+        limit: The maximum number of candidates to return
+        strategy: One of SAMPLING_STRATEGIES, defaults to the configured one
+        ids_only: Whether to return candidate IDs instead of User rows
+        exclude_ids: Extra user IDs to leave out
+        pivots: How many random pivots the keyset strategy spreads the batch over
+
+    Returns:
+        A list of up to ``limit`` User rows or IDs
+    """
+    strategy = strategy or DISCOVERY_SAMPLING_STRATEGY
+    if strategy == "tablesample":
+        candidates = _sample_tablesample(viewer, limit, ids_only, exclude_ids)
+    elif strategy == "full":
+        candidates = _sample_full(viewer, limit, ids_only, exclude_ids)
+    else:
+        if strategy != "keyset":
+            logger.warning(f"Unknown discovery sampling strategy {strategy!r}, using keyset")
+        if pivots > 1:
+            candidates = _sample_keyset_spread(viewer, limit, ids_only, exclude_ids, pivots)
+        else:
+            candidates = _sample_keyset(viewer, limit, ids_only, exclude_ids)
+
+    if ids_only:
+        return [candidate.id for candidate in candidates]
+    return candidates
+
+class _Deck:
+    """Queue of prefetched candidate IDs for one viewer"""
+
+    def __init__(self, candidate_ids: list, expires_at: float):
+        self.candidate_ids = deque(candidate_ids)
+        self.expires_at = expires_at
+
+class CandidateDeckStore:
+    """
+    Per-viewer decks of prefetched candidate IDs
+
+    Decks are filled with one batched query, then popped on every tap so the
+    per-tap cost is a deque pop and a primary-key lookup. When ranking is
+    enabled a larger batch is sampled and only its best candidates are queued,
+    best first. Memory is bounded by
+    evicting the least recently used deck beyond ``max_decks`` and by dropping
+    decks older than ``ttl`` seconds.
+    """
+
+    def __init__(self, deck_size: int = DISCOVERY_DECK_SIZE, refill_at: int = DISCOVERY_DECK_REFILL_AT,
+                 ttl: float = DISCOVERY_DECK_TTL, max_decks: int = DISCOVERY_DECK_MAX_USERS):
+        self.deck_size = deck_size
+        self.refill_at = refill_at
+        self.ttl = ttl
+        self.max_decks = max_decks
+        self._lock = threading.Lock()
+        self._decks = OrderedDict()
+        self._refilling = set()
+
+    @staticmethod
+    def _select(viewer: User, limit: int, exclude_ids) -> list:
+        # Likes still waiting in the like buffer are not in the database yet
+        exclude_ids = set(exclude_ids) | like_buffer.pending_for(viewer.id)
+        if ENABLE_CANDIDATE_RANKING and ranking.is_available():
+            # Spread the batch over the ID range; one keyset run would hold
+            # users who signed up around the same time, leaving recency nothing to rank
+            candidate_ids = sample_candidates(
+                viewer, limit=max(limit, RANKING_BATCH_SIZE), ids_only=True, exclude_ids=exclude_ids,
+                pivots=RANKING_SAMPLE_PIVOTS
+            )
+            return ranking.rank_candidates(viewer, candidate_ids, limit)
+
+        candidate_ids = sample_candidates(viewer, limit=limit, ids_only=True, exclude_ids=exclude_ids)
+        # Keyset sampling returns a run of consecutive IDs, so shuffle the batch
+        random.shuffle(candidate_ids)
+        return candidate_ids
+
+    def _get(self, viewer_id: int):
+        deck = self._decks.get(viewer_id)
+        if deck is None:
+            return None
+        if deck.expires_at < time.monotonic():
+            del self._decks[viewer_id]
+            return None
+        self._decks.move_to_end(viewer_id)
+        return deck
+
+    def fill(self, viewer: User) -> int:
+        """
+        Replace the viewer's deck with a fresh batch of candidates
+
+        Args:
+            viewer: The user who is discovering profiles
+
+        Returns:
+            The number of candidates queued
+        """
+        candidate_ids = self._select(viewer, self.deck_size, ())
+
+        with self._lock:
+            self._decks[viewer.id] = _Deck(candidate_ids, time.monotonic() + self.ttl)
+            self._decks.move_to_end(viewer.id)
+            while len(self._decks) > self.max_decks:
+                self._decks.popitem(last=False)
+        return len(candidate_ids)
+
+    def top_up(self, viewer: User) -> int:
+        """
+        Append new candidates to the viewer's deck without repeating queued ones
+
+        Args:
+            viewer: The user who is discovering profiles
+
+        Returns:
+            The number of candidates added
+        """
+        with self._lock:
+            deck = self._get(viewer.id)
+            if deck is None:
+                return 0
+            queued = set(deck.candidate_ids)
+            missing = self.deck_size - len(queued)
+        if missing <= 0:
+            return 0
+
+        candidate_ids = self._select(viewer, missing, queued)
+
+        with self._lock:
+            deck = self._get(viewer.id)
+            if deck is None:
+                return 0
+            deck.candidate_ids.extend(candidate_ids)
+            deck.expires_at = time.monotonic() + self.ttl
+        return len(candidate_ids)
+
+    def pop(self, viewer_id: int):
+        """
+        Take the next candidate ID from the viewer's deck
+
+        Args:
+            viewer_id: The ID of the user who is discovering profiles
+
+        Returns:
+            A candidate user ID, or None if the deck is missing or empty
+        """
+        with self._lock:
+            deck = self._get(viewer_id)
+            if deck is None or not deck.candidate_ids:
+                return None
+            return deck.candidate_ids.popleft()
+
+    def discard(self, viewer_id: int, candidate_id: int) -> None:
+        """
+        Remove a candidate the viewer has just liked or skipped
+
+        Args:
+            viewer_id: The ID of the user who acted
+            candidate_id: The ID of the liked or skipped user
+        """
+        with self._lock:
+            deck = self._get(viewer_id)
+            if deck is not None and candidate_id in deck.candidate_ids:
+                deck.candidate_ids.remove(candidate_id)
+
+    def drop(self, viewer_id: int) -> None:
+        """
+        Forget a viewer's deck, e.g. after their preferences changed
+
+        Args:
+            viewer_id: The ID of the viewer
+        """
+        with self._lock:
+            self._decks.pop(viewer_id, None)
+
+    def needs_refill(self, viewer_id: int) -> bool:
+        """
+        Check whether the viewer's deck is running low and not already refilling
+
+        Args:
+            viewer_id: The ID of the viewer
+
+        Returns:
+            True if a refill should be scheduled, False otherwise
+        """
+        with self._lock:
+            deck = self._get(viewer_id)
+            if deck is None or viewer_id in self._refilling:
+                return False
+            if len(deck.candidate_ids) > self.refill_at:
+                return False
+            self._refilling.add(viewer_id)
+            return True
+
+    def _refill(self, viewer_id: int) -> int:
+        viewer = User.query.get(viewer_id)
+        return self.top_up(viewer) if viewer else 0
+
+    async def refill(self, viewer_id: int) -> None:
+        """
+        Background task that tops up a viewer's deck
+
+        Args:
+            viewer_id: The ID of the viewer
+        """
+        try:
+            added = await run_db(self._refill, viewer_id)
+            logger.debug(f"Refilled discovery deck for user {viewer_id} with {added} candidates")
+        except Exception as e:
+            logger.error(f"Error refilling discovery deck for user {viewer_id}: {e}")
+        finally:
+            with self._lock:
+                self._refilling.discard(viewer_id)
+
+def next_candidate(viewer: User):
+    """
+    Pick the next profile to show a viewer
+
+    Candidates come from the viewer's prefetched deck first, then from the
+    in-memory discovery index and finally from a database sample.
+
+    Args:
+        viewer: The user who is discovering profiles
+
+    Returns:
+        A User row to show, or None if no candidate is available
+    """
+    candidate_id = candidate_decks.pop(viewer.id)
+    if candidate_id is None and ENABLE_DISCOVERY_INDEX:
+        candidate_id = discovery_index.sample(viewer)
+
+    candidate = None
+    if candidate_id is not None:
+        candidate = User.query.get(candidate_id)
+        if not candidate or not discovery_index.is_discoverable(candidate):
+            # The entry was stale, drop it and fall back to the database
+            discovery_index.remove_user(candidate_id)
+            candidate = None
+        elif not discovery_index.suits(viewer, candidate):
+            # Either side changed preferences after the deck was filled, e.g.
+            # in another process or while a refill was running
+            candidate_decks.drop(viewer.id)
+            candidate = None
+
+    if candidate is None:
+        # Let PostgreSQL pick a random eligible candidate
+        candidates = sample_candidates(viewer, exclude_ids=like_buffer.pending_for(viewer.id))
+        candidate = candidates[0] if candidates else None
+
+    if candidate is not None:
+        ranking.record_exposure(candidate.id)
+    return candidate
+
+def user_changed(user: User) -> None:
+    """
+    Refresh discovery state after a user's profile or status changed
+
+    Args:
+        user: The user who changed
+    """
+    discovery_index.refresh_user(user)
+    candidate_decks.drop(user.id)
+
+def user_removed(user_id: int, deleted: bool = False) -> None:
+    """
+    Remove a banned or deleted user from discovery
+
+    Args:
+        user_id: The ID of the user
+        deleted: Whether the user's profile was deleted, discarding their skips
+    """
+    discovery_index.remove_user(user_id)
+    candidate_decks.drop(user_id)
+    if deleted:
+        skip_store.forget(user_id)
+
+def mark_seen(viewer_id: int, user_id: int) -> None:
+    """
+    Record that a viewer liked a candidate
+
+    Args:
+        viewer_id: The ID of the user who acted
+        user_id: The ID of the liked user
+    """
+    discovery_index.mark_seen(viewer_id, user_id)
+    candidate_decks.discard(viewer_id, user_id)
+
+def mark_skipped(viewer_id: int, user_id: int) -> None:
+    """
+    Record that a viewer skipped a candidate
+
+    The skip is stored in the viewer's skip list and persisted by the skip
+    store's background flush instead of adding a row to the likes table.
+
+    Args:
+        viewer_id: The ID of the user who skipped
+        user_id: The ID of the skipped user
+    """
+    skip_store.add(viewer_id, user_id)
+    candidate_decks.discard(viewer_id, user_id)
+
+# Shared discovery state for the bot process
+discovery_index = DiscoveryIndex()
+candidate_decks = CandidateDeckStore()
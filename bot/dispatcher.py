@@ -0,0 +1,138 @@
+from telegram import Update
+from telegram.ext import Application
+from bot.update_context import UpdateContext, current_update_context
+from config import DISPATCH_WORKERS, DISPATCH_QUEUE_SIZE
+import asyncio
+import logging
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+class DispatcherStopped(RuntimeError):
+    """Raised when an update is queued on a dispatcher that is not running"""
+
+class UpdateDispatcher:
+    """
+    Pool of worker coroutines that process updates, sharded by chat
+
+    Each update goes to the worker chosen by its chat ID, so a chat's
+    updates are processed one at a time in arrival order while different
+    chats are processed in parallel. Every worker has a bounded queue;
+    when it is full the update is refused so the caller can ask Telegram
+    to send it again later.
+    """
+
+    def __init__(self, workers: int = DISPATCH_WORKERS, queue_size: int = DISPATCH_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._queues = []
+        self._tasks = []
+        self._application = None
+
+    @staticmethod
+    def shard_key(update: Update) -> int:
+        """
+        Get the key that decides which worker processes an update
+
+        Args:
+            update: The Telegram update
+
+        Returns:
+            The chat ID, else the user ID, else the update ID
+        """
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        if update.effective_user is not None:
+            return update.effective_user.id
+        return update.update_id
+
+    def start(self, application: Application) -> None:
+        """
+        Start the workers on the running event loop
+
+        Args:
+            application: The started bot application that processes updates
+        """
+        if self._tasks:
+            return
+        self._application = application
+        self._queues = [asyncio.Queue(self.queue_size) for _ in range(self.workers)]
+        self._tasks = [
+            asyncio.create_task(self._work(queue), name=f"update-worker-{index}")
+            for index, queue in enumerate(self._queues)
+        ]
+        logger.info(f"Started {self.workers} update workers")
+
+    async def stop(self) -> None:
+        """Let the workers finish the queued updates, then stop them"""
+        if not self._tasks:
+            return
+        await asyncio.gather(*(queue.join() for queue in self._queues))
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queues = []
+
+    def submit(self, update: Update) -> bool:
+        """
+        Queue an update on its chat's worker without waiting
+
+        Must be called on the event loop the workers run on.
+
+        Args:
+            update: The Telegram update
+
+        Returns:
+            True if the update was queued, False if that worker's queue is
+            full or the dispatcher is not running
+        """
+        if not self._queues:
+            logger.warning(f"Update dispatcher is not running, refusing update {update.update_id}")
+            return False
+        queue = self._queues[self.shard_key(update) % self.workers]
+        try:
+            queue.put_nowait(update)
+        except asyncio.QueueFull:
+            logger.warning(f"Update queue full, refusing update {update.update_id}")
+            return False
+        return True
+
+    async def put(self, update: Update) -> None:
+        """
+        Queue an update on its chat's worker, waiting for room if needed
+
+        Args:
+            update: The Telegram update
+
+        Raises:
+            DispatcherStopped: If the dispatcher is not running
+        """
+        if not self._queues:
+            raise DispatcherStopped(f"Update dispatcher is not running, refusing update {update.update_id}")
+        await self._queues[self.shard_key(update) % self.workers].put(update)
+
+    def backlog(self) -> int:
+        """
+        Get the number of updates waiting in all queues
+
+        Returns:
+            The number of queued updates
+        """
+        return sum(queue.qsize() for queue in self._queues)
+
+    async def _work(self, queue: asyncio.Queue) -> None:
+        while True:
+            update = await queue.get()
+            # Every handler of this update shares one UpdateContext
+            token = current_update_context.set(UpdateContext(update))
+            try:
+                await self._application.process_update(update)
+            except Exception as e:
+                logger.error(f"Error processing update {update.update_id}: {e}")
+            finally:
+                current_update_context.reset(token)
+                queue.task_done()
+
+# Shared dispatcher for the bot process
+update_dispatcher = UpdateDispatcher()
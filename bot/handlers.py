@@ -13,11 +13,12 @@ from bot.registration import (
 )
 from bot.matching import (
     find_matches_command, handle_like, handle_skip,
-    show_next_profile, view_matched_profiles
+    show_next_profile, view_matched_profiles, page_matches
 )
 from bot.messaging import (
     chat_command, process_chat_message, end_chat,
-    send_message_to_match
+    send_message_to_match, page_chat_history, page_chat_list,
+    search_command, page_search_results
 )
 from bot.confessions import (
     confess_command, process_confession_text,
@@ -79,10 +80,15 @@ def register_handlers(application: Application) -> None:
     application.add_handler(CallbackQueryHandler(handle_skip, pattern='^skip_'))
     application.add_handler(CallbackQueryHandler(show_next_profile, pattern='^next_profile$'))
     application.add_handler(CommandHandler('matches', view_matched_profiles))
+    application.add_handler(CallbackQueryHandler(page_matches, pattern='^matches_page_'))
     
     # Chat handlers
     application.add_handler(CommandHandler('chat', chat_command))
+    application.add_handler(CallbackQueryHandler(page_chat_list, pattern='^chats_page_'))
     application.add_handler(CallbackQueryHandler(send_message_to_match, pattern='^send_msg_to_'))
+    application.add_handler(CallbackQueryHandler(page_chat_history, pattern='^hist_'))
+    application.add_handler(CommandHandler('search', search_command))
+    application.add_handler(CallbackQueryHandler(page_search_results, pattern='^search_'))
     application.add_handler(CallbackQueryHandler(end_chat, pattern='^end_chat_'))
     application.add_handler(CallbackQueryHandler(handle_report, pattern='^report_user_'))
     
@@ -151,9 +157,9 @@ def register_handlers(application: Application) -> None:
     # Generic button handler
     application.add_handler(CallbackQueryHandler(register_button_handler))
     
-    # Handle chat messages
+    # Handle chat messages, including photos, voice notes and stickers
     application.add_handler(MessageHandler(
-        filters.TEXT & ~filters.COMMAND, 
+        (filters.TEXT & ~filters.COMMAND) | filters.PHOTO | filters.VOICE | filters.Sticker.ALL,
         process_chat_message
     ))
     
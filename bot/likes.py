@@ -0,0 +1,236 @@
+from datetime import datetime
+from sqlalchemy import DateTime, bindparam, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+from app import db
+from models import Like
+from bot.background import dead_letter, register_flusher, flush_soon
+from config import LIKE_FLUSH_INTERVAL, LIKE_FLUSH_BATCH_SIZE, LIKE_BUFFER_LIMIT, FLUSH_MAX_ATTEMPTS
+import logging
+import threading
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+FLUSHER_NAME = "likes"
+
+# Takes the same pair advisory locks as handle_like, in a fixed order so two
+# flushes never wait on each other in a cycle. Holding them until the flush
+# commits means a flush and a handler recording the two halves of a pair run
+# one after the other, and the later one always sees the other's like.
+_LOCK_LIKE_PAIRS = text("""
+    SELECT pg_advisory_xact_lock(pair.low, pair.high)
+    FROM (
+        SELECT DISTINCT least(l.user_id, l.liked_user_id) AS low, greatest(l.user_id, l.liked_user_id) AS high
+        FROM unnest(CAST(:likers AS integer[]), CAST(:liked AS integer[])) AS l(user_id, liked_user_id)
+        ORDER BY low, high
+    ) AS pair
+""")
+
+# Creates the matches for flushed likes whose reverse like is already stored.
+# It runs under the pair locks after the likes are written, so of two workers
+# flushing the two halves of a pair, the later one always sees both halves.
+_RECONCILE_MATCHES = text("""
+    INSERT INTO matches (user1_id, user2_id, is_active, created_at)
+    SELECT least(l.user_id, l.liked_user_id), greatest(l.user_id, l.liked_user_id), true, :now
+    FROM unnest(CAST(:likers AS integer[]), CAST(:liked AS integer[])) AS l(user_id, liked_user_id)
+    JOIN likes reverse
+      ON reverse.user_id = l.liked_user_id
+     AND reverse.liked_user_id = l.user_id
+     AND reverse.is_like
+    ON CONFLICT (user1_id, user2_id) DO NOTHING
+    RETURNING id, user1_id, user2_id
+""").bindparams(bindparam("now", type_=DateTime))
+
+def _like_row(key: tuple, created_at: datetime) -> dict:
+    liker_id, liked_id = key
+    return {"user_id": liker_id, "liked_user_id": liked_id, "is_like": True, "created_at": created_at}
+
+class LikeBuffer:
+    """
+    Write-behind buffer for likes that did not create a match
+
+    Likes are acknowledged as soon as they are buffered and written to the
+    likes table in batches by a background flush. Mutual likes never wait
+    here: handle_like checks the buffer and the database synchronously and
+    records those in its own transaction. Like the message writer, it moves
+    likes to the dead-letter file after ``max_attempts`` failed flushes in a
+    row and keeps at most ``max_pending`` of them.
+    """
+
+    def __init__(self, batch_size: int = LIKE_FLUSH_BATCH_SIZE, max_pending: int = LIKE_BUFFER_LIMIT,
+                 max_attempts: int = FLUSH_MAX_ATTEMPTS):
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        # (liker ID, liked ID) -> time of the like, in arrival order
+        self._pending = {}
+        # Matches found while flushing that still need to be announced
+        self._new_matches = []
+        # Flushes that have failed in a row
+        self._failures = 0
+
+    def _trim(self) -> list:
+        # Called with the lock held; returns the oldest likes beyond the limit
+        dropped = []
+        while len(self._pending) > self.max_pending:
+            key = next(iter(self._pending))
+            dropped.append(_like_row(key, self._pending.pop(key)))
+        return dropped
+
+    def add(self, liker_id: int, liked_id: int) -> bool:
+        """
+        Buffer a like
+
+        Args:
+            liker_id: The ID of the user who liked
+            liked_id: The ID of the liked user
+
+        Returns:
+            True if the like was buffered, False if it was already pending
+        """
+        with self._lock:
+            if (liker_id, liked_id) in self._pending:
+                return False
+            self._pending[(liker_id, liked_id)] = datetime.utcnow()
+            full = len(self._pending) >= self.batch_size
+            dropped = self._trim()
+        if dropped:
+            dead_letter(FLUSHER_NAME, dropped, f"the buffer reached {self.max_pending} likes")
+        if full:
+            flush_soon(FLUSHER_NAME)
+        return True
+
+    def contains(self, liker_id: int, liked_id: int) -> bool:
+        """
+        Check whether a like is waiting to be written
+
+        Args:
+            liker_id: The ID of the user who liked
+            liked_id: The ID of the liked user
+
+        Returns:
+            True if the like is buffered
+        """
+        with self._lock:
+            return (liker_id, liked_id) in self._pending
+
+    def pending_for(self, liker_id: int) -> set:
+        """
+        Get the users a user has liked whose likes are not written yet
+
+        Args:
+            liker_id: The ID of the user who liked
+
+        Returns:
+            The IDs of the liked users
+        """
+        with self._lock:
+            return {liked_id for (liker, liked_id) in self._pending if liker == liker_id}
+
+    def take(self, liker_id: int, liked_id: int):
+        """
+        Remove a like from the buffer so the caller can write it itself
+
+        Args:
+            liker_id: The ID of the user who liked
+            liked_id: The ID of the liked user
+
+        Returns:
+            The time of the like, or None if it was not buffered
+        """
+        with self._lock:
+            return self._pending.pop((liker_id, liked_id), None)
+
+    def flush(self) -> None:
+        """Write every buffered like in one statement and create missed matches"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        rows = [_like_row(key, created_at) for key, created_at in pending.items()]
+        try:
+            matches = self._write(rows)
+        except IntegrityError:
+            # A user was deleted meanwhile; write the rows one by one so a
+            # single bad row does not hold back everyone else's likes
+            db.session.rollback()
+            written, matches = 0, []
+            for row in rows:
+                try:
+                    matches.extend(self._write([row]))
+                    written += 1
+                except IntegrityError as e:
+                    db.session.rollback()
+                    logger.warning(f"Dropping like {row['user_id']} -> {row['liked_user_id']}: {e}")
+            logger.debug(f"Flushed {written} likes")
+        except Exception:
+            db.session.rollback()
+            self._failures += 1
+            if self._failures >= self.max_attempts:
+                self._failures = 0
+                dead_letter(FLUSHER_NAME, rows, f"{self.max_attempts} failed writes")
+                raise
+            # Put the likes back in front so the next flush retries them first
+            with self._lock:
+                newer, self._pending = self._pending, dict(pending)
+                for key, created_at in newer.items():
+                    self._pending.setdefault(key, created_at)
+                dropped = self._trim()
+            dead_letter(FLUSHER_NAME, dropped, f"the buffer reached {self.max_pending} likes")
+            raise
+        else:
+            logger.debug(f"Flushed {len(rows)} likes")
+        self._failures = 0
+
+        if matches:
+            logger.info(f"Created {len(matches)} matches from flushed likes")
+            with self._lock:
+                self._new_matches.extend(tuple(match) for match in matches)
+
+    @staticmethod
+    def _write(rows: list) -> list:
+        """
+        Write likes and create the matches they complete, in one transaction
+
+        Args:
+            rows: Like rows for the likes table
+
+        Returns:
+            The (id, user1_id, user2_id) of each match created
+        """
+        pairs = {
+            "likers": [row["user_id"] for row in rows],
+            "liked": [row["liked_user_id"] for row in rows],
+        }
+        db.session.execute(_LOCK_LIKE_PAIRS, pairs)
+        statement = insert(Like.__table__)
+        statement = statement.on_conflict_do_update(
+            index_elements=[Like.user_id, Like.liked_user_id],
+            set_={"is_like": True}
+        )
+        db.session.execute(statement, rows)
+        matches = db.session.execute(_RECONCILE_MATCHES, {**pairs, "now": datetime.utcnow()}).all()
+        db.session.commit()
+        return matches
+
+    async def announce_matches(self, bot_app) -> None:
+        """
+        Send match notifications for matches created while flushing
+
+        Args:
+            bot_app: The bot application, used to send the notifications
+        """
+        with self._lock:
+            matches, self._new_matches = self._new_matches, []
+
+        from bot.notifications import send_match_notification
+        for match_id, user1_id, user2_id in matches:
+            # The notification helpers only need ``.bot`` from their context
+            await send_match_notification(bot_app, match_id, user1_id, user2_id)
+
+# Shared like buffer for the bot process
+like_buffer = LikeBuffer()
+register_flusher(FLUSHER_NAME, like_buffer.flush, LIKE_FLUSH_INTERVAL, like_buffer.announce_matches)
@@ -0,0 +1,98 @@
+from sqlalchemy import case, func, select, true
+from sqlalchemy.orm import aliased
+from app import db
+from models import User, Match, Message
+import logging
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Longest last-message preview shown in the /chat list
+PREVIEW_LENGTH = 40
+
+# How media messages are shown in previews and chat history
+MEDIA_LABELS = {
+    "photo": "📷 Photo",
+    "voice": "🎤 Voice message",
+    "sticker": "🏷️ Sticker",
+}
+
+def load_match_listing(user_id: int, offset: int = 0, limit: int = None) -> tuple:
+    """
+    Load a page of a user's active matches with everything the listings show
+
+    One query returns each match with the peer's profile and the match's
+    last message, most recently active first, plus the total number of
+    active matches for pagination.
+
+    Args:
+        user_id: The ID of the user whose matches to list
+        offset: The number of matches to skip
+        limit: The maximum number of matches to return, or None for all
+
+    Returns:
+        A (rows, total) tuple; each row has match_id, peer_id, full_name, age,
+        university, bio, photo_id, last_content, last_media_type,
+        last_sender_id and last_sent_at
+    """
+    match = aliased(Match, Match.for_user(user_id).subquery())
+    peer_id = case((match.user1_id == user_id, match.user2_id), else_=match.user1_id)
+    last_message = (
+        select(Message.content, Message.media_type, Message.sender_id, Message.sent_at)
+        .where(Message.match_id == match.id)
+        .order_by(Message.sent_at.desc(), Message.id.desc())
+        .limit(1)
+        .lateral("last_message")
+    )
+
+    query = db.session.query(
+        match.id.label("match_id"),
+        User.id.label("peer_id"),
+        User.full_name,
+        User.age,
+        User.university,
+        User.bio,
+        User.photo_id,
+        last_message.c.content.label("last_content"),
+        last_message.c.media_type.label("last_media_type"),
+        last_message.c.sender_id.label("last_sender_id"),
+        last_message.c.sent_at.label("last_sent_at"),
+        func.count().over().label("total"),
+    ).join(
+        User, User.id == peer_id
+    ).outerjoin(
+        last_message, true()
+    ).order_by(
+        func.coalesce(last_message.c.sent_at, match.created_at).desc(),
+        match.id.desc()
+    ).offset(offset)
+    if limit is not None:
+        query = query.limit(limit)
+
+    rows = query.all()
+    if rows:
+        return rows, rows[0].total
+    if offset:
+        # Past the end; count separately so callers can step back
+        return rows, Match.for_user(user_id).count()
+    return rows, 0
+
+def preview(row, user_id: int) -> str:
+    """
+    Describe a listing row's last message in one short line
+
+    Args:
+        row: A row from load_match_listing
+        user_id: The ID of the user viewing the listing
+
+    Returns:
+        The preview text
+    """
+    if row.last_sent_at is None:
+        return "No messages yet"
+    content = " ".join((row.last_content or "").split())
+    if len(content) > PREVIEW_LENGTH:
+        content = content[:PREVIEW_LENGTH - 1] + "…"
+    if row.last_media_type:
+        content = f"{MEDIA_LABELS.get(row.last_media_type, 'Media')} {content}".rstrip()
+    return f"You: {content}" if row.last_sender_id == user_id else content
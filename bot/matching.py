@@ -1,12 +1,16 @@
-from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto
 from telegram.ext import ContextTypes, ConversationHandler
-from sqlalchemy import and_, not_, or_
+from datetime import datetime
+from sqlalchemy import DateTime, Integer, and_, bindparam, exists, not_, or_, select, text
 from app import db
-from models import User, Like, Match, UserState
+from models import User, Like, UserState
 from bot.keyboards import profile_action_keyboard, next_profile_keyboard
+from bot.discovery import candidate_decks, next_candidate, mark_seen, mark_skipped
+from bot.likes import like_buffer
+from bot.listings import load_match_listing
+from bot.db_pool import run_db
 from config import STATES
 import logging
-import random
 
 # Initialize logger
 logger = logging.getLogger(__name__)
@@ -22,7 +26,7 @@ async def find_matches_command(update: Update, context: ContextTypes.DEFAULT_TYP
     user = update.effective_user
     
     # Check if user is registered
-    db_user = User.query.filter_by(telegram_id=user.id).first()
+    db_user = await run_db(User.by_telegram_id, user.id)
     if not db_user or not db_user.registration_complete:
         await update.message.reply_text(
             "✋ *Registration Required*\n\n"
@@ -54,19 +58,40 @@ async def find_matches_command(update: Update, context: ContextTypes.DEFAULT_TYP
         parse_mode="Markdown"
     )
     
-    # Update user state
+    # Update user state and prefetch a deck of candidates
+    await run_db(_enter_discovery, db_user.id, user.id)
+    
+    await update.message.reply_text(
+        "🔍 *Finding UniMatch Profiles*\n\n"
+        "UniMatch Ethiopia is searching for your perfect connections...\n"
+        "Use ❤️ to like someone or ⏭️ to view the next profile!",
+        parse_mode="Markdown"
+    )
+    
+    # Show the first potential match
+    await show_next_profile(update, context, first_time=True)
+
+def _enter_discovery(user_id: int, telegram_id: int) -> None:
+    """
+    Put a user in profile-viewing state and prefetch their discovery deck
+    
+    Args:
+        user_id: The ID of the user
+        telegram_id: The Telegram ID of the user
+    """
+    db_user = db.session.get(User, user_id)
     db_user.current_state = STATES["VIEWING_PROFILE"]
     db.session.commit()
     
     # Update user state with proper error handling
     try:
-        user_state = UserState.query.filter_by(telegram_id=user.id).first()
+        user_state = UserState.query.filter_by(telegram_id=telegram_id).first()
         if user_state:
             user_state.state = STATES["VIEWING_PROFILE"]
             db.session.commit()
         else:
             user_state = UserState(
-                telegram_id=user.id,
+                telegram_id=telegram_id,
                 state=STATES["VIEWING_PROFILE"],
                 data={}
             )
@@ -79,23 +104,20 @@ async def find_matches_command(update: Update, context: ContextTypes.DEFAULT_TYP
         
         # Try again with just an update
         try:
-            user_state = UserState.query.filter_by(telegram_id=user.id).first()
+            user_state = UserState.query.filter_by(telegram_id=telegram_id).first()
             if user_state:
                 user_state.state = STATES["VIEWING_PROFILE"]
                 db.session.commit()
-                logger.info(f"Successfully updated user state after rollback for user {user.id}")
+                logger.info(f"Successfully updated user state after rollback for user {telegram_id}")
         except Exception as e2:
             logger.error(f"Fatal error managing user state: {e2}")
     
-    await update.message.reply_text(
-        "🔍 *Finding UniMatch Profiles*\n\n"
-        "UniMatch Ethiopia is searching for your perfect connections...\n"
-        "Use ❤️ to like someone or ⏭️ to view the next profile!",
-        parse_mode="Markdown"
-    )
-    
-    # Show the first potential match
-    await show_next_profile(update, context, first_time=True)
+    # Prefetch a deck of candidates so each tap is a pop and a primary-key lookup
+    try:
+        candidate_decks.fill(db_user)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error filling discovery deck for user {telegram_id}: {e}")
 
 async def show_next_profile(update: Update, context: ContextTypes.DEFAULT_TYPE, first_time=False) -> None:
     """
@@ -113,8 +135,8 @@ async def show_next_profile(update: Update, context: ContextTypes.DEFAULT_TYPE,
     else:
         user = update.effective_user
     
-    # Get the user from the database
-    db_user = User.query.filter_by(telegram_id=user.id).first()
+    # Get the user and their next candidate from the database
+    db_user, match = await run_db(_load_next_profile, user.id)
     if not db_user:
         message = "You need to register first. Use /start to begin."
         if first_time:
@@ -123,40 +145,11 @@ async def show_next_profile(update: Update, context: ContextTypes.DEFAULT_TYPE,
             await query.edit_message_text(message)
         return
     
-    # Find potential matches that:
-    # 1. Match the user's gender preference
-    # 2. Have the user's gender as their preference
-    # 3. Match the university filter
-    # 4. Have not been liked/disliked by the user
-    # 5. Have registration complete
-    # 6. Are not banned
-    # 7. Have a profile photo
-    
-    # Get a list of user IDs that the current user has already interacted with
-    interacted_users = [like.liked_user_id for like in db_user.likes_sent]
-    
-    potential_matches_query = User.query.filter(
-        # Match gender preferences
-        User.gender == db_user.interested_in,
-        User.interested_in == db_user.gender,
-        # University filter (if not "All Universities")
-        ((User.university == db_user.university) | 
-         (db_user.university.name == "ALL_UNIVERSITIES") |
-         (User.university.name == "ALL_UNIVERSITIES")),
-        # Not the current user
-        User.id != db_user.id,
-        # Not already interacted with
-        ~User.id.in_(interacted_users),
-        # Registration complete and not banned
-        User.registration_complete == True,
-        User.is_banned == False,
-        # Has profile photo
-        User.photo_id.isnot(None)
-    )
-    
-    potential_matches = potential_matches_query.all()
+    # Top up the deck in the background before it runs out
+    if candidate_decks.needs_refill(db_user.id):
+        context.application.create_task(candidate_decks.refill(db_user.id))
     
-    if not potential_matches:
+    if match is None:
         message = (
             "😔 *No UniMatch Profiles Available*\n\n"
             "UniMatch Ethiopia is still searching for your perfect match! "
@@ -169,9 +162,6 @@ async def show_next_profile(update: Update, context: ContextTypes.DEFAULT_TYPE,
             await query.edit_message_text(message, parse_mode="Markdown")
         return
     
-    # Pick a random match from the potential matches
-    match = random.choice(potential_matches)
-    
     # Display the match profile
     caption = (
         f"✨ *UniMatch Ethiopia Profile*\n\n"
@@ -203,6 +193,131 @@ async def show_next_profile(update: Update, context: ContextTypes.DEFAULT_TYPE,
             reply_markup=keyboard
         )
 
+def _load_next_profile(telegram_id: int) -> tuple:
+    """
+    Load a user and pick the next profile to show them
+    
+    Args:
+        telegram_id: The Telegram ID of the user
+    
+    Returns:
+        A (user, candidate) tuple; user is None if they are not registered,
+        candidate is None if no profile is available
+    """
+    db_user = User.by_telegram_id(telegram_id)
+    if not db_user:
+        return None, None
+    return db_user, next_candidate(db_user)
+
+# Types for the binds of the statements below; asyncpg sends parameters
+# untyped, and least() of two untyped parameters would resolve to text
+_LIKE_PARAMS = (
+    bindparam("liker_id", type_=Integer),
+    bindparam("liked_id", type_=Integer),
+    bindparam("now", type_=DateTime),
+)
+
+# Takes a transaction-scoped advisory lock on the unordered pair, so two users
+# liking each other at the same moment are serialized and only one of them
+# creates the match; the like buffer's flush takes the same lock per pair
+_LOCK_LIKE_PAIR = text(
+    "SELECT pg_advisory_xact_lock(least(:liker_id, :liked_id), greatest(:liker_id, :liked_id))"
+).bindparams(*_LIKE_PARAMS[:2])
+
+# Writes a like that was still waiting in this process's like buffer
+_UPSERT_LIKE = text("""
+    INSERT INTO likes (user_id, liked_user_id, is_like, created_at)
+    VALUES (:liker_id, :liked_id, true, :now)
+    ON CONFLICT (user_id, liked_user_id) DO UPDATE SET is_like = true
+""").bindparams(*_LIKE_PARAMS)
+
+# Upserts the like, checks for a like in the other direction and creates the
+# match if there is one, all in one statement. Matches are stored with
+# user1_id < user2_id, so an existing match is a conflict on the pair
+_RECORD_LIKE = text("""
+    WITH target AS (
+        SELECT id, full_name FROM users WHERE id = :liked_id
+    ),
+    upserted AS (
+        INSERT INTO likes (user_id, liked_user_id, is_like, created_at)
+        SELECT :liker_id, id, true, :now FROM target
+        ON CONFLICT (user_id, liked_user_id) DO UPDATE SET is_like = true
+        RETURNING (xmax = 0) AS inserted
+    ),
+    mutual AS (
+        SELECT 1 FROM likes
+        WHERE user_id = :liked_id AND liked_user_id = :liker_id AND is_like
+    ),
+    created_match AS (
+        INSERT INTO matches (user1_id, user2_id, is_active, created_at)
+        SELECT least(:liker_id, id), greatest(:liker_id, id), true, :now FROM target
+        WHERE EXISTS (SELECT 1 FROM mutual)
+        ON CONFLICT (user1_id, user2_id) DO NOTHING
+        RETURNING id
+    )
+    SELECT
+        (SELECT inserted FROM upserted) AS like_inserted,
+        EXISTS (SELECT 1 FROM mutual) AS is_mutual,
+        (SELECT id FROM created_match) AS match_id
+    FROM target
+""").bindparams(*_LIKE_PARAMS)
+
+def _lookup_like(liker_id: int, liked_id: int):
+    """
+    Look up the liked user and the likes between the two users
+
+    Args:
+        liker_id: The ID of the user who liked
+        liked_id: The ID of the liked user
+
+    Returns:
+        A row with the liked User and the already_liked and liked_back
+        flags, or None if the liked user does not exist
+    """
+    already_liked = exists().where(Like.user_id == liker_id, Like.liked_user_id == User.id, Like.is_like)
+    liked_back = exists().where(Like.user_id == User.id, Like.liked_user_id == liker_id, Like.is_like)
+    return db.session.execute(
+        select(User, already_liked.label("already_liked"), liked_back.label("liked_back"))
+        .where(User.id == liked_id)
+    ).first()
+
+def _record_mutual_like(liker_id: int, liked_id: int):
+    """
+    Record a like that is expected to be mutual and create the match
+
+    Args:
+        liker_id: The ID of the user who liked
+        liked_id: The ID of the liked user
+
+    Returns:
+        A (like_inserted, is_mutual, match_id) tuple, or None if the liked
+        user no longer exists
+    """
+    # The reverse like may still be waiting in the buffer; it has to be
+    # written in this transaction for the match check to see it
+    reverse_liked_at = like_buffer.take(liked_id, liker_id)
+    own_liked_at = like_buffer.take(liker_id, liked_id)
+    try:
+        params = {"liker_id": liker_id, "liked_id": liked_id, "now": datetime.utcnow()}
+        db.session.execute(_LOCK_LIKE_PAIR, params)
+        if reverse_liked_at:
+            db.session.execute(_UPSERT_LIKE, {
+                "liker_id": liked_id, "liked_id": liker_id, "now": reverse_liked_at
+            })
+        result = db.session.execute(_RECORD_LIKE, params).first()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        if reverse_liked_at:
+            like_buffer.add(liked_id, liker_id)
+        if own_liked_at:
+            like_buffer.add(liker_id, liked_id)
+        raise
+
+    if not result:
+        return None
+    return bool(result.like_inserted) and not own_liked_at, result.is_mutual, result.match_id
+
 async def handle_like(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Handle a user liking a profile
@@ -214,15 +329,25 @@ async def handle_like(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     query = update.callback_query
     await query.answer()
     
-    user = query.from_user
     data = query.data  # like_<user_id>
     liked_user_id = int(data.split('_')[1])
     
-    # Get the users from the database
-    liker = User.query.filter_by(telegram_id=user.id).first()
-    liked = User.query.get(liked_user_id)
+    # The liker comes from the update context; look up the liked user and the likes between them
+    liker = await context.update_context.user()
+    found = await run_db(_lookup_like, liker.id, liked_user_id) if liker else None
+    recorded = None
+    
+    if found:
+        liker_id = liker.id
+        if found.liked_back or like_buffer.contains(liked_user_id, liker_id):
+            # Mutual likes are recorded right away so the match is never missed
+            recorded = await run_db(_record_mutual_like, liker_id, liked_user_id)
+        else:
+            # Anything else is acknowledged now and written by the like buffer
+            buffered = like_buffer.add(liker_id, liked_user_id)
+            recorded = (buffered and not found.already_liked, False, None)
     
-    if not liker or not liked:
+    if not recorded:
         await query.edit_message_text(
             "❌ *Profile Unavailable*\n\n"
             "UniMatch Ethiopia cannot find this profile. "
@@ -232,63 +357,26 @@ async def handle_like(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         )
         return
     
-    # Check if this is a duplicate like
-    existing_like = Like.query.filter_by(
-        user_id=liker.id,
-        liked_user_id=liked.id
-    ).first()
+    like_inserted, is_mutual, match_id = recorded
+    liked_user = found.User
+    liked_name = liked_user.full_name
+    mark_seen(liker_id, liked_user_id)
     
-    if existing_like:
-        # Update the existing like
-        existing_like.is_like = True
-        db.session.commit()
-    else:
-        # Record the like in the database
-        like = Like(
-            user_id=liker.id,
-            liked_user_id=liked.id,
-            is_like=True
-        )
-        db.session.add(like)
-        db.session.commit()
-        
+    if like_inserted:
         # Send a notification to the liked user (without revealing who liked them)
         from bot.notifications import send_like_notification
-        await send_like_notification(context, liked.id)
+        await send_like_notification(context, liked_user_id, liked_user=liked_user)
     
-    # Check if there's a mutual like
-    mutual_like = Like.query.filter_by(
-        user_id=liked.id,
-        liked_user_id=liker.id,
-        is_like=True
-    ).first()
+    if match_id:
+        # Send match notifications to both users
+        from bot.notifications import send_match_notification
+        await send_match_notification(
+            context, match_id, liker_id, liked_user_id, user1=liker, user2=liked_user
+        )
     
-    if mutual_like:
-        # Check if they're already matched
-        existing_match = Match.query.filter(
-            (
-                (Match.user1_id == liker.id) & (Match.user2_id == liked.id)
-            ) | (
-                (Match.user1_id == liked.id) & (Match.user2_id == liker.id)
-            )
-        ).first()
-        
-        if not existing_match:
-            # Create a match
-            match = Match(
-                user1_id=liker.id,
-                user2_id=liked.id,
-                is_active=True
-            )
-            db.session.add(match)
-            db.session.commit()
-            
-            # Send match notifications to both users
-            from bot.notifications import send_match_notification
-            await send_match_notification(context, match.id, liker.id, liked.id)
-        
+    if is_mutual:
         # Show a confirmation message
-        match_text = f"✅ *Match Confirmed!* You liked {liked.full_name} and it's a match! 🎉\n\n"
+        match_text = f"✅ *Match Confirmed!* You liked {liked_name} and it's a match! 🎉\n\n"
         match_text += f"UniMatch Ethiopia has connected you! Use /chat to start your conversation."
         
         await query.edit_message_text(
@@ -298,7 +386,7 @@ async def handle_like(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         )
     else:
         # Just show a confirmation message
-        like_text = f"✅ *Like Sent!* You've shown interest in {liked.full_name}.\n\n"
+        like_text = f"✅ *Like Sent!* You've shown interest in {liked_name}.\n\n"
         like_text += "UniMatch Ethiopia will notify you if they like you back! 💕"
         
         await query.edit_message_text(
@@ -307,6 +395,25 @@ async def handle_like(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
             reply_markup=next_profile_keyboard()
         )
 
+def _skip_profile(skipper_id: int, skipped_user_id: int):
+    """
+    Look up the skipped user and record the skip
+
+    The skip goes into the skipper's bitset, which may have to be loaded
+    from the database first; it is written back in batches.
+
+    Args:
+        skipper_id: The ID of the user who skipped
+        skipped_user_id: The ID of the skipped user
+
+    Returns:
+        The skipped User, or None if they do not exist
+    """
+    skipped = db.session.get(User, skipped_user_id)
+    if skipped:
+        mark_skipped(skipper_id, skipped.id)
+    return skipped
+
 async def handle_skip(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Handle a user skipping a profile
@@ -318,13 +425,13 @@ async def handle_skip(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     query = update.callback_query
     await query.answer()
     
-    user = query.from_user
     data = query.data  # skip_<user_id>
     skipped_user_id = int(data.split('_')[1])
     
-    # Get the users from the database
-    skipper = User.query.filter_by(telegram_id=user.id).first()
-    skipped = User.query.get(skipped_user_id)
+    # The skipper comes from the update context; the skipped user is loaded
+    # and the skip recorded in one unit of work
+    skipper = await context.update_context.user()
+    skipped = await run_db(_skip_profile, skipper.id, skipped_user_id) if skipper else None
     
     if not skipper or not skipped:
         await query.edit_message_text(
@@ -336,26 +443,6 @@ async def handle_skip(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         )
         return
     
-    # Check if this is a duplicate skip
-    existing_like = Like.query.filter_by(
-        user_id=skipper.id,
-        liked_user_id=skipped.id
-    ).first()
-    
-    if existing_like:
-        # Update the existing record
-        existing_like.is_like = False
-        db.session.commit()
-    else:
-        # Record the skip in the database
-        skip = Like(
-            user_id=skipper.id,
-            liked_user_id=skipped.id,
-            is_like=False
-        )
-        db.session.add(skip)
-        db.session.commit()
-    
     # Show a confirmation message
     skip_text = f"❌ *Profile Skipped* - You passed on {skipped.full_name}.\n\n"
     skip_text += "UniMatch Ethiopia will continue finding your perfect match! 🔍"
@@ -377,7 +464,7 @@ async def view_matched_profiles(update: Update, context: ContextTypes.DEFAULT_TY
     user = update.effective_user
     
     # Check if user is registered
-    db_user = User.query.filter_by(telegram_id=user.id).first()
+    db_user = await run_db(User.by_telegram_id, user.id)
     if not db_user or not db_user.registration_complete:
         await update.message.reply_text(
             "✋ *Registration Required*\n\n"
@@ -399,16 +486,9 @@ async def view_matched_profiles(update: Update, context: ContextTypes.DEFAULT_TY
         )
         return
     
-    # Get all active matches for the user
-    matches = Match.query.filter(
-        (
-            (Match.user1_id == db_user.id) | 
-            (Match.user2_id == db_user.id)
-        ),
-        Match.is_active == True
-    ).all()
+    caption, keyboard, photo_id = await run_db(render_match_card, db_user.id)
     
-    if not matches:
+    if not caption:
         await update.message.reply_text(
             "🔍 *No UniMatch Connections Yet*\n\n"
             "You haven't made any matches on UniMatch Ethiopia yet! "
@@ -419,38 +499,86 @@ async def view_matched_profiles(update: Update, context: ContextTypes.DEFAULT_TY
         )
         return
     
-    # Display each match
-    for match in matches:
-        # Determine which user is the match
-        if match.user1_id == db_user.id:
-            match_user = User.query.get(match.user2_id)
-        else:
-            match_user = User.query.get(match.user1_id)
-        
-        # Create a message with the match's details
-        caption = (
-            f"💘 *UniMatch Connection*\n\n"
-            f"📋 *{match_user.full_name}*, {match_user.age}\n"
-            f"🏫 {match_user.university.value}\n\n"
-            f"{match_user.bio or 'No bio provided.'}\n\n"
-            f"You've both matched! Start a conversation to discover your connection ✨"
-        )
-        
-        # Create keyboard for chat actions
-        keyboard = InlineKeyboardMarkup([
-            [
-                InlineKeyboardButton("💬 Send Message", callback_data=f"send_msg_to_{match.id}"),
-                InlineKeyboardButton("🚫 End Chat", callback_data=f"end_chat_{match.id}")
-            ],
-            [
-                InlineKeyboardButton("⚠️ Report User", callback_data=f"report_user_{match_user.id}")
-            ]
-        ])
-        
-        await context.bot.send_photo(
-            chat_id=user.id,
-            photo=match_user.photo_id,
-            caption=caption,
-            parse_mode="Markdown",
-            reply_markup=keyboard
-        )
+    # One message for all matches; the arrows swap the card in place
+    await context.bot.send_photo(
+        chat_id=user.id,
+        photo=photo_id,
+        caption=caption,
+        parse_mode="Markdown",
+        reply_markup=keyboard
+    )
+
+def render_match_card(user_id: int, index: int = 0) -> tuple:
+    """
+    Render one match of a user's /matches carousel
+    
+    Args:
+        user_id: The ID of the user
+        index: The position of the match in the carousel, starting at 0
+    
+    Returns:
+        A (caption, keyboard, photo_id) tuple, or (None, None, None) if the
+        user has no active matches
+    """
+    rows, total = load_match_listing(user_id, index, 1)
+    if not rows:
+        return None, None, None
+    match = rows[0]
+    
+    # Create a message with the match's details
+    caption = (
+        f"💘 *UniMatch Connection* ({index + 1}/{total})\n\n"
+        f"📋 *{match.full_name}*, {match.age}\n"
+        f"🏫 {match.university.value}\n\n"
+        f"{match.bio or 'No bio provided.'}\n\n"
+        f"You've both matched! Start a conversation to discover your connection ✨"
+    )
+    
+    # Create keyboard for chat actions and carousel navigation
+    buttons = [
+        [
+            InlineKeyboardButton("💬 Send Message", callback_data=f"send_msg_to_{match.match_id}"),
+            InlineKeyboardButton("🚫 End Chat", callback_data=f"end_chat_{match.match_id}")
+        ],
+        [
+            InlineKeyboardButton("⚠️ Report User", callback_data=f"report_user_{match.peer_id}")
+        ]
+    ]
+    navigation = []
+    if index > 0:
+        navigation.append(InlineKeyboardButton("◀️", callback_data=f"matches_page_{index - 1}"))
+    if index + 1 < total:
+        navigation.append(InlineKeyboardButton("▶️", callback_data=f"matches_page_{index + 1}"))
+    if navigation:
+        buttons.append(navigation)
+    
+    return caption, InlineKeyboardMarkup(buttons), match.photo_id
+
+async def page_matches(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Show another match of the /matches carousel in place
+    
+    Args:
+        update: The update object
+        context: The context object
+    """
+    query = update.callback_query
+    await query.answer()
+    
+    index = int(query.data.split('_')[-1])  # matches_page_<index>
+    db_user = await run_db(User.by_telegram_id, query.from_user.id)
+    if not db_user:
+        return
+    
+    caption, keyboard, photo_id = await run_db(render_match_card, db_user.id, index)
+    if not caption and index > 0:
+        # Matches ended since the carousel was shown; start over
+        caption, keyboard, photo_id = await run_db(render_match_card, db_user.id)
+    if not caption:
+        await query.edit_message_caption("You have no active matches right now.")
+        return
+    
+    await query.edit_message_media(
+        media=InputMediaPhoto(media=photo_id, caption=caption, parse_mode="Markdown"),
+        reply_markup=keyboard
+    )
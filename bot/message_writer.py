@@ -0,0 +1,121 @@
+from datetime import datetime
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from app import db
+from models import Message
+from bot.background import dead_letter, register_flusher, flush_soon
+from config import MESSAGE_FLUSH_INTERVAL, MESSAGE_FLUSH_BATCH_SIZE, MESSAGE_BUFFER_LIMIT, FLUSH_MAX_ATTEMPTS
+import logging
+import threading
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+FLUSHER_NAME = "chat messages"
+
+class MessageWriter:
+    """
+    Write-behind buffer for relayed chat messages
+
+    Messages are queued after they have been relayed and inserted in
+    arrival order by a background flush, so ids and sent_at keep the order
+    each match saw them in. A batch that fails ``max_attempts`` flushes in a
+    row, and the oldest messages beyond ``max_pending``, are moved to the
+    dead-letter file so one bad batch cannot hold back the rest for ever.
+    """
+
+    def __init__(self, batch_size: int = MESSAGE_FLUSH_BATCH_SIZE, max_pending: int = MESSAGE_BUFFER_LIMIT,
+                 max_attempts: int = FLUSH_MAX_ATTEMPTS):
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._pending = []
+        # Flushes that have failed in a row
+        self._failures = 0
+
+    def _trim(self) -> list:
+        # Called with the lock held; returns the oldest messages beyond the limit
+        overflow = len(self._pending) - self.max_pending
+        if overflow <= 0:
+            return []
+        dropped = self._pending[:overflow]
+        del self._pending[:overflow]
+        return dropped
+
+    def add(self, match_id: int, sender_id: int, receiver_id: int, content: str,
+            sent_at: datetime, relay_failed: bool = False,
+            media_type: str = None, file_id: str = None) -> None:
+        """
+        Queue a chat message to be stored
+
+        Args:
+            match_id: The ID of the match
+            sender_id: The ID of the sender
+            receiver_id: The ID of the receiver
+            content: The message text or media caption
+            sent_at: When the message was received from the sender
+            relay_failed: Whether forwarding it to the receiver failed
+            media_type: The kind of media relayed, or None for text
+            file_id: The Telegram file_id of the media
+        """
+        with self._lock:
+            self._pending.append({
+                "match_id": match_id,
+                "sender_id": sender_id,
+                "receiver_id": receiver_id,
+                "content": content,
+                "media_type": media_type,
+                "file_id": file_id,
+                "sent_at": sent_at,
+                "is_read": False,
+                "relay_failed": relay_failed,
+            })
+            full = len(self._pending) >= self.batch_size
+            dropped = self._trim()
+        if dropped:
+            dead_letter(FLUSHER_NAME, dropped, f"the buffer reached {self.max_pending} messages")
+        if full:
+            flush_soon(FLUSHER_NAME)
+
+    def flush(self) -> None:
+        """Insert every queued message in one statement"""
+        with self._lock:
+            rows, self._pending = self._pending, []
+        if not rows:
+            return
+
+        statement = insert(Message.__table__)
+        try:
+            db.session.execute(statement, rows)
+            db.session.commit()
+        except IntegrityError:
+            # A match or user was deleted meanwhile; insert the rows one by
+            # one so a single bad row does not hold back everyone else's
+            db.session.rollback()
+            for row in rows:
+                try:
+                    db.session.execute(statement, [row])
+                    db.session.commit()
+                except IntegrityError as e:
+                    db.session.rollback()
+                    logger.warning(f"Dropping message in match {row['match_id']}: {e}")
+        except Exception:
+            db.session.rollback()
+            self._failures += 1
+            if self._failures >= self.max_attempts:
+                self._failures = 0
+                dead_letter(FLUSHER_NAME, rows, f"{self.max_attempts} failed writes")
+                raise
+            # Put the messages back in front so the next flush keeps the order
+            with self._lock:
+                self._pending[:0] = rows
+                dropped = self._trim()
+            dead_letter(FLUSHER_NAME, dropped, f"the buffer reached {self.max_pending} messages")
+            raise
+        self._failures = 0
+        logger.debug(f"Stored {len(rows)} chat messages")
+
+# Shared message writer for the bot process
+message_writer = MessageWriter()
+register_flusher(FLUSHER_NAME, message_writer.flush, MESSAGE_FLUSH_INTERVAL)
@@ -1,14 +1,29 @@
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes, ConversationHandler
-from sqlalchemy import or_
+from datetime import datetime, timedelta
+from sqlalchemy import func, literal_column, or_, tuple_
 from app import db
 from models import User, Match, Message, UserState
-from config import STATES
+from bot.archive import archived_messages, has_archive
+from bot.db_pool import run_db
+from bot.listings import MEDIA_LABELS, load_match_listing, preview
+from bot.message_writer import message_writer
+from bot.sessions import chat_sessions
+from bot.unread import unread_counters
+from config import (
+    STATES, MESSAGES_PER_PAGE, CHAT_ACK_MODE, CHAT_LIST_PAGE_SIZE,
+    SEARCH_LANGUAGE, SEARCH_RESULTS_PER_PAGE
+)
+import asyncio
 import logging
+import weakref
 
 # Initialize logger
 logger = logging.getLogger(__name__)
 
+# Per-match relay locks, dropped once no handler holds them
+_relay_locks = weakref.WeakValueDictionary()
+
 async def chat_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Show the user their active chats
@@ -20,7 +35,7 @@ async def chat_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     user = update.effective_user
     
     # Check if user is registered
-    db_user = User.query.filter_by(telegram_id=user.id).first()
+    db_user = await run_db(User.by_telegram_id, user.id)
     if not db_user or not db_user.registration_complete:
         await update.message.reply_text(
             "You need to complete your registration first.\n"
@@ -35,54 +50,58 @@ async def chat_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         )
         return
     
-    # Get all active matches for the user
-    matches = Match.query.filter(
-        (
-            (Match.user1_id == db_user.id) | 
-            (Match.user2_id == db_user.id)
-        ),
-        Match.is_active == True
-    ).all()
+    text, keyboard = await run_db(render_chat_list, db_user.id)
     
-    if not matches:
+    if not text:
         await update.message.reply_text(
             "You don't have any active matches to chat with.\n"
             "Use /find to start finding matches!"
         )
         return
     
-    await update.message.reply_text(
-        "Here are your active chats. Select one to start chatting!"
-    )
+    await update.message.reply_text(text, reply_markup=keyboard)
+
+def render_chat_list(user_id: int, page: int = 0) -> tuple:
+    """
+    Render one page of a user's active chats as a single message
     
-    # Display each match
-    for match in matches:
-        # Determine which user is the match
-        if match.user1_id == db_user.id:
-            match_user = User.query.get(match.user2_id)
-        else:
-            match_user = User.query.get(match.user1_id)
-        
-        # Create a message with the match's details
-        text = f"💬 Chat with *{match_user.full_name}*"
-        
-        # Create keyboard for chat actions
-        keyboard = InlineKeyboardMarkup([
-            [
-                InlineKeyboardButton("Send Message", callback_data=f"send_msg_to_{match.id}")
-            ]
-        ])
-        
-        await context.bot.send_message(
-            chat_id=user.id,
-            text=text,
-            parse_mode="Markdown",
-            reply_markup=keyboard
-        )
+    Args:
+        user_id: The ID of the user
+        page: The page number, starting at 0
+    
+    Returns:
+        A (text, keyboard) tuple, or (None, None) if the user has no active chats
+    """
+    rows, total = load_match_listing(user_id, page * CHAT_LIST_PAGE_SIZE, CHAT_LIST_PAGE_SIZE)
+    if not rows:
+        return None, None
+    
+    unread = unread_counters.counts(user_id, [row.match_id for row in rows])
+    
+    # Plain text, since previews may contain stray Markdown characters
+    lines = ["Here are your active chats. Select one to start chatting!"]
+    buttons = []
+    for row in rows:
+        count = unread.get(row.match_id)
+        badge = f" ({count} unread)" if count else ""
+        lines.append(f"\n💬 {row.full_name}{badge}\n{preview(row, user_id)}")
+        buttons.append([InlineKeyboardButton(
+            f"💬 {row.full_name}{badge}", callback_data=f"send_msg_to_{row.match_id}"
+        )])
+    
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("⬅️ Previous", callback_data=f"chats_page_{page - 1}"))
+    if (page + 1) * CHAT_LIST_PAGE_SIZE < total:
+        navigation.append(InlineKeyboardButton("Next ➡️", callback_data=f"chats_page_{page + 1}"))
+    if navigation:
+        buttons.append(navigation)
+    
+    return "\n".join(lines), InlineKeyboardMarkup(buttons)
 
-async def send_message_to_match(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def page_chat_list(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
-    Start a chat with a specific match
+    Show another page of the /chat list in place
     
     Args:
         update: The update object
@@ -91,41 +110,360 @@ async def send_message_to_match(update: Update, context: ContextTypes.DEFAULT_TY
     query = update.callback_query
     await query.answer()
     
-    user = query.from_user
-    data = query.data  # send_msg_to_<match_id>
-    match_id = int(data.split('_')[-1])
-    
-    # Get the match from the database
-    match = Match.query.get(match_id)
-    if not match or not match.is_active:
-        await query.edit_message_text(
-            "This match is no longer active."
-        )
+    page = int(query.data.split('_')[-1])  # chats_page_<page>
+    db_user = await run_db(User.by_telegram_id, query.from_user.id)
+    if not db_user:
+        await query.edit_message_text("Error: Your user profile was not found.")
         return
     
-    # Get the user and match user
-    db_user = User.query.filter_by(telegram_id=user.id).first()
-    if not db_user:
+    text, keyboard = await run_db(render_chat_list, db_user.id, page)
+    if not text and page > 0:
+        # Chats ended since the list was shown; fall back to the first page
+        text, keyboard = await run_db(render_chat_list, db_user.id)
+    if not text:
         await query.edit_message_text(
-            "Error: Your user profile was not found."
+            "You don't have any active matches to chat with.\n"
+            "Use /find to start finding matches!"
         )
         return
     
-    # Determine which user is the match
-    if match.user1_id == db_user.id:
-        match_user = User.query.get(match.user2_id)
+    await query.edit_message_text(text, reply_markup=keyboard)
+
+# Telegram rejects messages longer than this
+MAX_MESSAGE_LENGTH = 4096
+# Every message on a page gets an equal share, leaving room for the header
+# and the sender names
+HISTORY_ENTRY_LENGTH = (MAX_MESSAGE_LENGTH - 100) // MESSAGES_PER_PAGE - 100
+EPOCH = datetime(1970, 1, 1)
+
+def _encode_cursor(message: Message) -> str:
+    # Microseconds since the epoch keep the callback data well under 64 bytes
+    delta = message.sent_at - EPOCH
+    usec = (delta.days * 86400 + delta.seconds) * 10**6 + delta.microseconds
+    return f"{usec}_{message.id}"
+
+def _decode_cursor(usec: str, message_id: str) -> tuple:
+    return EPOCH + timedelta(microseconds=int(usec)), int(message_id)
+
+def _merge_archived(messages: list, match_id: int, direction: str, cursor: tuple, limit: int) -> list:
+    # Same keyset conditions as the database query, applied to the archive
+    if direction == "n":
+        archived = [msg for msg in archived_messages(match_id) if (msg.sent_at, msg.id) > cursor]
+    elif direction == "o":
+        archived = [msg for msg in archived_messages(match_id) if (msg.sent_at, msg.id) < cursor]
+    else:
+        archived = list(archived_messages(match_id))
+
+    merged = {(msg.id, msg.sent_at): msg for msg in archived}
+    for msg in messages:
+        merged[(msg.id, msg.sent_at)] = msg
+    ordered = sorted(merged.values(), key=lambda msg: (msg.sent_at, msg.id), reverse=direction != "n")
+    return ordered[:limit]
+
+def load_history_page(match_id: int, direction: str = None, cursor: tuple = None) -> tuple:
+    """
+    Load one page of a match's messages using a keyset cursor
+
+    Args:
+        match_id: The ID of the match
+        direction: "o" for messages older than the cursor, "n" for newer
+            ones, or None for the latest page
+        cursor: The (sent_at, id) of the message the page starts after
+
+    Returns:
+        A (messages, has_older, has_newer) tuple, messages oldest first
+    """
+    key = tuple_(Message.sent_at, Message.id)
+    page = Message.query.filter(Message.match_id == match_id)
+    if direction == "n":
+        page = page.filter(key > tuple_(*cursor)).order_by(Message.sent_at.asc(), Message.id.asc())
     else:
-        match_user = User.query.get(match.user1_id)
+        if direction == "o":
+            page = page.filter(key < tuple_(*cursor))
+        page = page.order_by(Message.sent_at.desc(), Message.id.desc())
+
+    limit = MESSAGES_PER_PAGE + 1
+    messages = page.limit(limit).all()
+    # Messages from archived months are read back from the archive files
+    if (direction == "n" or len(messages) < limit) and has_archive(match_id):
+        messages = _merge_archived(messages, match_id, direction, cursor, limit)
+    has_more = len(messages) > MESSAGES_PER_PAGE
+    messages = messages[:MESSAGES_PER_PAGE]
+
+    if direction == "n":
+        return messages, True, has_more
+    messages.reverse()
+    return messages, has_more, direction == "o"
+
+def render_history_page(match_id: int, names: dict, direction: str = None, cursor: tuple = None) -> tuple:
+    """
+    Render one page of chat history with its navigation buttons
+
+    Args:
+        match_id: The ID of the match
+        names: Full names of both participants, by user ID
+        direction: Passed on to load_history_page
+        cursor: Passed on to load_history_page
+
+    Returns:
+        A (text, keyboard) tuple, or (None, None) if the match has no messages
+    """
+    messages, has_older, has_newer = load_history_page(match_id, direction, cursor)
+    if not messages:
+        return None, None
+
+    chat_history = "📱 *Chat History*\n\n"
+    for msg in messages:
+        content = msg.content or ""
+        if len(content) > HISTORY_ENTRY_LENGTH:
+            content = content[:HISTORY_ENTRY_LENGTH - 1] + "…"
+        if msg.media_type:
+            content = f"{MEDIA_LABELS.get(msg.media_type, 'Media')} {content}".rstrip()
+        chat_history += f"*{names.get(msg.sender_id, 'Unknown')}*: {content}\n\n"
+
+    buttons = []
+    if has_older:
+        buttons.append(InlineKeyboardButton(
+            "⬅️ Older", callback_data=f"hist_{match_id}_o_{_encode_cursor(messages[0])}"
+        ))
+    if has_newer:
+        buttons.append(InlineKeyboardButton(
+            "Newer ➡️", callback_data=f"hist_{match_id}_n_{_encode_cursor(messages[-1])}"
+        ))
+    keyboard = InlineKeyboardMarkup([buttons]) if buttons else None
+    return chat_history[:MAX_MESSAGE_LENGTH], keyboard
+
+def _participant_names(telegram_id: int, match_id: int):
+    """
+    Get the names of a match's participants, if the user is one of them
+
+    Args:
+        telegram_id: The Telegram ID of the user asking
+        match_id: The ID of the match
+
+    Returns:
+        Full names of both participants by user ID, or None if the user is
+        not a participant or the match does not exist
+    """
+    db_user = User.by_telegram_id(telegram_id)
+    match = Match.query.get(match_id)
+    if not db_user or not match or db_user.id not in (match.user1_id, match.user2_id):
+        return None
+    return dict(
+        db.session.query(User.id, User.full_name).filter(
+            User.id.in_([match.user1_id, match.user2_id])
+        ).all()
+    )
+
+async def page_chat_history(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Show an older or newer page of chat history in place
     
-    if not match_user:
-        await query.edit_message_text(
-            "Error: Match user profile not found."
-        )
+    Args:
+        update: The update object
+        context: The context object
+    """
+    query = update.callback_query
+    await query.answer()
+    
+    # hist_<match_id>_<o|n>_<sent_at in microseconds>_<message_id>
+    _, match_id, direction, usec, message_id = query.data.split('_')
+    match_id = int(match_id)
+    
+    # Only the two participants may read the history
+    names = await run_db(_participant_names, query.from_user.id, match_id)
+    if names is None:
+        await query.edit_message_text("This chat history is no longer available.")
+        return
+    
+    text, keyboard = await run_db(
+        render_history_page, match_id, names, direction, _decode_cursor(usec, message_id)
+    )
+    if not text:
+        await query.edit_message_text("No more messages.")
+        return
+    
+    await query.edit_message_text(
+        text=text,
+        parse_mode="Markdown",
+        reply_markup=keyboard
+    )
+
+# Matched words are marked in plain text, since messages may contain Markdown
+SEARCH_HEADLINE_OPTIONS = "StartSel=«, StopSel=», MaxWords=20, MinWords=8, MaxFragments=2"
+
+def search_messages(match_id: int, terms: str, page: int = 0) -> tuple:
+    """
+    Find a match's messages containing the given words, newest first
+
+    Uses the ix_messages_search full-text index. Messages of archived months
+    are not searched.
+
+    Args:
+        match_id: The ID of the match
+        terms: The search terms, in web search syntax ("quoted phrases", -excluded)
+        page: The page number, starting at 0
+
+    Returns:
+        A (rows, has_more) tuple; each row has sender_id, media_type, sent_at
+        and snippet
+    """
+    language = literal_column(f"'{SEARCH_LANGUAGE}'::regconfig")
+    tsquery = func.websearch_to_tsquery(language, terms)
+    rows = db.session.query(
+        Message.sender_id,
+        Message.media_type,
+        Message.sent_at,
+        func.ts_headline(language, Message.content, tsquery, SEARCH_HEADLINE_OPTIONS).label("snippet"),
+    ).filter(
+        Message.match_id == match_id,
+        Message.search_document().op("@@")(tsquery)
+    ).order_by(
+        Message.sent_at.desc(), Message.id.desc()
+    ).offset(page * SEARCH_RESULTS_PER_PAGE).limit(SEARCH_RESULTS_PER_PAGE + 1).all()
+    return rows[:SEARCH_RESULTS_PER_PAGE], len(rows) > SEARCH_RESULTS_PER_PAGE
+
+def render_search_page(match_id: int, names: dict, terms: str, page: int = 0) -> tuple:
+    """
+    Render one page of search results with its navigation buttons
+
+    Args:
+        match_id: The ID of the match
+        names: Full names of both participants, by user ID
+        terms: The search terms
+        page: The page number, starting at 0
+
+    Returns:
+        A (text, keyboard) tuple; the text says so when nothing was found
+    """
+    rows, has_more = search_messages(match_id, terms, page)
+    if not rows:
+        if page:
+            return "No more results.", None
+        return f"No messages found for \"{terms}\".", None
+
+    text = f"🔎 Results for \"{terms}\"\n\n"
+    for row in rows:
+        snippet = " ".join((row.snippet or "").split())
+        if row.media_type:
+            snippet = f"{MEDIA_LABELS.get(row.media_type, 'Media')} {snippet}".rstrip()
+        text += f"{names.get(row.sender_id, 'Unknown')} ({row.sent_at:%Y-%m-%d %H:%M}): {snippet}\n\n"
+
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("⬅️ Newer", callback_data=f"search_{match_id}_{page - 1}"))
+    if has_more:
+        buttons.append(InlineKeyboardButton("Older ➡️", callback_data=f"search_{match_id}_{page + 1}"))
+    keyboard = InlineKeyboardMarkup([buttons]) if buttons else None
+    return text[:MAX_MESSAGE_LENGTH], keyboard
+
+def _load_open_chat(telegram_id: int):
+    """
+    Load and cache the chat a user has open, from their stored state
+
+    Args:
+        telegram_id: The Telegram ID of the user
+
+    Returns:
+        The user's ChatSession, or None if they have no active chat open
+    """
+    user_state = UserState.by_telegram_id(telegram_id)
+    match = None
+    if user_state and user_state.state == STATES["CHATTING"] and user_state.data:
+        match = Match.query.get(user_state.data.get("match_id"))
+    db_user = User.by_telegram_id(telegram_id)
+    match_user = User.query.get(match.peer_id(db_user.id)) if match and db_user else None
+    if not match or not match.is_active or not match_user:
+        return None
+    return chat_sessions.put(telegram_id, match.id, db_user, match_user)
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Search the messages of the chat the user currently has open
+    
+    Args:
+        update: The update object
+        context: The context object
+    """
+    user = update.effective_user
+    terms = " ".join(context.args or []).strip()
+    
+    # Search the chat that is open; fall back to the database like the relay
+    session = chat_sessions.get(user.id)
+    if session is None:
+        session = await run_db(_load_open_chat, user.id)
+        if session is None:
+            await update.message.reply_text(
+                "Open a chat with /chat first, then use /search <text> to find earlier messages."
+            )
+            return
+    
+    if not terms:
+        await update.message.reply_text("Usage: /search <text>")
+        return
+    
+    # Callback data is limited to 64 bytes, so the terms are kept here
+    context.user_data["search"] = {"match_id": session.match_id, "terms": terms}
+    names = {session.user_id: session.user_name, session.peer_id: session.peer_name}
+    text, keyboard = await run_db(render_search_page, session.match_id, names, terms)
+    await update.message.reply_text(text, reply_markup=keyboard)
+
+async def page_search_results(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Show another page of /search results in place
+    
+    Args:
+        update: The update object
+        context: The context object
+    """
+    query = update.callback_query
+    await query.answer()
+    
+    # search_<match_id>_<page>
+    _, match_id, page = query.data.split('_')
+    match_id, page = int(match_id), int(page)
+    
+    search = context.user_data.get("search")
+    if not search or search["match_id"] != match_id:
+        await query.edit_message_text("This search has expired. Please run /search again.")
+        return
+    
+    # Only the two participants may search the history
+    names = await run_db(_participant_names, query.from_user.id, match_id)
+    if names is None:
+        await query.edit_message_text("This chat history is no longer available.")
         return
     
+    text, keyboard = await run_db(render_search_page, match_id, names, search["terms"], page)
+    await query.edit_message_text(text, reply_markup=keyboard)
+
+def _open_chat(db_user: User, user_state: UserState, match_id: int) -> tuple:
+    """
+    Put a user in chatting state with a match and cache the chat session
+    
+    Args:
+        db_user: The user, as loaded by the update context
+        user_state: The user's state as loaded by the update context, or None
+        match_id: The ID of the match
+    
+    Returns:
+        A (session, error) tuple; error is a message for the user when the
+        chat cannot be opened, and session is None then
+    """
+    # Get the match from the database
+    match = Match.query.get(match_id)
+    if not match or not match.is_active:
+        return None, "This match is no longer active."
+    
+    # Determine which user is the match
+    match_user = User.query.get(match.peer_id(db_user.id))
+    if not match_user:
+        return None, "Error: Match user profile not found."
+    
     # Set user state to chatting with this match
-    user_state = UserState.query.filter_by(telegram_id=user.id).first()
+    telegram_id = db_user.telegram_id
     if user_state:
+        user_state = db.session.merge(user_state, load=False)
         user_state.state = STATES["CHATTING"]
         user_state.data = {
             "match_id": match_id,
@@ -134,7 +472,7 @@ async def send_message_to_match(update: Update, context: ContextTypes.DEFAULT_TY
         db.session.commit()
     else:
         user_state = UserState(
-            telegram_id=user.id,
+            telegram_id=telegram_id,
             state=STATES["CHATTING"],
             data={
                 "match_id": match_id,
@@ -143,26 +481,55 @@ async def send_message_to_match(update: Update, context: ContextTypes.DEFAULT_TY
         )
         db.session.add(user_state)
         db.session.commit()
+    session = chat_sessions.put(telegram_id, match_id, db_user, match_user)
+    unread_counters.reset(match_id, db_user.id)
+    return session, None
+
+async def send_message_to_match(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Start a chat with a specific match
+    
+    Args:
+        update: The update object
+        context: The context object
+    """
+    query = update.callback_query
+    await query.answer()
+    
+    user = query.from_user
+    data = query.data  # send_msg_to_<match_id>
+    match_id = int(data.split('_')[-1])
+    
+    # Open the chat: checks the match, stores the chatting state and caches the session
+    db_user = await context.update_context.user()
+    if not db_user:
+        await query.edit_message_text("Error: Your user profile was not found.")
+        return
+    user_state = await context.update_context.user_state()
+    session, error = await run_db(_open_chat, db_user, user_state, match_id)
+    context.update_context.invalidate()
+    if error:
+        await query.edit_message_text(error)
+        return
     
-    # Show chat history
-    messages = Message.query.filter_by(match_id=match_id).order_by(Message.sent_at.asc()).all()
+    # Show the latest page of chat history
+    text, history_keyboard = await run_db(
+        render_history_page, match_id,
+        {session.user_id: session.user_name, session.peer_id: session.peer_name}
+    )
     
     # Display message history or a starter message
-    if messages:
-        chat_history = "📱 *Chat History*\n\n"
-        for msg in messages:
-            sender = User.query.get(msg.sender_id)
-            chat_history += f"*{sender.full_name}*: {msg.content}\n\n"
-        
+    if text:
         await context.bot.send_message(
             chat_id=user.id,
-            text=chat_history,
-            parse_mode="Markdown"
+            text=text,
+            parse_mode="Markdown",
+            reply_markup=history_keyboard
         )
     else:
         await context.bot.send_message(
             chat_id=user.id,
-            text=f"Start chatting with *{match_user.full_name}*!\n"
+            text=f"Start chatting with *{session.peer_name}*!\n"
                  f"Type a message below to send it.",
             parse_mode="Markdown"
         )
@@ -171,7 +538,7 @@ async def send_message_to_match(update: Update, context: ContextTypes.DEFAULT_TY
     keyboard = InlineKeyboardMarkup([
         [
             InlineKeyboardButton("🚫 End Chat", callback_data=f"end_chat_{match_id}"),
-            InlineKeyboardButton("⚠️ Report User", callback_data=f"report_user_{match_user.id}")
+            InlineKeyboardButton("⚠️ Report User", callback_data=f"report_user_{session.peer_id}")
         ]
     ])
     
@@ -181,75 +548,188 @@ async def send_message_to_match(update: Update, context: ContextTypes.DEFAULT_TY
         reply_markup=keyboard
     )
 
-async def process_chat_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+def _media_of(message) -> tuple:
+    # Telegram sends each photo in several sizes; the last one is the largest
+    if message.photo:
+        return "photo", message.photo[-1].file_id
+    if message.voice:
+        return "voice", message.voice.file_id
+    if message.sticker:
+        return "sticker", message.sticker.file_id
+    return None, None
+
+async def _relay(update: Update, context: ContextTypes.DEFAULT_TYPE, session, media_type: str, message_text: str):
     """
-    Process a message sent by a user in chat mode
+    Forward a chat message to the other participant
+    
+    Media is copied by Telegram from the sender's chat, so the bot never
+    downloads or uploads the file itself.
     
     Args:
         update: The update object
         context: The context object
+        session: The sender's ChatSession
+        media_type: The kind of media, or None for text
+        message_text: The text, or the media caption
+    
+    Returns:
+        The sent message, or the id of the copy for media
     """
-    user = update.effective_user
-    message_text = update.message.text
+    if media_type is None:
+        return await context.bot.send_message(
+            chat_id=session.peer_telegram_id,
+            text=f"💬 *{session.user_name}*: {message_text}",
+            parse_mode="Markdown"
+        )
+    
+    if media_type == "sticker":
+        # Stickers cannot carry a caption
+        return await context.bot.copy_message(
+            chat_id=session.peer_telegram_id,
+            from_chat_id=update.effective_chat.id,
+            message_id=update.message.message_id
+        )
+    
+    caption = f"💬 *{session.user_name}*"
+    if message_text:
+        caption += f": {message_text}"
+    return await context.bot.copy_message(
+        chat_id=session.peer_telegram_id,
+        from_chat_id=update.effective_chat.id,
+        message_id=update.message.message_id,
+        caption=caption,
+        parse_mode="Markdown"
+    )
+
+def _relay_lock(match_id: int) -> asyncio.Lock:
+    lock = _relay_locks.get(match_id)
+    if lock is None:
+        lock = _relay_locks[match_id] = asyncio.Lock()
+    return lock
+
+async def _acknowledge(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Let the sender know their chat message was received, as set by CHAT_ACK_MODE
+    
+    Args:
+        update: The update object
+        context: The context object
+    """
+    if CHAT_ACK_MODE == "none":
+        return
+    
+    if CHAT_ACK_MODE == "reaction":
+        # Reactions need a Bot API client that supports them
+        set_reaction = getattr(context.bot, "set_message_reaction", None)
+        if set_reaction is not None:
+            await set_reaction(
+                chat_id=update.effective_chat.id,
+                message_id=update.message.message_id,
+                reaction="👍"
+            )
+            return
+    
+    await update.message.reply_text(
+        "✅ Message sent!",
+        reply_to_message_id=update.message.message_id
+    )
+
+def _resume_chat(telegram_id: int) -> tuple:
+    """
+    Restore a user's chat session from their stored chatting state
+    
+    Args:
+        telegram_id: The Telegram ID of the sender
     
+    Returns:
+        A (session, error) tuple; error is a message for the user when the
+        chat cannot be resumed, and both are None if the user is not chatting
+    """
     # Get the user's state
-    user_state = UserState.query.filter_by(telegram_id=user.id).first()
+    user_state = UserState.by_telegram_id(telegram_id)
     
     # If user is not in chatting state, ignore the message
     if not user_state or user_state.state != STATES["CHATTING"]:
-        return
+        return None, None
     
     # Get the match and user data
     match_id = user_state.data.get("match_id")
     match_user_id = user_state.data.get("match_user_id")
     
     if not match_id or not match_user_id:
-        await update.message.reply_text(
-            "Error: Chat data not found. Please use /chat to start chatting again."
-        )
-        return
+        return None, "Error: Chat data not found. Please use /chat to start chatting again."
     
     # Get the match and users from the database
     match = Match.query.get(match_id)
-    db_user = User.query.filter_by(telegram_id=user.id).first()
+    db_user = User.by_telegram_id(telegram_id)
     match_user = User.query.get(match_user_id)
     
     if not match or not match.is_active:
-        await update.message.reply_text(
-            "This chat has ended. Use /matches to see your active matches."
-        )
         user_state.state = STATES["IDLE"]
         db.session.commit()
-        return
+        return None, "This chat has ended. Use /matches to see your active matches."
     
     if not db_user or not match_user:
+        return None, "Error: User data not found. Please use /chat to start chatting again."
+    
+    return chat_sessions.put(telegram_id, match_id, db_user, match_user), None
+
+async def process_chat_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Process a message sent by a user in chat mode
+    
+    Args:
+        update: The update object
+        context: The context object
+    """
+    user = update.effective_user
+    media_type, file_id = _media_of(update.message)
+    message_text = update.message.caption if media_type else update.message.text
+    
+    # Cached sessions skip all of the lookups below
+    session = chat_sessions.get(user.id)
+    if session is None:
+        session, error = await run_db(_resume_chat, user.id)
+        if session is None:
+            # Not in chat mode; the message is not meant for a match
+            if error:
+                await update.message.reply_text(error)
+            return
+    
+    # Relay first and store afterwards; the lock keeps a match's messages in
+    # order even when updates are processed concurrently, and sent_at is
+    # taken under it so stored order matches relay order
+    async with _relay_lock(session.match_id):
+        sent_at = datetime.utcnow()
+        try:
+            await _relay(update, context, session, media_type, message_text)
+            relay_error = None
+        except Exception as e:
+            relay_error = e
+        relay_failed = relay_error is not None
+        message_writer.add(
+            session.match_id, session.user_id, session.peer_id,
+            message_text, sent_at, relay_failed=relay_failed,
+            media_type=media_type, file_id=file_id
+        )
+        # Messages are unread unless the peer has this chat open right now
+        peer_session = chat_sessions.get(session.peer_telegram_id)
+        if relay_failed or not peer_session or peer_session.match_id != session.match_id:
+            unread_counters.increment(session.match_id, session.peer_id)
+    
+    if relay_failed:
+        logger.error(f"Failed to relay message in match {session.match_id}: {relay_error}")
         await update.message.reply_text(
-            "Error: User data not found. Please use /chat to start chatting again."
+            "⚠️ Your message could not be delivered. Please try again later.",
+            reply_to_message_id=update.message.message_id
         )
         return
     
-    # Store the message in the database
-    message = Message(
-        match_id=match_id,
-        sender_id=db_user.id,
-        receiver_id=match_user.id,
-        content=message_text
-    )
-    db.session.add(message)
-    db.session.commit()
-    
-    # Forward the message to the match user
-    await context.bot.send_message(
-        chat_id=match_user.telegram_id,
-        text=f"💬 *{db_user.full_name}*: {message_text}",
-        parse_mode="Markdown"
-    )
-    
-    # Confirm to the sender
-    await update.message.reply_text(
-        "✅ Message sent!",
-        reply_to_message_id=update.message.message_id
-    )
+    # Only acknowledge messages that actually reached the other participant
+    try:
+        await _acknowledge(update, context)
+    except Exception as e:
+        logger.warning(f"Failed to acknowledge message from {user.id}: {e}")
 
 async def end_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
@@ -266,52 +746,60 @@ async def end_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     data = query.data  # end_chat_<match_id>
     match_id = int(data.split('_')[-1])
     
+    ended, error = await run_db(_end_match, user.id, match_id)
+    if error:
+        await query.edit_message_text(error)
+        return
+    user_name, peer_name, peer_telegram_id = ended
+    
+    # Notify both users
+    await query.edit_message_text(
+        f"Chat with {peer_name} has ended."
+    )
+    
+    await context.bot.send_message(
+        chat_id=peer_telegram_id,
+        text=f"{user_name} has ended the chat."
+    )
+
+def _end_match(telegram_id: int, match_id: int) -> tuple:
+    """
+    End a match and take the user out of chatting state
+    
+    Args:
+        telegram_id: The Telegram ID of the user ending the chat
+        match_id: The ID of the match
+    
+    Returns:
+        A (names, error) tuple; names is (user_name, peer_name,
+        peer_telegram_id), error is a message for the user when the match
+        cannot be ended, and names is None then
+    """
     # Get the match from the database
     match = Match.query.get(match_id)
     if not match:
-        await query.edit_message_text(
-            "Error: Match not found."
-        )
-        return
+        return None, "Error: Match not found."
     
     # Get the user
-    db_user = User.query.filter_by(telegram_id=user.id).first()
+    db_user = User.by_telegram_id(telegram_id)
     if not db_user:
-        await query.edit_message_text(
-            "Error: Your user profile was not found."
-        )
-        return
+        return None, "Error: Your user profile was not found."
     
     # Determine which user is the match
-    if match.user1_id == db_user.id:
-        match_user = User.query.get(match.user2_id)
-    else:
-        match_user = User.query.get(match.user1_id)
+    match_user = User.query.get(match.peer_id(db_user.id))
     
     if not match_user:
-        await query.edit_message_text(
-            "Error: Match user profile not found."
-        )
-        return
+        return None, "Error: Match user profile not found."
     
     # End the match
     match.is_active = False
-    from datetime import datetime
     match.ended_at = datetime.utcnow()
     db.session.commit()
+    chat_sessions.discard_match(match_id)
     
     # Update user state
-    user_state = UserState.query.filter_by(telegram_id=user.id).first()
+    user_state = UserState.by_telegram_id(telegram_id)
     if user_state and user_state.state == STATES["CHATTING"]:
         user_state.state = STATES["IDLE"]
         db.session.commit()
-    
-    # Notify both users
-    await query.edit_message_text(
-        f"Chat with {match_user.full_name} has ended."
-    )
-    
-    await context.bot.send_message(
-        chat_id=match_user.telegram_id,
-        text=f"{db_user.full_name} has ended the chat."
-    )
+    return (db_user.full_name, match_user.full_name, match_user.telegram_id), None
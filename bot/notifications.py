@@ -2,6 +2,7 @@ from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes
 from app import db
 from models import User, Like, Match
+from bot.db_pool import run_db
 from config import ENABLE_NOTIFICATIONS
 import logging
 import random
@@ -27,7 +28,7 @@ MATCH_NOTIFICATION_TEMPLATES = [
     "💞 *New Match on UniMatch Ethiopia!* 💞\n\nCongratulations on matching with *{match_name}* from *{university}*!\n\nBegin your conversation with /chat! 📱"
 ]
 
-async def send_like_notification(context: ContextTypes.DEFAULT_TYPE, liked_user_id: int) -> None:
+async def send_like_notification(context: ContextTypes.DEFAULT_TYPE, liked_user_id: int, liked_user: User = None) -> None:
     """
     Send a notification to a user when someone likes their profile,
     without revealing who liked them
@@ -35,13 +36,15 @@ async def send_like_notification(context: ContextTypes.DEFAULT_TYPE, liked_user_
     Args:
         context: The context object
         liked_user_id: The ID of the user who received the like
+        liked_user: The user who received the like, if already loaded
     """
     if not ENABLE_NOTIFICATIONS:
         return
     
     try:
         # Get the user who received the like
-        liked_user = User.query.get(liked_user_id)
+        if liked_user is None:
+            liked_user = await run_db(db.session.get, User, liked_user_id)
         
         if not liked_user:
             logger.warning(f"Cannot send like notification: User ID {liked_user_id} not found")
@@ -67,7 +70,8 @@ async def send_like_notification(context: ContextTypes.DEFAULT_TYPE, liked_user_
     except Exception as e:
         logger.error(f"Error sending like notification: {e}")
 
-async def send_match_notification(context: ContextTypes.DEFAULT_TYPE, match_id: int, user1_id: int, user2_id: int) -> None:
+async def send_match_notification(context: ContextTypes.DEFAULT_TYPE, match_id: int, user1_id: int, user2_id: int,
+                                  user1: User = None, user2: User = None) -> None:
     """
     Send a notification to both users when they match
     
@@ -76,14 +80,18 @@ async def send_match_notification(context: ContextTypes.DEFAULT_TYPE, match_id:
         match_id: The ID of the match
         user1_id: The ID of the first user
         user2_id: The ID of the second user
+        user1: The first user, if already loaded
+        user2: The second user, if already loaded
     """
     if not ENABLE_NOTIFICATIONS:
         return
     
     try:
         # Get both users
-        user1 = User.query.get(user1_id)
-        user2 = User.query.get(user2_id)
+        if user1 is None:
+            user1 = await run_db(db.session.get, User, user1_id)
+        if user2 is None:
+            user2 = await run_db(db.session.get, User, user2_id)
         
         if not user1 or not user2:
             logger.warning(f"Cannot send match notification: One or both users not found")
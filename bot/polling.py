@@ -0,0 +1,85 @@
+from telegram.error import RetryAfter, TelegramError
+from telegram.ext import Application
+from bot.dedup import update_deduplicator
+from bot.dispatcher import DispatcherStopped, update_dispatcher
+from config import POLLING_BATCH_SIZE, POLLING_TIMEOUT, ALLOWED_UPDATES
+import asyncio
+import logging
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Seconds to wait after a failed getUpdates, doubled per failure up to the maximum
+RETRY_DELAY = 1
+MAX_RETRY_DELAY = 30
+
+_task = None
+
+async def poll_updates(bot_app: Application, batch_size: int = POLLING_BATCH_SIZE,
+                       timeout: int = POLLING_TIMEOUT) -> None:
+    """
+    Fetch updates with long polling and hand them to the update dispatcher
+
+    Each getUpdates call asks for up to batch_size updates of the
+    ALLOWED_UPDATES types. The next call confirms the batch through its
+    offset, so it is only made once every update has found room in its
+    worker's queue; a full queue slows fetching down instead of growing
+    memory.
+
+    Args:
+        bot_app: The started bot application
+        batch_size: Updates fetched per call, at most 100
+        timeout: Seconds Telegram holds a call open when there are no updates
+    """
+    offset = None
+    delay = RETRY_DELAY
+    while True:
+        try:
+            updates = await bot_app.bot.get_updates(
+                offset=offset, limit=batch_size, timeout=timeout, allowed_updates=ALLOWED_UPDATES
+            )
+        except RetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+            continue
+        except TelegramError as e:
+            # Network errors, or another instance polling with the same token
+            logger.warning(f"getUpdates failed, retrying in {delay}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RETRY_DELAY)
+            continue
+        delay = RETRY_DELAY
+
+        for update in updates:
+            if update_deduplicator.claim(update.update_id):
+                try:
+                    await update_dispatcher.put(update)
+                except DispatcherStopped:
+                    # Shutting down; the offset was not confirmed, so Telegram keeps the rest
+                    update_deduplicator.release(update.update_id)
+                    return
+            offset = update.update_id + 1
+
+async def start_polling(bot_app: Application) -> None:
+    """
+    Remove any webhook and start polling in the background
+
+    Telegram refuses getUpdates while a webhook is set.
+
+    Args:
+        bot_app: The started bot application
+    """
+    global _task
+    if _task is not None:
+        return
+    await bot_app.bot.delete_webhook()
+    _task = asyncio.create_task(poll_updates(bot_app), name="poll-updates")
+    logger.info(f"Polling for {', '.join(ALLOWED_UPDATES)} updates")
+
+async def stop_polling() -> None:
+    """Stop fetching updates; queued updates are left to the dispatcher"""
+    global _task
+    if _task is None:
+        return
+    _task.cancel()
+    await asyncio.gather(_task, return_exceptions=True)
+    _task = None
@@ -3,6 +3,10 @@ from telegram.ext import ContextTypes, ConversationHandler
 from sqlalchemy import and_, not_, or_
 from app import db
 from models import User, Gender, University, Like, Match, UserState
+from bot.db_pool import run_db
+from bot.discovery import user_changed, user_removed
+from bot.sessions import chat_sessions
+from bot.unread import unread_counters
 from config import STATES
 import logging
 
@@ -26,7 +30,7 @@ async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     user = update.effective_user
     
     # Check if user is registered
-    db_user = User.query.filter_by(telegram_id=user.id).first()
+    db_user = await run_db(User.by_telegram_id, user.id)
     if not db_user or not db_user.registration_complete:
         await update.message.reply_text(
             "✋ *Registration Required*\n\n"
@@ -275,6 +279,22 @@ async def profile_button_handler(update: Update, context: ContextTypes.DEFAULT_T
         )
         return PROFILE_MENU
 
+def _update_profile(telegram_id: int, discovery: bool = False, **fields) -> None:
+    """
+    Save changed profile fields for a user
+    
+    Args:
+        telegram_id: The Telegram ID of the user
+        discovery: Whether the fields affect who the user is shown to
+        **fields: The User columns to set
+    """
+    user = User.by_telegram_id(telegram_id)
+    for name, value in fields.items():
+        setattr(user, name, value)
+    db.session.commit()
+    if discovery:
+        user_changed(user)
+
 async def edit_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """
     Process the new name entered by the user
@@ -296,9 +316,7 @@ async def edit_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         return EDIT_NAME
     
     # Update the user's name in the database
-    user = User.query.filter_by(telegram_id=update.effective_user.id).first()
-    user.full_name = new_name
-    db.session.commit()
+    await run_db(_update_profile, update.effective_user.id, full_name=new_name)
     
     # Confirm the update
     await update.message.reply_text(
@@ -332,9 +350,7 @@ async def edit_age(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             return EDIT_AGE
         
         # Update the user's age in the database
-        user = User.query.filter_by(telegram_id=update.effective_user.id).first()
-        user.age = new_age
-        db.session.commit()
+        await run_db(_update_profile, update.effective_user.id, age=new_age)
         
         # Confirm the update
         await update.message.reply_text(
@@ -372,14 +388,11 @@ async def edit_gender(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
         # Return to profile menu
         return await profile_command(update, context)
     
-    # Update the user's gender in the database
-    user = User.query.filter_by(telegram_id=update.effective_user.id).first()
-    
     if data == "gender_male":
-        user.gender = Gender.MALE
+        gender = Gender.MALE
         gender_display = "Male"
     elif data == "gender_female":
-        user.gender = Gender.FEMALE
+        gender = Gender.FEMALE
         gender_display = "Female"
     else:
         # Invalid gender selection
@@ -388,7 +401,8 @@ async def edit_gender(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
         )
         return EDIT_GENDER
     
-    db.session.commit()
+    # Update the user's gender in the database
+    await run_db(_update_profile, update.effective_user.id, discovery=True, gender=gender)
     
     # Confirm the update
     await query.edit_message_text(
@@ -420,14 +434,11 @@ async def edit_interested_in(update: Update, context: ContextTypes.DEFAULT_TYPE)
         # Return to profile menu
         return await profile_command(update, context)
     
-    # Update the user's interest in the database
-    user = User.query.filter_by(telegram_id=update.effective_user.id).first()
-    
     if data == "interest_male":
-        user.interested_in = Gender.MALE
+        interested_in = Gender.MALE
         interest_display = "Men"
     elif data == "interest_female":
-        user.interested_in = Gender.FEMALE
+        interested_in = Gender.FEMALE
         interest_display = "Women"
     else:
         # Invalid interest selection
@@ -436,7 +447,8 @@ async def edit_interested_in(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
         return EDIT_INTERESTED_IN
     
-    db.session.commit()
+    # Update the user's interest in the database
+    await run_db(_update_profile, update.effective_user.id, discovery=True, interested_in=interested_in)
     
     # Confirm the update
     await query.edit_message_text(
@@ -476,9 +488,7 @@ async def edit_university(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         university = University[uni_name]
         
         # Update the user's university in the database
-        user = User.query.filter_by(telegram_id=update.effective_user.id).first()
-        user.university = university
-        db.session.commit()
+        await run_db(_update_profile, update.effective_user.id, discovery=True, university=university)
         
         # Confirm the update
         await query.edit_message_text(
@@ -518,9 +528,7 @@ async def edit_bio(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         return EDIT_BIO
     
     # Update the user's bio in the database
-    user = User.query.filter_by(telegram_id=update.effective_user.id).first()
-    user.bio = new_bio
-    db.session.commit()
+    await run_db(_update_profile, update.effective_user.id, bio=new_bio)
     
     # Confirm the update
     await update.message.reply_text(
@@ -555,9 +563,7 @@ async def edit_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     photo_id = photo.file_id
     
     # Update the user's photo in the database
-    user = User.query.filter_by(telegram_id=update.effective_user.id).first()
-    user.photo_id = photo_id
-    db.session.commit()
+    await run_db(_update_profile, update.effective_user.id, discovery=True, photo_id=photo_id)
     
     # Confirm the update
     await update.message.reply_text(
@@ -569,6 +575,45 @@ async def edit_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     # Return to profile menu
     return await profile_command(update, context)
 
+def _delete_profile(telegram_id: int) -> bool:
+    """
+    Delete a user with their likes, matches and state
+    
+    Args:
+        telegram_id: The Telegram ID of the user
+        
+    Returns:
+        True if the profile was deleted, False if it was not found
+    """
+    # Get the user from the database
+    user = User.by_telegram_id(telegram_id)
+    if not user:
+        return False
+    
+    # Delete related data first (foreign key relationships)
+    Like.query.filter_by(user_id=user.id).delete()
+    Like.query.filter_by(liked_user_id=user.id).delete()
+    
+    # Delete matches involving this user
+    match_ids = []
+    for match in Match.for_user(user.id, active_only=False).all():
+        match_ids.append(match.id)
+        db.session.delete(match)
+    
+    # Delete the user's state
+    UserState.query.filter_by(telegram_id=telegram_id).delete()
+    
+    # Finally delete the user
+    user_id = user.id
+    db.session.delete(user)
+    db.session.commit()
+    user_removed(user_id, deleted=True)
+    chat_sessions.discard(telegram_id)
+    for match_id in match_ids:
+        chat_sessions.discard_match(match_id)
+        unread_counters.forget_match(match_id)
+    return True
+
 async def confirm_delete(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """
     Process the confirmation for deleting the profile
@@ -590,52 +635,31 @@ async def confirm_delete(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return await profile_command(update, context)
     
     elif data == "confirm_delete":
-        # Get the user from the database
-        user = User.query.filter_by(telegram_id=update.effective_user.id).first()
+        # Delete the user's data
+        try:
+            deleted = await run_db(_delete_profile, update.effective_user.id)
+        except Exception as e:
+            logger.error(f"Error deleting user profile: {e}")
+            
+            await query.edit_message_text(
+                "❌ *Error Deleting Profile*\n\n"
+                "There was an error processing your request. Please try again later "
+                "or contact support for assistance.",
+                parse_mode="Markdown"
+            )
+            return ConversationHandler.END
         
-        if user:
-            # Delete the user's data
-            try:
-                # Delete related data first (foreign key relationships)
-                Like.query.filter_by(user_id=user.id).delete()
-                Like.query.filter_by(liked_user_id=user.id).delete()
-                
-                # Delete matches involving this user
-                matches_user1 = Match.query.filter_by(user1_id=user.id).all()
-                matches_user2 = Match.query.filter_by(user2_id=user.id).all()
-                
-                for match in matches_user1 + matches_user2:
-                    db.session.delete(match)
-                
-                # Delete the user's state
-                UserState.query.filter_by(telegram_id=user.telegram_id).delete()
-                
-                # Finally delete the user
-                db.session.delete(user)
-                db.session.commit()
-                
-                await query.edit_message_text(
-                    "✅ *Profile Deleted Successfully*\n\n"
-                    "Your UniMatch Ethiopia profile and all associated data has been permanently deleted.\n\n"
-                    "If you'd like to use UniMatch Ethiopia again in the future, "
-                    "you can create a new profile with /start.",
-                    parse_mode="Markdown"
-                )
-                
-                # End the conversation
-                return ConversationHandler.END
-                
-            except Exception as e:
-                logger.error(f"Error deleting user profile: {e}")
-                db.session.rollback()
-                
-                await query.edit_message_text(
-                    "❌ *Error Deleting Profile*\n\n"
-                    "There was an error processing your request. Please try again later "
-                    "or contact support for assistance.",
-                    parse_mode="Markdown"
-                )
-                return ConversationHandler.END
+        if deleted:
+            await query.edit_message_text(
+                "✅ *Profile Deleted Successfully*\n\n"
+                "Your UniMatch Ethiopia profile and all associated data has been permanently deleted.\n\n"
+                "If you'd like to use UniMatch Ethiopia again in the future, "
+                "you can create a new profile with /start.",
+                parse_mode="Markdown"
+            )
+            
+            # End the conversation
+            return ConversationHandler.END
         else:
             await query.edit_message_text(
                 "❌ *Error Deleting Profile*\n\n"
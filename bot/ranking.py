@@ -0,0 +1,156 @@
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import exists
+from app import db
+from models import User, Like, UserState
+from config import RANKING_WEIGHTS, RANKING_TEMPERATURE
+import logging
+import threading
+
+try:
+    import numpy as np
+except ImportError:  # Ranking is optional; discovery falls back to random order
+    np = None
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+FEATURES = ("recency", "activity", "liked_you", "exposure", "age_distance")
+
+# Feature scales: registrations fade over 30 days, activity over 3 days and
+# every 5 years of age difference counts as one unit of distance
+RECENCY_SCALE_SECONDS = 30 * 24 * 3600
+ACTIVITY_SCALE_SECONDS = 3 * 24 * 3600
+AGE_DISTANCE_SCALE = 5.0
+
+# How often each candidate has been shown in this process
+_exposures = Counter()
+_exposures_lock = threading.Lock()
+
+def is_available() -> bool:
+    """
+    Check whether the ranking stage can run
+
+    Returns:
+        True if numpy is installed, False otherwise
+    """
+    return np is not None
+
+def record_exposure(user_id: int) -> None:
+    """
+    Count that a candidate's profile was shown to someone
+
+    Args:
+        user_id: The ID of the candidate that was shown
+    """
+    with _exposures_lock:
+        _exposures[user_id] += 1
+
+def load_features(viewer: User, candidate_ids: list) -> dict:
+    """
+    Load the ranking features of a batch of candidates as columns
+
+    Args:
+        viewer: The user who is discovering profiles
+        candidate_ids: The IDs of the candidates to score
+
+    Returns:
+        A dict with an "id" column and one numpy array per feature
+    """
+    liked_viewer = exists().where(
+        Like.user_id == User.id,
+        Like.liked_user_id == viewer.id,
+        Like.is_like == True
+    )
+    rows = db.session.query(
+        User.id, User.age, User.registration_date, UserState.updated_at, liked_viewer
+    ).outerjoin(
+        UserState, UserState.telegram_id == User.telegram_id
+    ).filter(User.id.in_(candidate_ids)).all()
+
+    now = datetime.utcnow()
+    count = len(rows)
+    ids = np.empty(count, dtype=np.int64)
+    registered_seconds = np.empty(count)
+    inactive_seconds = np.empty(count)
+    ages = np.empty(count)
+    liked_you = np.empty(count)
+    with _exposures_lock:
+        exposures = np.fromiter((_exposures[row[0]] for row in rows), dtype=np.float64, count=count)
+
+    for position, (user_id, age, registered_at, active_at, liked) in enumerate(rows):
+        ids[position] = user_id
+        registered_seconds[position] = (now - (registered_at or now)).total_seconds()
+        inactive_seconds[position] = (now - (active_at or registered_at or now)).total_seconds()
+        ages[position] = age
+        liked_you[position] = liked
+
+    return {
+        "id": ids,
+        "recency": np.exp(-registered_seconds / RECENCY_SCALE_SECONDS),
+        "activity": np.exp(-inactive_seconds / ACTIVITY_SCALE_SECONDS),
+        "liked_you": liked_you,
+        "exposure": np.log1p(exposures),
+        "age_distance": np.abs(ages - viewer.age) / AGE_DISTANCE_SCALE,
+    }
+
+def score(features: dict, weights: dict = None):
+    """
+    Score candidates as a weighted sum of their feature columns
+
+    Args:
+        features: Feature columns as returned by load_features
+        weights: Feature weights, defaults to RANKING_WEIGHTS
+
+    Returns:
+        A numpy array with one score per candidate
+    """
+    weights = RANKING_WEIGHTS if weights is None else weights
+    matrix = np.stack([features[name] for name in FEATURES])
+    vector = np.array([weights.get(name, 0.0) for name in FEATURES])
+    return vector @ matrix
+
+def pick_top(ids, scores, limit: int, temperature: float = RANKING_TEMPERATURE) -> list:
+    """
+    Order candidates by score with some randomness and keep the best
+
+    Adds Gumbel noise scaled by the temperature before taking the top
+    ``limit``, which samples without replacement in proportion to
+    exp(score / temperature); a temperature of 0 keeps the strict order.
+
+    Args:
+        ids: Candidate IDs
+        scores: Candidate scores aligned with ids
+        limit: The number of candidates to keep
+        temperature: How much randomness to add
+
+    Returns:
+        A list of up to ``limit`` candidate IDs, best first
+    """
+    keys = scores
+    if temperature > 0:
+        keys = scores + temperature * np.random.gumbel(size=len(scores))
+    limit = min(limit, len(ids))
+    if limit < len(ids):
+        top = np.argpartition(-keys, limit - 1)[:limit]
+    else:
+        top = np.arange(len(ids))
+    top = top[np.argsort(-keys[top])]
+    return ids[top].tolist()
+
+def rank_candidates(viewer: User, candidate_ids: list, limit: int) -> list:
+    """
+    Rank a batch of eligible candidates for a viewer
+
+    Args:
+        viewer: The user who is discovering profiles
+        candidate_ids: The IDs of eligible candidates
+        limit: The number of candidates to keep
+
+    Returns:
+        A list of up to ``limit`` candidate IDs, best first
+    """
+    if not candidate_ids:
+        return []
+    features = load_features(viewer, candidate_ids)
+    return pick_top(features["id"], score(features), limit)
@@ -4,6 +4,8 @@ from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes, ConversationHandler
 from app import db
 from models import User, Gender, University, UserState
+from bot.db_pool import run_db
+from bot.discovery import user_changed
 from bot.keyboards import (
     gender_keyboard, interested_in_keyboard,
     universities_keyboard, confirmation_keyboard
@@ -13,6 +15,99 @@ from config import REGISTRATION_STATES, REGISTRATION_STATE_IDS, STATES, STATE_ID
 # Initialize logger
 logger = logging.getLogger(__name__)
 
+def _begin_registration(telegram_id: int, full_name: str) -> bool:
+    """
+    Create or reset a user's record and put them at the start of registration
+    
+    Args:
+        telegram_id: The Telegram ID of the user
+        full_name: The user's Telegram name, used until they enter their own
+        
+    Returns:
+        True if the user record exists, False if it could not be created
+    """
+    existing_user = User.by_telegram_id(telegram_id)
+    
+    # If user exists but registration is not complete, update the existing record
+    if existing_user:
+        logger.info(f"Updating existing user {telegram_id} for registration")
+        # Update the existing user with default values
+        existing_user.full_name = full_name if full_name else "Unknown"
+        existing_user.age = 0
+        existing_user.gender = Gender.MALE  # Default, will be updated
+        existing_user.interested_in = Gender.FEMALE  # Default, will be updated
+        existing_user.university = University.ALL_UNIVERSITIES  # Default, will be updated
+        existing_user.registration_complete = False
+        existing_user.current_state = REGISTRATION_STATES["NAME"]
+        new_user = existing_user
+    else:
+        logger.info(f"Creating new user {telegram_id} for registration")
+        # Create a new user with minimal details
+        new_user = User(
+            telegram_id=telegram_id,
+            full_name=full_name if full_name else "Unknown",
+            age=0,
+            gender=Gender.MALE,  # Default, will be updated
+            interested_in=Gender.FEMALE,  # Default, will be updated
+            university=University.ALL_UNIVERSITIES,  # Default, will be updated
+            registration_complete=False,
+            current_state=REGISTRATION_STATES["NAME"]
+        )
+        db.session.add(new_user)
+    
+    # Commit the changes with error handling
+    try:
+        db.session.commit()
+        logger.info(f"Successfully saved user {telegram_id} to database")
+    except Exception as e:
+        logger.error(f"Database error creating/updating user: {e}")
+        db.session.rollback()
+        # Try to find the user again after rollback
+        existing_user = User.by_telegram_id(telegram_id)
+        if existing_user:
+            logger.info(f"Found user {telegram_id} after database error")
+            new_user = existing_user
+        else:
+            logger.error(f"Could not find or create user {telegram_id}")
+            return False
+            
+    # Store user state with error handling
+    try:
+        # First check if user state already exists
+        existing_state = UserState.by_telegram_id(telegram_id)
+        
+        if existing_state:
+            # Update existing state
+            existing_state.state = REGISTRATION_STATES["NAME"]
+            existing_state.data = {}
+            db.session.commit()
+            logger.info(f"Updated existing user state for user {telegram_id}")
+        else:
+            # Create new state
+            user_state = UserState(
+                telegram_id=telegram_id,
+                state=REGISTRATION_STATES["NAME"],
+                data={}
+            )
+            db.session.add(user_state)
+            db.session.commit()
+            logger.info(f"Created new user state for user {telegram_id}")
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"Error managing user state during registration: {e}")
+        
+        # Try one more time just to update
+        try:
+            existing_state = UserState.by_telegram_id(telegram_id)
+            if existing_state:
+                existing_state.state = REGISTRATION_STATES["NAME"]
+                existing_state.data = {}
+                db.session.commit()
+                logger.info(f"Successfully updated user state after error for user {telegram_id}")
+        except Exception as e2:
+            logger.error(f"Fatal error managing user state during registration: {e2}")
+    return True
+
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """
     Start the registration process when the user sends /start
@@ -28,13 +123,12 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     telegram_id = user.id
     
     # Variables declared outside try blocks for wider scope
-    new_user = None
     existing_user = None
     welcome_messages = []
     
     try:
         # Check if user already exists and registration is complete
-        existing_user = User.query.filter_by(telegram_id=telegram_id).first()
+        existing_user = await run_db(User.by_telegram_id, telegram_id)
         
         if existing_user and existing_user.registration_complete:
             await update.message.reply_text(
@@ -64,90 +158,13 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
                 logger.error(f"Error checking channel membership: {e}")
                 # Continue with registration if channel check fails
         
-        # Initialize the user record
-        
-        # If user exists but registration is not complete, update the existing record
-        if existing_user:
-            logger.info(f"Updating existing user {telegram_id} for registration")
-            # Update the existing user with default values
-            existing_user.full_name = user.full_name if user.full_name else "Unknown"
-            existing_user.age = 0
-            existing_user.gender = Gender.MALE  # Default, will be updated
-            existing_user.interested_in = Gender.FEMALE  # Default, will be updated
-            existing_user.university = University.ALL_UNIVERSITIES  # Default, will be updated
-            existing_user.registration_complete = False
-            existing_user.current_state = REGISTRATION_STATES["NAME"]
-            new_user = existing_user
-        else:
-            logger.info(f"Creating new user {telegram_id} for registration")
-            # Create a new user with minimal details
-            new_user = User(
-                telegram_id=telegram_id,
-                full_name=user.full_name if user.full_name else "Unknown",
-                age=0,
-                gender=Gender.MALE,  # Default, will be updated
-                interested_in=Gender.FEMALE,  # Default, will be updated
-                university=University.ALL_UNIVERSITIES,  # Default, will be updated
-                registration_complete=False,
-                current_state=REGISTRATION_STATES["NAME"]
+        # Initialize the user record and registration state
+        if not await run_db(_begin_registration, telegram_id, user.full_name):
+            await update.message.reply_text(
+                "Sorry, there was an error with registration. Please try again later.",
+                parse_mode="Markdown"
             )
-            db.session.add(new_user)
-        
-        # Commit the changes with error handling
-        try:
-            db.session.commit()
-            logger.info(f"Successfully saved user {telegram_id} to database")
-        except Exception as e:
-            logger.error(f"Database error creating/updating user: {e}")
-            db.session.rollback()
-            # Try to find the user again after rollback
-            existing_user = User.query.filter_by(telegram_id=telegram_id).first()
-            if existing_user:
-                logger.info(f"Found user {telegram_id} after database error")
-                new_user = existing_user
-            else:
-                logger.error(f"Could not find or create user {telegram_id}")
-                await update.message.reply_text(
-                    "Sorry, there was an error with registration. Please try again later.",
-                    parse_mode="Markdown"
-                )
-                return ConversationHandler.END
-                
-        # Store user state with error handling
-        try:
-            # First check if user state already exists
-            existing_state = UserState.query.filter_by(telegram_id=telegram_id).first()
-            
-            if existing_state:
-                # Update existing state
-                existing_state.state = REGISTRATION_STATES["NAME"]
-                existing_state.data = {}
-                db.session.commit()
-                logger.info(f"Updated existing user state for user {telegram_id}")
-            else:
-                # Create new state
-                user_state = UserState(
-                    telegram_id=telegram_id,
-                    state=REGISTRATION_STATES["NAME"],
-                    data={}
-                )
-                db.session.add(user_state)
-                db.session.commit()
-                logger.info(f"Created new user state for user {telegram_id}")
-        except Exception as e:
-            db.session.rollback()
-            logger.warning(f"Error managing user state during registration: {e}")
-            
-            # Try one more time just to update
-            try:
-                existing_state = UserState.query.filter_by(telegram_id=telegram_id).first()
-                if existing_state:
-                    existing_state.state = REGISTRATION_STATES["NAME"]
-                    existing_state.data = {}
-                    db.session.commit()
-                    logger.info(f"Successfully updated user state after error for user {telegram_id}")
-            except Exception as e2:
-                logger.error(f"Fatal error managing user state during registration: {e2}")
+            return ConversationHandler.END
     except Exception as e:
         logger.error(f"Unexpected error in start command: {e}")
         await update.message.reply_text(
@@ -197,6 +214,32 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     
     return REGISTRATION_STATE_IDS["NAME"]
 
+def _save_step(telegram_id: int, state, fields: dict = None, data: dict = None, discovery: bool = False) -> None:
+    """
+    Save a registration answer and move the user to the next step
+    
+    Args:
+        telegram_id: The Telegram ID of the user
+        state: The state the user moves to
+        fields: The User columns to set
+        data: Answers to add to the stored state data
+        discovery: Whether the change affects who the user is shown to
+    """
+    db_user = User.by_telegram_id(telegram_id)
+    if db_user:
+        for name, value in (fields or {}).items():
+            setattr(db_user, name, value)
+        db_user.current_state = state
+    
+    user_state = UserState.by_telegram_id(telegram_id)
+    if user_state:
+        user_state.state = state
+        if data:
+            user_state.data = {**user_state.data, **data}
+    db.session.commit()
+    if db_user and discovery:
+        user_changed(db_user)
+
 async def process_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """
     Process the user's name and ask for age
@@ -217,19 +260,11 @@ async def process_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         )
         return REGISTRATION_STATE_IDS["NAME"]
     
-    # Update user name
-    db_user = User.query.filter_by(telegram_id=user.id).first()
-    if db_user:
-        db_user.full_name = full_name
-        db_user.current_state = REGISTRATION_STATES["AGE"]
-        db.session.commit()
-    
-    # Update user state
-    user_state = UserState.query.filter_by(telegram_id=user.id).first()
-    if user_state:
-        user_state.state = REGISTRATION_STATES["AGE"]
-        user_state.data = {**user_state.data, "name": full_name}
-        db.session.commit()
+    # Update user name and registration state
+    await run_db(
+        _save_step, user.id, REGISTRATION_STATES["AGE"],
+        {"full_name": full_name}, {"name": full_name}
+    )
     
     # Create engaging name confirmation messages
     name_responses = [
@@ -288,19 +323,8 @@ async def process_age(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
         )
         return REGISTRATION_STATE_IDS["AGE"]
     
-    # Update user age
-    db_user = User.query.filter_by(telegram_id=user.id).first()
-    if db_user:
-        db_user.age = age
-        db_user.current_state = REGISTRATION_STATES["GENDER"]
-        db.session.commit()
-    
-    # Update user state
-    user_state = UserState.query.filter_by(telegram_id=user.id).first()
-    if user_state:
-        user_state.state = REGISTRATION_STATES["GENDER"]
-        user_state.data = {**user_state.data, "age": age}
-        db.session.commit()
+    # Update user age and registration state
+    await run_db(_save_step, user.id, REGISTRATION_STATES["GENDER"], {"age": age}, {"age": age})
     
     # Create engaging gender selection messages
     gender_prompts = [
@@ -344,19 +368,11 @@ async def process_gender(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     user = query.from_user
     gender = query.data  # 'male' or 'female'
     
-    # Update user gender
-    db_user = User.query.filter_by(telegram_id=user.id).first()
-    if db_user:
-        db_user.gender = Gender.MALE if gender == 'male' else Gender.FEMALE
-        db_user.current_state = REGISTRATION_STATES["INTERESTED_IN"]
-        db.session.commit()
-    
-    # Update user state
-    user_state = UserState.query.filter_by(telegram_id=user.id).first()
-    if user_state:
-        user_state.state = REGISTRATION_STATES["INTERESTED_IN"]
-        user_state.data = {**user_state.data, "gender": gender}
-        db.session.commit()
+    # Update user gender and registration state
+    await run_db(
+        _save_step, user.id, REGISTRATION_STATES["INTERESTED_IN"],
+        {"gender": Gender.MALE if gender == 'male' else Gender.FEMALE}, {"gender": gender}
+    )
     
     # Create vibrant interest selection messages with emojis
     interest_prompts = [
@@ -406,19 +422,11 @@ async def process_interested_in(update: Update, context: ContextTypes.DEFAULT_TY
     user = query.from_user
     interested_in = query.data  # 'male' or 'female'
     
-    # Update user interest
-    db_user = User.query.filter_by(telegram_id=user.id).first()
-    if db_user:
-        db_user.interested_in = Gender.MALE if interested_in == 'male' else Gender.FEMALE
-        db_user.current_state = REGISTRATION_STATES["UNIVERSITY"]
-        db.session.commit()
-    
-    # Update user state
-    user_state = UserState.query.filter_by(telegram_id=user.id).first()
-    if user_state:
-        user_state.state = REGISTRATION_STATES["UNIVERSITY"]
-        user_state.data = {**user_state.data, "interested_in": interested_in}
-        db.session.commit()
+    # Update user interest and registration state
+    await run_db(
+        _save_step, user.id, REGISTRATION_STATES["UNIVERSITY"],
+        {"interested_in": Gender.MALE if interested_in == 'male' else Gender.FEMALE}, {"interested_in": interested_in}
+    )
     
     # Create vibrant university selection messages with emojis
     university_prompts = [
@@ -479,19 +487,11 @@ async def process_university(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
         return REGISTRATION_STATE_IDS["UNIVERSITY"]
     
-    # Update user university
-    db_user = User.query.filter_by(telegram_id=user.id).first()
-    if db_user:
-        db_user.university = getattr(University, university)
-        db_user.current_state = REGISTRATION_STATES["BIO"]
-        db.session.commit()
-    
-    # Update user state
-    user_state = UserState.query.filter_by(telegram_id=user.id).first()
-    if user_state:
-        user_state.state = REGISTRATION_STATES["BIO"]
-        user_state.data = {**user_state.data, "university": university}
-        db.session.commit()
+    # Update user university and registration state
+    await run_db(
+        _save_step, user.id, REGISTRATION_STATES["BIO"],
+        {"university": getattr(University, university)}, {"university": university}
+    )
     
     # Create engaging bio prompts with emojis
     bio_prompts = [
@@ -554,19 +554,8 @@ async def process_bio(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
         )
         return REGISTRATION_STATE_IDS["BIO"]
     
-    # Update user bio
-    db_user = User.query.filter_by(telegram_id=user.id).first()
-    if db_user:
-        db_user.bio = bio
-        db_user.current_state = REGISTRATION_STATE_IDS["PHOTO"]
-        db.session.commit()
-    
-    # Update user state
-    user_state = UserState.query.filter_by(telegram_id=user.id).first()
-    if user_state:
-        user_state.state = REGISTRATION_STATE_IDS["PHOTO"]
-        user_state.data = {**user_state.data, "bio": bio}
-        db.session.commit()
+    # Update user bio and registration state
+    await run_db(_save_step, user.id, REGISTRATION_STATE_IDS["PHOTO"], {"bio": bio}, {"bio": bio})
     
     # Create engaging photo request messages with emojis
     photo_prompts = [
@@ -630,21 +619,14 @@ async def process_photo(update: Update, context: ContextTypes.DEFAULT_TYPE, is_t
     photo = update.message.photo[-1]  # Get the largest size
     photo_id = photo.file_id
     
-    # Update user photo
-    db_user = User.query.filter_by(telegram_id=user.id).first()
-    if db_user:
-        db_user.photo_id = photo_id
-        db_user.current_state = REGISTRATION_STATE_IDS["CONFIRM"]
-        db.session.commit()
-    
-    # Update user state
-    user_state = UserState.query.filter_by(telegram_id=user.id).first()
-    if user_state:
-        user_state.state = REGISTRATION_STATE_IDS["CONFIRM"]
-        user_state.data = {**user_state.data, "photo_id": photo_id}
-        db.session.commit()
+    # Update user photo and registration state
+    await run_db(
+        _save_step, user.id, REGISTRATION_STATE_IDS["CONFIRM"],
+        {"photo_id": photo_id}, {"photo_id": photo_id}
+    )
     
     # Send profile summary for confirmation
+    db_user = await run_db(User.by_telegram_id, user.id)
     await send_profile_summary(update, context, db_user)
     
     return REGISTRATION_STATE_IDS["CONFIRM"]
@@ -703,29 +685,12 @@ async def confirm_registration(update: Update, context: ContextTypes.DEFAULT_TYP
         )
         
         # Update user state
-        db_user = User.query.filter_by(telegram_id=user.id).first()
-        if db_user:
-            db_user.current_state = REGISTRATION_STATE_IDS["NAME"]
-            db.session.commit()
-            
-        user_state = UserState.query.filter_by(telegram_id=user.id).first()
-        if user_state:
-            user_state.state = REGISTRATION_STATE_IDS["NAME"]
-            db.session.commit()
+        await run_db(_save_step, user.id, REGISTRATION_STATE_IDS["NAME"])
             
         return REGISTRATION_STATE_IDS["NAME"]
     
     # Confirm and complete registration
-    db_user = User.query.filter_by(telegram_id=user.id).first()
-    if db_user:
-        db_user.registration_complete = True
-        db_user.current_state = STATES["IDLE"]
-        db.session.commit()
-        
-    user_state = UserState.query.filter_by(telegram_id=user.id).first()
-    if user_state:
-        user_state.state = STATES["IDLE"]
-        db.session.commit()
+    await run_db(_save_step, user.id, STATES["IDLE"], {"registration_complete": True}, discovery=True)
     
     await query.edit_message_text(
         "🎉 *Congratulations!* Your UniMatch Ethiopia profile is complete! 🎉\n\n"
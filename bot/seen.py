@@ -0,0 +1,243 @@
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+from app import db
+from models import SkipSet
+from bot.background import register_flusher
+from config import SKIP_EXPIRY_DAYS, SKIP_CACHE_SIZE, SKIP_FLUSH_INTERVAL
+import logging
+import re
+import threading
+import zlib
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+_NONZERO_BYTE = re.compile(rb"[^\x00]")
+
+def _set_bit(bits: bytearray, user_id: int) -> None:
+    byte_index = user_id >> 3
+    if byte_index >= len(bits):
+        bits.extend(bytes(byte_index - len(bits) + 1))
+    # Bit order matches PostgreSQL's get_bit(), least significant bit first
+    bits[byte_index] |= 1 << (user_id & 7)
+
+def _encode(ids: array) -> bytes:
+    # Stored as a zlib-compressed bitset, where long runs of unset bits cost
+    # next to nothing; it only exists while a flush is writing it
+    bits = bytearray((ids[-1] >> 3) + 1) if ids else bytearray()
+    for user_id in ids:
+        _set_bit(bits, user_id)
+    return zlib.compress(bytes(bits))
+
+def _decode(stored: bytes) -> array:
+    ids = array("i")
+    if not stored:
+        return ids
+    bits = zlib.decompress(stored)
+    for found in _NONZERO_BYTE.finditer(bits):
+        byte_index, byte = found.start(), bits[found.start()]
+        ids.extend((byte_index << 3) | bit for bit in range(8) if byte & (1 << bit))
+    return ids
+
+def is_skipped(skipped_ids: array, user_id: int) -> bool:
+    """Check a user ID against sorted skipped IDs such as the ones SkipStore.skipped_ids returns"""
+    index = bisect_left(skipped_ids, user_id)
+    return index < len(skipped_ids) and skipped_ids[index] == user_id
+
+class _SkipIds:
+    """Two generations of skipped user IDs for one viewer, each kept as a sorted array"""
+
+    def __init__(self, current: array, previous: array, rotated_at: datetime):
+        self.current = current
+        self.previous = previous
+        self.rotated_at = rotated_at
+        self.dirty = False
+
+    def expire(self, now: datetime) -> None:
+        if not SKIP_EXPIRY_DAYS:
+            return
+        age = now - self.rotated_at
+        if age < timedelta(days=SKIP_EXPIRY_DAYS):
+            return
+        # Skips older than two generations are forgotten, so skipped profiles
+        # come back after between SKIP_EXPIRY_DAYS and twice that many days
+        self.previous = self.current if age < timedelta(days=2 * SKIP_EXPIRY_DAYS) else array("i")
+        self.current = array("i")
+        self.rotated_at = now
+        self.dirty = True
+
+    def add(self, user_id: int) -> None:
+        if is_skipped(self.current, user_id):
+            return
+        self.current.insert(bisect_left(self.current, user_id), user_id)
+        self.dirty = True
+
+    def merged(self) -> array:
+        if not self.previous:
+            return array("i", self.current)
+        return array("i", sorted(set(self.current).union(self.previous)))
+
+class SkipStore:
+    """
+    Per-viewer skipped profiles
+
+    In memory a viewer's skips are a sorted array of user IDs, four bytes per
+    skip however large the IDs are. The skip_sets table stores them as
+    compressed bitsets, where bit N is set when the viewer skipped user ID N.
+    Skips are loaded on first use, consulted in memory by discovery and
+    written back in batches by a background flush.
+    """
+
+    def __init__(self, cache_size: int = SKIP_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._lock = threading.RLock()
+        self._skips = OrderedDict()
+
+    def _load(self, viewer_id: int) -> _SkipIds:
+        with self._lock:
+            skips = self._skips.get(viewer_id)
+            if skips is not None:
+                self._skips.move_to_end(viewer_id)
+                skips.expire(datetime.utcnow())
+                return skips
+
+        row = SkipSet.query.get(viewer_id)
+        if row:
+            skips = _SkipIds(
+                _decode(row.current_bits), _decode(row.previous_bits), row.rotated_at or datetime.utcnow()
+            )
+        else:
+            skips = _SkipIds(array("i"), array("i"), datetime.utcnow())
+        skips.expire(datetime.utcnow())
+
+        with self._lock:
+            # Another caller may have loaded it while we were querying
+            skips = self._skips.setdefault(viewer_id, skips)
+            self._evict()
+        return skips
+
+    def _evict(self) -> None:
+        # Only clean entries are evicted; dirty ones wait for the next flush
+        while len(self._skips) > self.cache_size:
+            for viewer_id, skips in self._skips.items():
+                if not skips.dirty:
+                    del self._skips[viewer_id]
+                    break
+            else:
+                return
+
+    def add(self, viewer_id: int, user_id: int) -> None:
+        """
+        Record that a viewer skipped a profile
+
+        Args:
+            viewer_id: The ID of the user who skipped
+            user_id: The ID of the skipped user
+        """
+        skips = self._load(viewer_id)
+        with self._lock:
+            skips.add(user_id)
+
+    def contains(self, viewer_id: int, user_id: int) -> bool:
+        """
+        Check whether a viewer has skipped a profile
+
+        Args:
+            viewer_id: The ID of the viewer
+            user_id: The ID of the candidate
+
+        Returns:
+            True if the candidate was skipped and the skip has not expired
+        """
+        skips = self._load(viewer_id)
+        with self._lock:
+            return is_skipped(skips.current, user_id) or is_skipped(skips.previous, user_id)
+
+    def skipped_ids(self, viewer_id: int) -> array:
+        """
+        Get the IDs the viewer has skipped, e.g. to bind as one integer[] in SQL
+
+        Args:
+            viewer_id: The ID of the viewer
+
+        Returns:
+            The skipped user IDs in ascending order, empty if there are none
+        """
+        skips = self._load(viewer_id)
+        with self._lock:
+            return skips.merged()
+
+    def forget(self, viewer_id: int) -> None:
+        """
+        Drop a viewer's skips from memory, e.g. after profile deletion
+
+        Args:
+            viewer_id: The ID of the viewer
+        """
+        with self._lock:
+            self._skips.pop(viewer_id, None)
+
+    def flush(self) -> None:
+        """Write every changed viewer's skips back to the database in one statement"""
+        with self._lock:
+            changed = []
+            for viewer_id, skips in self._skips.items():
+                if skips.dirty:
+                    changed.append((viewer_id, array("i", skips.current), array("i", skips.previous), skips.rotated_at))
+                    skips.dirty = False
+        if not changed:
+            return
+
+        # Encode outside the lock; a bitset is as long as the largest skipped ID
+        rows = [
+            {
+                "viewer_id": viewer_id,
+                "current_bits": _encode(current),
+                "previous_bits": _encode(previous) if previous else None,
+                "rotated_at": rotated_at,
+                "updated_at": datetime.utcnow(),
+            }
+            for viewer_id, current, previous, rotated_at in changed
+        ]
+
+        statement = insert(SkipSet.__table__)
+        statement = statement.on_conflict_do_update(
+            index_elements=[SkipSet.viewer_id],
+            set_={
+                "current_bits": statement.excluded.current_bits,
+                "previous_bits": statement.excluded.previous_bits,
+                "rotated_at": statement.excluded.rotated_at,
+                "updated_at": statement.excluded.updated_at,
+            }
+        )
+        try:
+            db.session.execute(statement, rows)
+            db.session.commit()
+        except IntegrityError:
+            # A viewer was deleted meanwhile; write the rows one by one so a
+            # single bad row does not hold back everyone else's skips
+            db.session.rollback()
+            for row in rows:
+                try:
+                    db.session.execute(statement, [row])
+                    db.session.commit()
+                except IntegrityError as e:
+                    db.session.rollback()
+                    logger.warning(f"Dropping skip bitset for user {row['viewer_id']}: {e}")
+        except Exception:
+            # Mark the bitsets dirty again so the next flush retries them
+            with self._lock:
+                for row in rows:
+                    skips = self._skips.get(row["viewer_id"])
+                    if skips is not None:
+                        skips.dirty = True
+            raise
+        logger.debug(f"Flushed {len(rows)} skip bitsets")
+
+# Shared skip store for the bot process
+skip_store = SkipStore()
+register_flusher("skip bitsets", skip_store.flush, SKIP_FLUSH_INTERVAL)
@@ -0,0 +1,119 @@
+from collections import OrderedDict, namedtuple
+from sqlalchemy import event
+from models import UserState
+from config import STATES, CHAT_SESSION_CACHE_SIZE, CHAT_SESSION_TTL
+import logging
+import threading
+import time
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# Everything the relay path needs to forward a message without reading the database
+ChatSession = namedtuple("ChatSession", [
+    "match_id", "user_id", "user_name", "peer_id", "peer_telegram_id", "peer_name", "expires_at"
+])
+
+class ChatSessionCache:
+    """
+    LRU cache of active chat sessions, keyed by the sender's Telegram ID
+
+    Sessions are cached when a user opens a chat and dropped when the chat
+    ends, either user is banned or deleted, or the user's state leaves
+    CHATTING. Entries also expire after CHAT_SESSION_TTL seconds so changes
+    made by other processes are picked up.
+    """
+
+    def __init__(self, max_size: int = CHAT_SESSION_CACHE_SIZE, ttl: float = CHAT_SESSION_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+        # Telegram IDs with a cached session, by match ID
+        self._by_match = {}
+
+    def get(self, telegram_id: int):
+        """
+        Get a user's active chat session
+
+        Args:
+            telegram_id: The Telegram ID of the sender
+
+        Returns:
+            The ChatSession, or None if it is not cached or has expired
+        """
+        with self._lock:
+            session = self._sessions.get(telegram_id)
+            if session is None:
+                return None
+            if session.expires_at < time.monotonic():
+                self._remove(telegram_id)
+                return None
+            self._sessions.move_to_end(telegram_id)
+            return session
+
+    def put(self, telegram_id: int, match_id: int, user, peer) -> ChatSession:
+        """
+        Cache a user's chat session
+
+        Args:
+            telegram_id: The Telegram ID of the sender
+            match_id: The ID of the match they are chatting in
+            user: The sender's User
+            peer: The other participant's User
+
+        Returns:
+            The cached ChatSession
+        """
+        session = ChatSession(
+            match_id, user.id, user.full_name,
+            peer.id, peer.telegram_id, peer.full_name,
+            time.monotonic() + self.ttl
+        )
+        with self._lock:
+            self._remove(telegram_id)
+            self._sessions[telegram_id] = session
+            self._by_match.setdefault(match_id, set()).add(telegram_id)
+            while len(self._sessions) > self.max_size:
+                self._remove(next(iter(self._sessions)))
+        return session
+
+    def _remove(self, telegram_id: int) -> None:
+        session = self._sessions.pop(telegram_id, None)
+        if session is None:
+            return
+        members = self._by_match.get(session.match_id)
+        if members is not None:
+            members.discard(telegram_id)
+            if not members:
+                del self._by_match[session.match_id]
+
+    def discard(self, telegram_id: int) -> None:
+        """
+        Drop a user's cached chat session
+
+        Args:
+            telegram_id: The Telegram ID of the user
+        """
+        with self._lock:
+            self._remove(telegram_id)
+
+    def discard_match(self, match_id: int) -> None:
+        """
+        Drop the cached sessions of both participants of a match
+
+        Args:
+            match_id: The ID of the match
+        """
+        with self._lock:
+            for telegram_id in list(self._by_match.get(match_id, ())):
+                self._remove(telegram_id)
+
+# Shared chat session cache for the bot process
+chat_sessions = ChatSessionCache()
+
+@event.listens_for(UserState.state, "set")
+def _state_changed(target, value, oldvalue, initiator):
+    # Leaving chat mode in any handler ends the cached session
+    if value != STATES["CHATTING"] and target.telegram_id is not None:
+        chat_sessions.discard(target.telegram_id)
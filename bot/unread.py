@@ -0,0 +1,234 @@
+from collections import OrderedDict
+from datetime import datetime
+from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+from app import db
+from models import Message, UnreadCounter
+from bot.background import dead_letter, register_flusher
+from config import UNREAD_CACHE_SIZE, UNREAD_FLUSH_INTERVAL, UNREAD_BUFFER_LIMIT, FLUSH_MAX_ATTEMPTS
+import logging
+import threading
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+def _change_row(key: tuple, change: tuple) -> dict:
+    (match_id, user_id), (reset, increment) = key, change
+    return {"match_id": match_id, "user_id": user_id, "reset": reset, "increment": increment}
+
+class UnreadCounters:
+    """
+    Unread message counts per (match, user), kept in memory with write-behind
+
+    The chat pipeline increments a counter for every message a user did not
+    see live, and opening the conversation resets it. Counts are cached, and
+    the changes are written to the unread_counters table as increments, so
+    several processes can update the same counter. Changes that fail
+    ``max_attempts`` flushes in a row, and the oldest beyond ``max_pending``,
+    are moved to the dead-letter file.
+    """
+
+    def __init__(self, cache_size: int = UNREAD_CACHE_SIZE, max_pending: int = UNREAD_BUFFER_LIMIT,
+                 max_attempts: int = FLUSH_MAX_ATTEMPTS):
+        self.cache_size = cache_size
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        # (match ID, user ID) -> known count
+        self._counts = OrderedDict()
+        # (match ID, user ID) -> (reset, increment) waiting to be written
+        self._pending = {}
+        # Flushes that have failed in a row
+        self._failures = 0
+
+    def _evict(self) -> None:
+        # Counters with unwritten changes stay until the next flush
+        while len(self._counts) > self.cache_size:
+            for key in self._counts:
+                if key not in self._pending:
+                    del self._counts[key]
+                    break
+            else:
+                return
+
+    def _trim(self) -> list:
+        # Called with the lock held; returns the oldest changes beyond the
+        # limit and forgets their cached counts, which no longer match the table
+        dropped = []
+        while len(self._pending) > self.max_pending:
+            key = next(iter(self._pending))
+            dropped.append(_change_row(key, self._pending.pop(key)))
+            self._counts.pop(key, None)
+        return dropped
+
+    def increment(self, match_id: int, user_id: int) -> None:
+        """
+        Count one more unread message for a user
+
+        Args:
+            match_id: The ID of the match
+            user_id: The ID of the user who has not read the message
+        """
+        key = (match_id, user_id)
+        with self._lock:
+            reset, increment = self._pending.get(key, (False, 0))
+            self._pending[key] = (reset, increment + 1)
+            if key in self._counts:
+                self._counts[key] += 1
+            dropped = self._trim()
+        dead_letter("unread counters", dropped, f"the buffer reached {self.max_pending} counters")
+
+    def reset(self, match_id: int, user_id: int) -> None:
+        """
+        Mark every message of a match as read by a user
+
+        Args:
+            match_id: The ID of the match
+            user_id: The ID of the user who opened the conversation
+        """
+        key = (match_id, user_id)
+        with self._lock:
+            self._pending[key] = (True, 0)
+            self._counts[key] = 0
+            self._counts.move_to_end(key)
+            self._evict()
+            dropped = self._trim()
+        dead_letter("unread counters", dropped, f"the buffer reached {self.max_pending} counters")
+
+    def counts(self, user_id: int, match_ids: list) -> dict:
+        """
+        Get a user's unread counts for several matches
+
+        Args:
+            user_id: The ID of the user
+            match_ids: The IDs of the matches
+
+        Returns:
+            A dict of unread counts by match ID
+        """
+        with self._lock:
+            found = {}
+            missing = []
+            for match_id in match_ids:
+                key = (match_id, user_id)
+                if key in self._counts:
+                    self._counts.move_to_end(key)
+                    found[match_id] = self._counts[key]
+                else:
+                    missing.append(match_id)
+        if not missing:
+            return found
+
+        stored = dict(
+            db.session.query(UnreadCounter.match_id, UnreadCounter.count).filter(
+                UnreadCounter.user_id == user_id,
+                UnreadCounter.match_id.in_(missing)
+            ).all()
+        )
+        with self._lock:
+            for match_id in missing:
+                key = (match_id, user_id)
+                if key in self._counts:
+                    # Loaded by someone else meanwhile
+                    found[match_id] = self._counts[key]
+                    continue
+                reset, increment = self._pending.get(key, (False, 0))
+                count = (0 if reset else stored.get(match_id, 0)) + increment
+                self._counts[key] = found[match_id] = count
+            self._evict()
+        return found
+
+    def flush(self) -> None:
+        """Write pending resets and increments to the database"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        now = datetime.utcnow()
+        rows = [
+            {"match_id": match_id, "user_id": user_id, "count": increment, "updated_at": now}
+            for (match_id, user_id), (reset, increment) in pending.items()
+        ]
+        resets = [row for row, (reset, _) in zip(rows, pending.values()) if reset]
+        increments = [row for row, (reset, _) in zip(rows, pending.values()) if not reset]
+
+        statement = insert(UnreadCounter.__table__)
+        set_count = statement.on_conflict_do_update(
+            index_elements=[UnreadCounter.match_id, UnreadCounter.user_id],
+            set_={"count": statement.excluded["count"], "updated_at": statement.excluded.updated_at}
+        )
+        add_count = statement.on_conflict_do_update(
+            index_elements=[UnreadCounter.match_id, UnreadCounter.user_id],
+            set_={
+                "count": UnreadCounter.__table__.c["count"] + statement.excluded["count"],
+                "updated_at": statement.excluded.updated_at,
+            }
+        )
+        try:
+            for upsert, batch in ((set_count, resets), (add_count, increments)):
+                if batch:
+                    db.session.execute(upsert, batch)
+            for row in resets:
+                db.session.execute(
+                    update(Message).where(
+                        Message.match_id == row["match_id"],
+                        Message.receiver_id == row["user_id"],
+                        Message.is_read == False
+                    ).values(is_read=True)
+                )
+            db.session.commit()
+        except IntegrityError as e:
+            # A match or user was deleted meanwhile; its counters go with it
+            db.session.rollback()
+            logger.warning(f"Retrying unread counters one by one: {e}")
+            for upsert, batch in ((set_count, resets), (add_count, increments)):
+                for row in batch:
+                    try:
+                        db.session.execute(upsert, [row])
+                        db.session.commit()
+                    except IntegrityError:
+                        db.session.rollback()
+        except Exception:
+            db.session.rollback()
+            self._failures += 1
+            if self._failures >= self.max_attempts:
+                self._failures = 0
+                with self._lock:
+                    for key in pending:
+                        self._counts.pop(key, None)
+                dead_letter(
+                    "unread counters", [_change_row(key, change) for key, change in pending.items()],
+                    f"{self.max_attempts} failed writes"
+                )
+                raise
+            # Merge the changes back in front so the next flush retries them
+            with self._lock:
+                newer, self._pending = self._pending, {}
+                for key, (reset, increment) in pending.items():
+                    newer_reset, newer_increment = newer.pop(key, (False, 0))
+                    self._pending[key] = (True, newer_increment) if newer_reset else (reset, increment + newer_increment)
+                self._pending.update(newer)
+                dropped = self._trim()
+            dead_letter("unread counters", dropped, f"the buffer reached {self.max_pending} counters")
+            raise
+        self._failures = 0
+        logger.debug(f"Flushed {len(rows)} unread counters")
+
+    def forget_match(self, match_id: int) -> None:
+        """
+        Drop a match's counters from memory, e.g. after it was deleted
+
+        Args:
+            match_id: The ID of the match
+        """
+        with self._lock:
+            for key in [key for key in self._counts if key[0] == match_id]:
+                del self._counts[key]
+            for key in [key for key in self._pending if key[0] == match_id]:
+                del self._pending[key]
+
+# Shared unread counters for the bot process
+unread_counters = UnreadCounters()
+register_flusher("unread counters", unread_counters.flush, UNREAD_FLUSH_INTERVAL)
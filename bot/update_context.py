@@ -0,0 +1,77 @@
+from contextvars import ContextVar
+from telegram import Update
+from telegram.ext import Application, CallbackContext
+from models import User, UserState
+from bot.db_pool import run_db
+
+def _load_caller(telegram_id: int) -> tuple:
+    return User.by_telegram_id(telegram_id), UserState.by_telegram_id(telegram_id)
+
+class UpdateContext:
+    """
+    State shared by every handler that processes one update
+
+    The update dispatcher creates one per update, and handlers reach it as
+    context.update_context. The caller's User and UserState are loaded
+    together on first use and kept until the update is done, so handlers
+    and their helpers do not look the caller up again. Database work still
+    goes through run_db, which gives every unit of work its own session.
+    The loaded rows are detached: read them freely, and to change them in a
+    unit of work attach them with db.session.merge(row, load=False), which
+    does not reload them.
+    """
+
+    def __init__(self, update: Update):
+        self.update = update
+        self.telegram_id = update.effective_user.id if update.effective_user else None
+        self._loaded = False
+        self._user = None
+        self._user_state = None
+
+    async def _load(self) -> None:
+        if self._loaded or self.telegram_id is None:
+            return
+        self._user, self._user_state = await run_db(_load_caller, self.telegram_id)
+        self._loaded = True
+
+    async def user(self):
+        """
+        Get the caller's user record
+
+        Returns:
+            The User, or None if the caller has not registered
+        """
+        await self._load()
+        return self._user
+
+    async def user_state(self):
+        """
+        Get the caller's conversation state
+
+        Returns:
+            The UserState, or None if the caller has none
+        """
+        await self._load()
+        return self._user_state
+
+    def invalidate(self) -> None:
+        """Drop the loaded rows after a unit of work changed them, so the next read reloads them"""
+        self._loaded = False
+        self._user = None
+        self._user_state = None
+
+# The context of the update the current task is processing, set by the update dispatcher
+current_update_context = ContextVar("current_update_context", default=None)
+
+class BotContext(CallbackContext):
+    """Callback context that carries the UpdateContext of the update being handled"""
+
+    update_context = None
+
+    @classmethod
+    def from_update(cls, update: object, application: Application) -> "BotContext":
+        context = super().from_update(update, application)
+        if isinstance(update, Update):
+            # Updates handled outside the dispatcher get a context per callback
+            context.update_context = current_update_context.get() or UpdateContext(update)
+        return context
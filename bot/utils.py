@@ -2,6 +2,7 @@ from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes, ConversationHandler
 from app import db
 from models import UserState
+from bot.db_pool import run_db
 from config import STATES
 import logging
 
@@ -41,6 +42,13 @@ async def ping_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         # Fallback without markdown
         await update.message.reply_text(f"Pong! Hi {user.first_name}! The bot is working! ✅")
 
+def _reset_state(telegram_id: int) -> None:
+    user_state = UserState.by_telegram_id(telegram_id)
+    if user_state:
+        user_state.state = STATES["IDLE"]
+        user_state.data = {}
+        db.session.commit()
+
 async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """
     Cancel the current conversation and reset user state
@@ -55,11 +63,7 @@ async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     user = update.effective_user
     
     # Reset user state
-    user_state = UserState.query.filter_by(telegram_id=user.id).first()
-    if user_state:
-        user_state.state = STATES["IDLE"]
-        user_state.data = {}
-        db.session.commit()
+    await run_db(_reset_state, user.id)
     
     cancel_messages = [
         "✅ *Operation cancelled!* What adventure shall we embark on next? 🚀",
@@ -102,6 +106,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         "❤️ /find - Discover your potential soulmate\n"
         "💑 /matches - See who matched with you\n"
         "💌 /chat - Send sweet messages to your matches\n"
+        "🔎 /search - Find earlier messages in an open chat\n"
         "🎭 /confess - Share anonymous thoughts in UniMatchConfessions\n"
         "ℹ️ /about - Learn about UniMatch Ethiopia\n"
         "🚫 /cancel - Stop current action instantly\n"
@@ -1,7 +1,7 @@
 import os
 
 # Telegram Bot Configuration
-TELEGRAM_API_BASE_URL = "https://api.telegram.org/bot"
+TELEGRAM_API_BASE_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org/bot")
 REPLIT_DOMAIN = os.environ.get("REPLIT_DOMAINS", "").split()[0] if os.environ.get("REPLIT_DOMAINS") else ""
 WEBHOOK_URL = f"https://{REPLIT_DOMAIN}/webhook/{os.environ.get('TELEGRAM_BOT_TOKEN', '')}" if REPLIT_DOMAIN else ""
 
@@ -97,3 +97,101 @@ MAX_BIO_LENGTH = 300
 # Pagination configuration
 PROFILES_PER_PAGE = 1
 MESSAGES_PER_PAGE = 5
+
+# Discovery configuration
+ENABLE_DISCOVERY_INDEX = os.environ.get("ENABLE_DISCOVERY_INDEX", "True").lower() == "true"
+DISCOVERY_SAMPLE_ATTEMPTS = int(os.environ.get("DISCOVERY_SAMPLE_ATTEMPTS", "32"))
+DISCOVERY_SEEN_CACHE_SIZE = int(os.environ.get("DISCOVERY_SEEN_CACHE_SIZE", "5000"))
+# Strategy for picking candidates in PostgreSQL when the index has none: keyset, tablesample or full
+DISCOVERY_SAMPLING_STRATEGY = os.environ.get("DISCOVERY_SAMPLING_STRATEGY", "keyset").lower()
+DISCOVERY_TABLESAMPLE_PERCENT = float(os.environ.get("DISCOVERY_TABLESAMPLE_PERCENT", "5"))
+# Prefetched candidate decks for /find
+DISCOVERY_DECK_SIZE = int(os.environ.get("DISCOVERY_DECK_SIZE", "20"))
+DISCOVERY_DECK_REFILL_AT = int(os.environ.get("DISCOVERY_DECK_REFILL_AT", "5"))
+DISCOVERY_DECK_TTL = int(os.environ.get("DISCOVERY_DECK_TTL", "900"))
+DISCOVERY_DECK_MAX_USERS = int(os.environ.get("DISCOVERY_DECK_MAX_USERS", "10000"))
+
+# Skipped profiles are kept in per-user bitsets instead of the likes table
+SKIP_EXPIRY_DAYS = int(os.environ.get("SKIP_EXPIRY_DAYS", "0"))  # 0 keeps skips forever
+SKIP_CACHE_SIZE = int(os.environ.get("SKIP_CACHE_SIZE", "2000"))
+SKIP_FLUSH_INTERVAL = float(os.environ.get("SKIP_FLUSH_INTERVAL", "5"))
+
+# Candidate ranking (requires numpy); weights are "feature=weight" pairs
+ENABLE_CANDIDATE_RANKING = os.environ.get("ENABLE_CANDIDATE_RANKING", "True").lower() == "true"
+RANKING_BATCH_SIZE = int(os.environ.get("RANKING_BATCH_SIZE", "500"))
+# Keyset sampling draws the ranking batch from this many random pivots
+RANKING_SAMPLE_PIVOTS = int(os.environ.get("RANKING_SAMPLE_PIVOTS", "8"))
+RANKING_TEMPERATURE = float(os.environ.get("RANKING_TEMPERATURE", "0.5"))
+RANKING_WEIGHTS = {
+    name.strip(): float(weight)
+    for name, weight in (
+        pair.split("=") for pair in os.environ.get(
+            "RANKING_WEIGHTS",
+            "recency=1.0,activity=1.5,liked_you=2.0,exposure=-0.5,age_distance=-1.0"
+        ).split(",") if pair
+    )
+}
+
+# Likes that do not create a match are buffered and written in batches
+LIKE_FLUSH_INTERVAL = float(os.environ.get("LIKE_FLUSH_INTERVAL", "0.5"))
+LIKE_FLUSH_BATCH_SIZE = int(os.environ.get("LIKE_FLUSH_BATCH_SIZE", "200"))
+LIKE_BUFFER_LIMIT = int(os.environ.get("LIKE_BUFFER_LIMIT", "20000"))
+
+# Active chat sessions are cached so relaying a message needs no lookups
+CHAT_SESSION_CACHE_SIZE = int(os.environ.get("CHAT_SESSION_CACHE_SIZE", "10000"))
+CHAT_SESSION_TTL = float(os.environ.get("CHAT_SESSION_TTL", "300"))
+
+# Relayed chat messages are stored in batches; senders are acknowledged with
+# a reply, a reaction (falls back to a reply where unsupported) or not at all
+MESSAGE_FLUSH_INTERVAL = float(os.environ.get("MESSAGE_FLUSH_INTERVAL", "0.2"))
+MESSAGE_FLUSH_BATCH_SIZE = int(os.environ.get("MESSAGE_FLUSH_BATCH_SIZE", "100"))
+CHAT_ACK_MODE = os.environ.get("CHAT_ACK_MODE", "reply").lower()
+MESSAGE_BUFFER_LIMIT = int(os.environ.get("MESSAGE_BUFFER_LIMIT", "10000"))
+
+# Write-behind buffers give up on a batch after this many failed flushes in a
+# row and append it to a JSONL file in DEAD_LETTER_DIR instead
+FLUSH_MAX_ATTEMPTS = int(os.environ.get("FLUSH_MAX_ATTEMPTS", "5"))
+DEAD_LETTER_DIR = os.environ.get("DEAD_LETTER_DIR", "dead_letters")
+
+# Messages are partitioned by month; old months are archived to gzipped JSONL
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "archive")
+MESSAGE_ARCHIVE_AFTER_MONTHS = int(os.environ.get("MESSAGE_ARCHIVE_AFTER_MONTHS", "12"))
+MESSAGE_PARTITIONS_AHEAD = int(os.environ.get("MESSAGE_PARTITIONS_AHEAD", "3"))
+ARCHIVE_CACHE_SIZE = int(os.environ.get("ARCHIVE_CACHE_SIZE", "64"))
+
+# Unread message counters shown in /chat
+UNREAD_CACHE_SIZE = int(os.environ.get("UNREAD_CACHE_SIZE", "20000"))
+UNREAD_FLUSH_INTERVAL = float(os.environ.get("UNREAD_FLUSH_INTERVAL", "2"))
+UNREAD_BUFFER_LIMIT = int(os.environ.get("UNREAD_BUFFER_LIMIT", "50000"))
+
+# Chats listed per page in /chat
+CHAT_LIST_PAGE_SIZE = int(os.environ.get("CHAT_LIST_PAGE_SIZE", "8"))
+
+# Text search configuration for /search; "simple" works for any language
+SEARCH_LANGUAGE = os.environ.get("SEARCH_LANGUAGE", "simple")
+SEARCH_RESULTS_PER_PAGE = int(os.environ.get("SEARCH_RESULTS_PER_PAGE", "5"))
+
+# Update workers, sharded by chat, and the number of updates each may have queued
+DISPATCH_WORKERS = int(os.environ.get("DISPATCH_WORKERS", "32"))
+DISPATCH_QUEUE_SIZE = int(os.environ.get("DISPATCH_QUEUE_SIZE", "100"))
+
+# Updates held while the bot starts; beyond this the webhook asks Telegram to retry
+STARTUP_BUFFER_SIZE = int(os.environ.get("STARTUP_BUFFER_SIZE", "1000"))
+
+# Recent update IDs remembered to drop updates Telegram delivers again
+DEDUP_WINDOW = int(os.environ.get("DEDUP_WINDOW", "10000"))
+# Also persist the highest update ID, so redeliveries after a restart are dropped
+DEDUP_PERSIST = os.environ.get("DEDUP_PERSIST", "False").lower() == "true"
+DEDUP_FLUSH_INTERVAL = float(os.environ.get("DEDUP_FLUSH_INTERVAL", "5"))
+
+# How updates reach the bot: "webhook" or "polling" (long polling with getUpdates)
+UPDATE_MODE = os.environ.get("UPDATE_MODE", "webhook").lower()
+POLLING_BATCH_SIZE = int(os.environ.get("POLLING_BATCH_SIZE", "100"))
+POLLING_TIMEOUT = int(os.environ.get("POLLING_TIMEOUT", "30"))
+# Update types the handlers use; Telegram does not send the others
+ALLOWED_UPDATES = [kind for kind in os.environ.get("ALLOWED_UPDATES", "message,callback_query").split(",") if kind]
+
+# Threads running the bot's database work, each with its own session and connection
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+# How the bot runs database work: "thread" on the thread pool, or "async" on the event loop through asyncpg
+DB_MODE = os.environ.get("DB_MODE", "thread").lower()
@@ -3,7 +3,8 @@ import logging
 from flask import jsonify, request
 from app import app
 from webhook import setup_webhook
-from bot import setup_bot
+from bot import setup_bot, run_on_bot_loop, is_ready
+from config import UPDATE_MODE
 
 # Configure detailed logging
 logging.basicConfig(
@@ -42,6 +43,23 @@ def ping():
         'message': 'Bot is running'
     })
 
+@app.route('/health')
+def health():
+    # 503 until the bot has started, so load balancers wait for it
+    if not is_ready():
+        return jsonify({'status': 'starting', 'message': 'Bot is starting'}), 503
+    return jsonify({'status': 'success', 'message': 'Bot is ready'})
+
+@app.route('/metrics')
+def metrics():
+    from bot.dedup import update_deduplicator
+    from bot.dispatcher import update_dispatcher
+    return jsonify({
+        'status': 'success',
+        'updates': update_deduplicator.stats(),
+        'queued_updates': update_dispatcher.backlog()
+    })
+
 @app.route('/api/docs')
 def api_docs():
     return jsonify({
@@ -59,6 +77,16 @@ def api_docs():
                 'method': 'GET',
                 'description': 'Simple health check endpoint'
             },
+            {
+                'path': '/health',
+                'method': 'GET',
+                'description': 'Readiness check; 503 until the bot has started'
+            },
+            {
+                'path': '/metrics',
+                'method': 'GET',
+                'description': 'Update counters: accepted, duplicates dropped and queued'
+            },
             {
                 'path': '/about',
                 'method': 'GET',
@@ -148,8 +176,6 @@ if __name__ == "__main__":
 @app.route('/setup_webhook_direct')
 def setup_webhook_direct():
     """Set up webhook directly from the current host"""
-    import asyncio
-    
     token = os.environ.get("TELEGRAM_BOT_TOKEN")
     if not token:
         return jsonify({"status": "error", "message": "No bot token available"}), 400
@@ -164,19 +190,15 @@ def setup_webhook_direct():
         from bot import get_bot
         bot_instance = get_bot()
         
-        # Create a new event loop for async operations
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
         # Delete any existing webhook
         try:
-            loop.run_until_complete(bot_instance.bot.delete_webhook())
+            run_on_bot_loop(bot_instance.bot.delete_webhook())
             logger.info("Existing webhook deleted")
         except Exception as e:
             logger.warning(f"Error deleting existing webhook: {e}")
         
         # Set the new webhook
-        loop.run_until_complete(bot_instance.bot.set_webhook(url=webhook_url))
+        run_on_bot_loop(bot_instance.bot.set_webhook(url=webhook_url))
         
         return jsonify({
             "status": "success", 
@@ -189,8 +211,6 @@ def setup_webhook_direct():
 @app.route('/delete_webhook_direct')
 def delete_webhook_direct():
     """Delete the current webhook"""
-    import asyncio
-    
     token = os.environ.get("TELEGRAM_BOT_TOKEN")
     if not token:
         return jsonify({"status": "error", "message": "No bot token available"}), 400
@@ -200,12 +220,8 @@ def delete_webhook_direct():
         from bot import get_bot
         bot_instance = get_bot()
         
-        # Create a new event loop for async operations
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
         # Delete the webhook
-        loop.run_until_complete(bot_instance.bot.delete_webhook())
+        run_on_bot_loop(bot_instance.bot.delete_webhook())
         
         return jsonify({
             "status": "success", 
@@ -219,8 +235,6 @@ def delete_webhook_direct():
 @app.route('/set_webhook_url')
 def set_webhook_url():
     """Set webhook to a specific URL"""
-    import asyncio
-    
     token = os.environ.get("TELEGRAM_BOT_TOKEN")
     if not token:
         return jsonify({"status": "error", "message": "No bot token available"}), 400
@@ -270,19 +284,15 @@ def set_webhook_url():
         from bot import get_bot
         bot_instance = get_bot()
         
-        # Create a new event loop for async operations
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
         # Delete any existing webhook
         try:
-            loop.run_until_complete(bot_instance.bot.delete_webhook())
+            run_on_bot_loop(bot_instance.bot.delete_webhook())
             logger.info("Existing webhook deleted")
         except Exception as e:
             logger.warning(f"Error deleting existing webhook: {e}")
         
         # Set the new webhook
-        loop.run_until_complete(bot_instance.bot.set_webhook(url=webhook_url))
+        run_on_bot_loop(bot_instance.bot.set_webhook(url=webhook_url))
         
         return f"""
         <!DOCTYPE html>
@@ -338,7 +348,9 @@ token = os.environ.get("TELEGRAM_BOT_TOKEN")
 if token:
     try:
         bot = setup_bot(token)
-        setup_webhook(app, bot, token)
+        # With UPDATE_MODE=polling the bot fetches its own updates
+        if UPDATE_MODE == "webhook":
+            setup_webhook(app, bot, token)
         logger.info("Bot and webhook set up successfully")
     except Exception as e:
         logger.error(f"Error setting up bot and webhook: {e}")
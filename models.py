@@ -1,6 +1,8 @@
 from datetime import datetime
 from app import db
-from sqlalchemy import Enum, func
+from sqlalchemy import Enum, func, literal_column
+import sqlalchemy.dialects.postgresql  # Registers the full-text search functions
+from config import SEARCH_LANGUAGE
 import enum
 
 class Gender(enum.Enum):
@@ -51,6 +53,11 @@ class User(db.Model):
     def __repr__(self):
         return f"<User {self.telegram_id} - {self.full_name}>"
 
+    @classmethod
+    def by_telegram_id(cls, telegram_id):
+        """Get the user with a Telegram ID, or None"""
+        return cls.query.filter_by(telegram_id=telegram_id).first()
+
 class Like(db.Model):
     """Like table for storing user likes/dislikes"""
     __tablename__ = 'likes'
@@ -68,6 +75,19 @@ class Like(db.Model):
     def __repr__(self):
         return f"<Like {self.user_id} -> {self.liked_user_id} ({self.is_like})>"
 
+class SkipSet(db.Model):
+    """SkipSet table for storing each user's skipped profiles as packed bitsets"""
+    __tablename__ = 'skip_sets'
+
+    viewer_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    current_bits = db.Column(db.LargeBinary, nullable=False)  # zlib-compressed bitset of skipped user IDs
+    previous_bits = db.Column(db.LargeBinary, nullable=True)  # Previous generation, kept until it expires
+    rotated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<SkipSet {self.viewer_id}>"
+
 class Match(db.Model):
     """Match table for storing matched users"""
     __tablename__ = 'matches'
@@ -82,30 +102,101 @@ class Match(db.Model):
     user1 = db.relationship('User', foreign_keys=[user1_id])
     user2 = db.relationship('User', foreign_keys=[user2_id])
 
+    # Pairs are stored with user1_id < user2_id, so a pair has exactly one row.
+    # The unique constraint serves lookups by user1_id, the index by user2_id.
     __table_args__ = (
         db.UniqueConstraint('user1_id', 'user2_id', name='_user1_user2_uc'),
+        db.CheckConstraint('user1_id < user2_id', name='_user1_lt_user2_ck'),
+        db.Index('ix_matches_user2_user1', 'user2_id', 'user1_id'),
     )
 
+    @staticmethod
+    def ordered(user_a_id, user_b_id):
+        """Return the two user IDs in the order they are stored in"""
+        return (user_a_id, user_b_id) if user_a_id < user_b_id else (user_b_id, user_a_id)
+
+    @classmethod
+    def between(cls, user_a_id, user_b_id):
+        """Query the match between two users, in either order"""
+        user1_id, user2_id = cls.ordered(user_a_id, user_b_id)
+        return cls.query.filter_by(user1_id=user1_id, user2_id=user2_id)
+
+    @classmethod
+    def for_user(cls, user_id, active_only=True):
+        """Query a user's matches as two index probes instead of one OR scan"""
+        as_user1 = cls.query.filter(cls.user1_id == user_id)
+        as_user2 = cls.query.filter(cls.user2_id == user_id)
+        if active_only:
+            as_user1 = as_user1.filter(cls.is_active == True)
+            as_user2 = as_user2.filter(cls.is_active == True)
+        return as_user1.union_all(as_user2)
+
+    def peer_id(self, user_id):
+        """Return the ID of the other user in the match"""
+        return self.user2_id if self.user1_id == user_id else self.user1_id
+
     def __repr__(self):
         return f"<Match {self.user1_id} <-> {self.user2_id}>"
 
+def _search_document(content):
+    # Constants are rendered inline so queries match the index expression
+    language = literal_column(f"'{SEARCH_LANGUAGE}'::regconfig")
+    return func.to_tsvector(language, func.coalesce(content, literal_column("''")))
+
 class Message(db.Model):
     """Message table for storing messages between matched users"""
     __tablename__ = 'messages'
 
-    id = db.Column(db.Integer, primary_key=True)
+    # Range-partitioned by month on sent_at, which therefore has to be part
+    # of the primary key; see bot/archive.py for partition maintenance
+    id = db.Column(db.Integer, db.Sequence('messages_id_seq'), primary_key=True)
     match_id = db.Column(db.Integer, db.ForeignKey('matches.id'), nullable=False)
     sender_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     receiver_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    content = db.Column(db.Text, nullable=False)
-    sent_at = db.Column(db.DateTime, default=datetime.utcnow)
+    content = db.Column(db.Text, nullable=True)  # Text, or the caption of a media message
+    media_type = db.Column(db.String(20), nullable=True)  # photo, voice or sticker; None for text
+    file_id = db.Column(db.String(255), nullable=True)  # Telegram file_id of the relayed media
+    sent_at = db.Column(db.DateTime, primary_key=True, default=datetime.utcnow)
     is_read = db.Column(db.Boolean, default=False)
+    relay_failed = db.Column(db.Boolean, default=False)  # True if forwarding to the receiver failed
     
     match = db.relationship('Match')
 
+    # Serves keyset pagination of a match's history
+    __table_args__ = (
+        db.Index('ix_messages_match_sent_id', 'match_id', 'sent_at', 'id'),
+        # Serves /search; PostgreSQL only, other databases scan instead
+        db.Index(
+            'ix_messages_search', _search_document(content), postgresql_using='gin'
+        ).ddl_if(dialect='postgresql'),
+        {'postgresql_partition_by': 'RANGE (sent_at)'},
+    )
+
     def __repr__(self):
         return f"<Message {self.sender_id} -> {self.receiver_id}>"
 
+    @classmethod
+    def search_document(cls):
+        """
+        Get the full-text search document of a message's text or caption
+
+        Returns:
+            A tsvector SQL expression matching the ix_messages_search index
+        """
+        return _search_document(cls.content)
+
+class UnreadCounter(db.Model):
+    """UnreadCounter table for storing how many messages of a match a user has not read"""
+    __tablename__ = 'unread_counters'
+
+    match_id = db.Column(db.Integer, db.ForeignKey('matches.id', ondelete='CASCADE'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<UnreadCounter match {self.match_id} user {self.user_id}: {self.count}>"
+
 class Report(db.Model):
     """Report table for storing user reports"""
     __tablename__ = 'reports'
@@ -173,3 +264,19 @@ class UserState(db.Model):
 
     def __repr__(self):
         return f"<UserState {self.telegram_id} - {self.state}>"
+
+    @classmethod
+    def by_telegram_id(cls, telegram_id):
+        """Get the conversation state of a Telegram user, or None"""
+        return cls.query.filter_by(telegram_id=telegram_id).first()
+
+class UpdateMark(db.Model):
+    """UpdateMark table for storing the highest Telegram update ID each bot has taken"""
+    __tablename__ = 'update_marks'
+
+    bot_id = db.Column(db.BigInteger, primary_key=True)
+    last_update_id = db.Column(db.BigInteger, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<UpdateMark bot {self.bot_id}: {self.last_update_id}>"
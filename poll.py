@@ -0,0 +1,45 @@
+"""
+Long-polling entry point: runs the bot without a web server
+
+Run with:
+    python poll.py
+
+The same application as the webhook servers is started, and updates fetched
+with getUpdates go to the same update dispatcher. Polling is started even if
+UPDATE_MODE is left at "webhook"; any webhook that is set gets removed.
+"""
+import asyncio
+import logging
+import os
+import signal
+
+from app import app
+from bot import build_bot, start_bot, stop_bot
+from bot.polling import start_polling
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+async def main() -> None:
+    token = os.environ.get("TELEGRAM_BOT_TOKEN")
+    if not token:
+        logger.error("TELEGRAM_BOT_TOKEN environment variable is not set!")
+        exit(1)
+
+    bot = build_bot(token)
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    # Handlers use Flask-SQLAlchemy; tasks started from here inherit the app context
+    with app.app_context():
+        await start_bot(bot)
+        await start_polling(bot)
+        try:
+            await stopping.wait()
+        finally:
+            await stop_bot(bot)
+
+if __name__ == "__main__":
+    asyncio.run(main())
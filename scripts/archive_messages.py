@@ -0,0 +1,33 @@
+"""
+Archive old months of chat messages to compressed files
+
+Creates the partitions for the coming months, then exports every monthly
+partition older than MESSAGE_ARCHIVE_AFTER_MONTHS to a gzipped JSONL file
+in ARCHIVE_DIR and drops it. Chat history reads fall back to these files.
+Meant to run from cron, e.g. once a day.
+
+Usage:
+    python scripts/archive_messages.py [--after-months 12]
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app
+from bot.archive import archive_old_partitions, ensure_partitions
+from config import MESSAGE_ARCHIVE_AFTER_MONTHS
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--after-months", type=int, default=MESSAGE_ARCHIVE_AFTER_MONTHS)
+    args = parser.parse_args()
+
+    with app.app_context():
+        ensure_partitions()
+        archived = archive_old_partitions(args.after_months)
+    print(f"Archived {len(archived)} partitions: {', '.join(archived) or 'none'}")
+
+if __name__ == "__main__":
+    main()
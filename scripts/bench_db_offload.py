@@ -0,0 +1,103 @@
+"""
+Benchmark handler database work on the event loop, the thread pool and asyncpg
+
+Runs many concurrent synthetic updates whose handler does a user lookup
+plus a query that takes --latency seconds on the server, the way a slow
+or remote database would. In "inline" mode the work runs on the event loop,
+as handlers did before bot/db_pool.py; in "run_db" mode it goes through
+run_db, which uses the thread pool or, with DB_MODE=async, an asyncpg
+AsyncSession. Reports updates per second and how late a 10 ms heartbeat on
+the event loop ran, which is how long every other chat was kept waiting.
+
+Usage:
+    BENCH_DATABASE_URL=postgresql://... python scripts/bench_db_offload.py --updates 400 --concurrency 32 --latency 0.01
+    BENCH_DATABASE_URL=postgresql://... DB_MODE=async python scripts/bench_db_offload.py --skip-inline
+
+Only reads are made, so any PostgreSQL database with the app's tables will do.
+Set DB_POOL_SIZE to try other pool sizes.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+bench_database_url = os.environ.get("BENCH_DATABASE_URL")
+if not bench_database_url:
+    sys.exit("BENCH_DATABASE_URL must point to a PostgreSQL database")
+os.environ["DATABASE_URL"] = bench_database_url
+
+from sqlalchemy import text
+from app import app, db
+from models import User
+from bot.db_pool import close_db, run_db
+from config import DB_MODE, DB_POOL_SIZE
+
+HEARTBEAT_INTERVAL = 0.01
+
+def handler_work(telegram_id: int, latency: float) -> None:
+    User.by_telegram_id(telegram_id)
+    db.session.execute(text("SELECT pg_sleep(:latency)"), {"latency": latency})
+    db.session.commit()
+
+async def heartbeat(delays: list) -> None:
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        delays.append(time.perf_counter() - started - HEARTBEAT_INTERVAL)
+
+async def run(mode: str, total: int, concurrency: int, latency: float) -> None:
+    queue = asyncio.Queue()
+    for telegram_id in range(total):
+        queue.put_nowait(telegram_id)
+
+    async def worker() -> None:
+        while not queue.empty():
+            telegram_id = queue.get_nowait()
+            if mode == "inline":
+                handler_work(telegram_id, latency)
+                # Handlers awaited Telegram between queries, which let other updates run
+                await asyncio.sleep(0)
+            else:
+                await run_db(handler_work, telegram_id, latency)
+
+    delays = []
+    beat = asyncio.create_task(heartbeat(delays))
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    beat.cancel()
+    await asyncio.gather(beat, return_exceptions=True)
+
+    if mode != "inline":
+        await close_db()
+
+    delays.sort()
+    p99 = delays[int(len(delays) * 0.99)] if delays else 0
+    print(
+        f"{mode:>6}: updates/s={total / elapsed:8.1f} "
+        f"loop lag p50={statistics.median(delays or [0]) * 1000:7.1f}ms "
+        f"p99={p99 * 1000:7.1f}ms max={max(delays or [0]) * 1000:7.1f}ms"
+    )
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--updates", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--skip-inline", action="store_true", help="Only measure run_db")
+    args = parser.parse_args()
+
+    print(f"{args.updates} updates, {args.concurrency} at a time, {args.latency * 1000:.0f}ms per query, "
+          f"DB_MODE={DB_MODE}, DB_POOL_SIZE={DB_POOL_SIZE}")
+    if not args.skip_inline:
+        # Inline work uses the session of an app context pushed on the loop, as the bot did
+        with app.app_context():
+            asyncio.run(run("inline", args.updates, args.concurrency, args.latency))
+    asyncio.run(run("run_db", args.updates, args.concurrency, args.latency))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark discovery candidate sampling strategies
+
+Seeds synthetic users into a throwaway PostgreSQL database and times each
+sampling strategy in bot/discovery.py at growing pool sizes.
+
+Usage:
+    BENCH_DATABASE_URL=postgresql://... python scripts/bench_discovery.py --sizes 10000 100000 1000000
+
+The database named by BENCH_DATABASE_URL must be disposable: the users table
+is truncated before seeding.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+bench_database_url = os.environ.get("BENCH_DATABASE_URL")
+if not bench_database_url:
+    sys.exit("BENCH_DATABASE_URL must point to a disposable PostgreSQL database")
+os.environ["DATABASE_URL"] = bench_database_url
+
+from sqlalchemy import text
+from app import app, db
+from models import User, Gender, University
+from bot.discovery import sample_candidates, SAMPLING_STRATEGIES
+
+SEED_BATCH_SIZE = 10000
+UNIVERSITIES = list(University)
+
+def seed_users(start: int, stop: int) -> None:
+    """Insert synthetic users with telegram IDs in [start, stop)"""
+    for batch_start in range(start, stop, SEED_BATCH_SIZE):
+        rows = []
+        for telegram_id in range(batch_start, min(batch_start + SEED_BATCH_SIZE, stop)):
+            gender = random.choice(list(Gender))
+            rows.append({
+                "telegram_id": telegram_id,
+                "full_name": f"Bench User {telegram_id}",
+                "age": random.randint(18, 30),
+                "gender": gender,
+                "interested_in": Gender.FEMALE if gender == Gender.MALE else Gender.MALE,
+                "university": random.choice(UNIVERSITIES),
+                "bio": "x" * 200,
+                "photo_id": f"photo-{telegram_id}",
+                "registration_complete": True,
+                "is_banned": False,
+            })
+        db.session.execute(User.__table__.insert(), rows)
+        db.session.commit()
+    db.session.execute(text("ANALYZE users"))
+    db.session.commit()
+
+def time_strategy(viewer: User, strategy: str, rounds: int) -> list:
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        sample_candidates(viewer, strategy=strategy)
+        timings.append((time.perf_counter() - started) * 1000)
+        db.session.rollback()
+    return timings
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--strategies", nargs="+", default=list(SAMPLING_STRATEGIES))
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.session.execute(text("TRUNCATE users RESTART IDENTITY CASCADE"))
+        db.session.commit()
+
+        seeded = 0
+        for size in sorted(args.sizes):
+            seed_users(seeded, size)
+            seeded = size
+            viewer = User.query.filter_by(
+                university=University.ADDIS_ABABA_UNIVERSITY
+            ).first()
+
+            for strategy in args.strategies:
+                # Fewer rounds for the full scan at large sizes keeps runs bounded
+                rounds = args.rounds if strategy != "full" or size <= 100000 else 5
+                timings = time_strategy(viewer, strategy, rounds)
+                print(
+                    f"users={size:>8} strategy={strategy:<11} "
+                    f"median={statistics.median(timings):8.2f}ms "
+                    f"max={max(timings):8.2f}ms rounds={rounds}"
+                )
+
+if __name__ == "__main__":
+    main()
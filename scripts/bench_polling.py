@@ -0,0 +1,126 @@
+"""
+Benchmark long-polling ingestion against a loopback mock Bot API
+
+Serves getMe, deleteWebhook and getUpdates from a mock Bot API on
+127.0.0.1, points the bot at it with TELEGRAM_API_URL and times how long
+bot/polling.py takes to fetch a fixed number of synthetic updates and get
+them through the update dispatcher, for each batch size. The updates are
+poll answers, which no handler takes, so the numbers cover ingestion
+rather than handler work. The mock runs on the bot's event loop, so its
+own cost is included.
+
+Usage:
+    python scripts/bench_polling.py --updates 20000 --batch-sizes 1 10 100
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from urllib.parse import parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PORT = int(os.environ.get("BENCH_MOCK_PORT", "8081"))
+TOKEN = "123456:BENCH"
+
+# Nothing is stored, so an in-memory database is enough to import the app
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ["TELEGRAM_API_URL"] = f"http://127.0.0.1:{PORT}/bot"
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from app import app
+from bot import build_bot, start_bot, stop_bot
+from bot.dispatcher import update_dispatcher
+from bot.polling import poll_updates
+
+class MockBotApi:
+    """Hands out update IDs first_id..last_id in the batches getUpdates asks for"""
+
+    def __init__(self):
+        self.first_id = self.last_id = 0
+        self.calls = 0
+        self.drained = asyncio.Event()
+
+    def reset(self, first_id: int, count: int) -> None:
+        self.first_id, self.last_id = first_id, first_id + count - 1
+        self.calls = 0
+        self.drained.clear()
+
+    async def handle(self, request: Request) -> JSONResponse:
+        method = request.path_params["method"]
+        if method == "getMe":
+            return JSONResponse({"ok": True, "result": {
+                "id": 123456, "is_bot": True, "first_name": "Bench", "username": "bench_bot",
+            }})
+        if method != "getUpdates":
+            return JSONResponse({"ok": True, "result": True})
+
+        params = {key: values[0] for key, values in parse_qs((await request.body()).decode()).items()}
+        self.calls += 1
+        start = max(int(params.get("offset", self.first_id)), self.first_id)
+        end = min(start + int(params.get("limit", 100)) - 1, self.last_id)
+        if start > self.last_id:
+            self.drained.set()
+            await asyncio.sleep(0.05)
+            return JSONResponse({"ok": True, "result": []})
+        return JSONResponse({"ok": True, "result": [
+            {
+                "update_id": update_id,
+                "poll_answer": {
+                    "poll_id": "bench",
+                    "user": {"id": update_id % 1000 + 1, "is_bot": False, "first_name": "Bench"},
+                    "option_ids": [0],
+                },
+            }
+            for update_id in range(start, end + 1)
+        ]})
+
+async def run(count: int, batch_sizes: list) -> None:
+    mock = MockBotApi()
+    server = uvicorn.Server(uvicorn.Config(
+        Starlette(routes=[Route("/bot{token}/{method}", mock.handle, methods=["GET", "POST"])]),
+        host="127.0.0.1", port=PORT, log_level="warning",
+    ))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    bot = build_bot(TOKEN)
+    with app.app_context():
+        await start_bot(bot)
+        first_id = 1
+        for batch_size in batch_sizes:
+            mock.reset(first_id, count)
+            first_id += count
+            started = time.perf_counter()
+            poller = asyncio.create_task(poll_updates(bot, batch_size=batch_size, timeout=0))
+            await mock.drained.wait()
+            while update_dispatcher.backlog():
+                await asyncio.sleep(0.001)
+            elapsed = time.perf_counter() - started
+            poller.cancel()
+            await asyncio.gather(poller, return_exceptions=True)
+            print(
+                f"batch={batch_size:>4} updates={count} getUpdates calls={mock.calls:>6} "
+                f"updates/s={count / elapsed:9.1f}"
+            )
+        await stop_bot(bot)
+
+    server.should_exit = True
+    await server_task
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 10, 100])
+    args = parser.parse_args()
+    asyncio.run(run(args.updates, args.batch_sizes))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Benchmark the discovery ranking stage
+
+Times scoring and top-k selection in bot/ranking.py on synthetic feature
+columns, without touching the database.
+
+Usage:
+    python scripts/bench_ranking.py --sizes 500 2000 5000 --rounds 1000
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Scoring never queries the database, so an in-memory database is enough to import the app
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import numpy as np
+from bot.ranking import score, pick_top
+
+def synthetic_features(size: int, rng) -> dict:
+    return {
+        "id": np.arange(size, dtype=np.int64),
+        "recency": np.exp(-rng.uniform(0, 365, size) / 30),
+        "activity": np.exp(-rng.uniform(0, 30, size) / 3),
+        "liked_you": (rng.random(size) < 0.05).astype(np.float64),
+        "exposure": np.log1p(rng.poisson(3, size).astype(np.float64)),
+        "age_distance": np.abs(rng.integers(18, 31, size) - 22) / 5.0,
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[500, 2000, 5000])
+    parser.add_argument("--rounds", type=int, default=1000)
+    parser.add_argument("--keep", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    for size in args.sizes:
+        features = synthetic_features(size, rng)
+        timings = []
+        for _ in range(args.rounds):
+            started = time.perf_counter()
+            pick_top(features["id"], score(features), args.keep)
+            timings.append((time.perf_counter() - started) * 1e6)
+        timings.sort()
+        print(
+            f"candidates={size:>6} median={statistics.median(timings):8.1f}us "
+            f"p99={timings[int(len(timings) * 0.99) - 1]:8.1f}us"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark webhook ingestion of a running server
+
+Posts synthetic updates to the webhook endpoint from many concurrent
+clients and reports requests per second and latency percentiles. The
+updates are poll answers, which no handler takes, so the numbers cover
+ingestion rather than handler work. Start the server under test first,
+for example:
+
+    gunicorn --bind 127.0.0.1:8000 main:app
+    uvicorn asgi:app --host 127.0.0.1 --port 8000
+
+Usage:
+    python scripts/bench_webhook.py --url http://127.0.0.1:8000 --requests 5000 --concurrency 50
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import statistics
+import time
+
+import httpx
+
+def synthetic_update(update_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "poll_answer": {
+            "poll_id": "bench",
+            "user": {"id": 1, "is_bot": False, "first_name": "Bench"},
+            "option_ids": [0],
+        },
+    }
+
+async def run(url: str, total: int, concurrency: int) -> tuple:
+    update_ids = itertools.count(1)
+    timings = []
+    errors = 0
+
+    async def client_loop(client: httpx.AsyncClient) -> None:
+        nonlocal errors
+        while len(timings) + errors < total:
+            started = time.perf_counter()
+            try:
+                response = await client.post(url, json=synthetic_update(next(update_ids)))
+                response.raise_for_status()
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            timings.append((time.perf_counter() - started) * 1e3)
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return timings, errors, elapsed
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--token", default=os.environ.get("TELEGRAM_BOT_TOKEN", ""))
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    url = f"{args.url.rstrip('/')}/webhook/{args.token}"
+    timings, errors, elapsed = asyncio.run(run(url, args.requests, args.concurrency))
+    if not timings:
+        print(f"all {errors} requests failed")
+        return
+    timings.sort()
+    print(
+        f"requests={len(timings):>6} errors={errors} rps={len(timings) / elapsed:8.1f} "
+        f"median={statistics.median(timings):7.2f}ms p99={timings[int(len(timings) * 0.99) - 1]:7.2f}ms"
+    )
+
+if __name__ == "__main__":
+    main()
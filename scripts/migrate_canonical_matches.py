@@ -0,0 +1,75 @@
+"""
+Store every match with user1_id < user2_id
+
+Older versions stored matches in the order the likes happened, so a pair
+could be (a, b) or (b, a) and, after concurrent likes, occasionally both.
+This script merges such duplicates into the older row, moving their
+messages over, swaps the remaining rows into canonical order and then adds
+the check constraint and the user2_id index the models expect.
+
+Usage:
+    python scripts/migrate_canonical_matches.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+from app import app, db
+
+# Pairs stored in both orders: keep the older row, mark it active if either was
+DUPLICATE_PAIRS = text("""
+    SELECT kept.id, dropped.id, kept.is_active OR dropped.is_active
+    FROM matches kept
+    JOIN matches dropped
+      ON dropped.user1_id = kept.user2_id
+     AND dropped.user2_id = kept.user1_id
+     AND dropped.id > kept.id
+""")
+
+def merge_duplicates() -> None:
+    pairs = db.session.execute(DUPLICATE_PAIRS).all()
+    for kept_id, dropped_id, is_active in pairs:
+        db.session.execute(
+            text("UPDATE messages SET match_id = :kept WHERE match_id = :dropped"),
+            {"kept": kept_id, "dropped": dropped_id}
+        )
+        db.session.execute(
+            text("UPDATE matches SET is_active = :active, ended_at = CASE WHEN :active THEN NULL ELSE ended_at END WHERE id = :kept"),
+            {"kept": kept_id, "active": is_active}
+        )
+        db.session.execute(text("DELETE FROM matches WHERE id = :dropped"), {"dropped": dropped_id})
+    print(f"Merged {len(pairs)} duplicate matches")
+
+def swap_reversed() -> None:
+    # The right-hand sides see the old values, so this swaps the columns
+    result = db.session.execute(text(
+        "UPDATE matches SET user1_id = user2_id, user2_id = user1_id WHERE user1_id > user2_id"
+    ))
+    print(f"Reordered {result.rowcount} matches")
+
+def add_constraints() -> None:
+    exists = db.session.execute(text(
+        "SELECT 1 FROM pg_constraint WHERE conname = '_user1_lt_user2_ck'"
+    )).first()
+    if not exists:
+        db.session.execute(text(
+            "ALTER TABLE matches ADD CONSTRAINT _user1_lt_user2_ck CHECK (user1_id < user2_id)"
+        ))
+    db.session.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_matches_user2_user1 ON matches (user2_id, user1_id)"
+    ))
+    print("Added check constraint and index")
+
+def main() -> None:
+    with app.app_context():
+        # One transaction, so a failure leaves the table as it was
+        db.session.execute(text("LOCK TABLE matches IN SHARE ROW EXCLUSIVE MODE"))
+        merge_duplicates()
+        swap_reversed()
+        add_constraints()
+        db.session.commit()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""
+Add the media and relay columns to an existing messages table
+
+Older versions created messages without media_type, file_id and
+relay_failed, and with content required. db.create_all() never alters an
+existing table, so until this script has run every insert of a chat
+message fails. It is safe to run more than once, and works on both the
+plain and the partitioned table.
+
+Usage:
+    python scripts/migrate_message_columns.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+from app import app, db
+
+STATEMENTS = (
+    "ALTER TABLE messages ADD COLUMN IF NOT EXISTS media_type VARCHAR(20)",
+    "ALTER TABLE messages ADD COLUMN IF NOT EXISTS file_id VARCHAR(255)",
+    "ALTER TABLE messages ADD COLUMN IF NOT EXISTS relay_failed BOOLEAN DEFAULT false",
+    # Media messages without a caption have no text
+    "ALTER TABLE messages ALTER COLUMN content DROP NOT NULL",
+)
+
+def migrate() -> None:
+    for statement in STATEMENTS:
+        db.session.execute(text(statement))
+    db.session.commit()
+    print("The messages table has the media and relay columns")
+
+def main() -> None:
+    with app.app_context():
+        migrate()
+
+if __name__ == "__main__":
+    main()
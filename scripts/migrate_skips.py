@@ -0,0 +1,65 @@
+"""
+Move skip rows from the likes table into per-user skip bitsets
+
+Older versions stored every skip as a Like row with is_like = False. This
+script folds those rows into the skip_sets table, merging with any bitsets
+that already exist, and then deletes them from likes.
+
+Usage:
+    python scripts/migrate_skips.py [--batch-size 500]
+"""
+import argparse
+import os
+import sys
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db
+from models import Like, SkipSet
+from bot.seen import _set_bit
+
+def migrate(batch_size: int) -> None:
+    viewer_ids = [
+        viewer_id for (viewer_id,) in
+        db.session.query(Like.user_id).filter(Like.is_like == False).distinct()
+    ]
+    print(f"Migrating skips of {len(viewer_ids)} users")
+
+    for start in range(0, len(viewer_ids), batch_size):
+        batch = viewer_ids[start:start + batch_size]
+        bitsets = {}
+        for skip_set in SkipSet.query.filter(SkipSet.viewer_id.in_(batch)):
+            bitsets[skip_set.viewer_id] = (skip_set, bytearray(zlib.decompress(skip_set.current_bits)))
+
+        skips = db.session.query(Like.user_id, Like.liked_user_id).filter(
+            Like.is_like == False,
+            Like.user_id.in_(batch)
+        )
+        for viewer_id, skipped_id in skips:
+            if viewer_id not in bitsets:
+                skip_set = SkipSet(viewer_id=viewer_id, current_bits=b"")
+                db.session.add(skip_set)
+                bitsets[viewer_id] = (skip_set, bytearray())
+            _set_bit(bitsets[viewer_id][1], skipped_id)
+
+        for skip_set, bits in bitsets.values():
+            skip_set.current_bits = zlib.compress(bytes(bits))
+
+        Like.query.filter(
+            Like.is_like == False,
+            Like.user_id.in_(batch)
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        print(f"Migrated {min(start + batch_size, len(viewer_ids))}/{len(viewer_ids)} users")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    with app.app_context():
+        migrate(args.batch_size)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Convert the messages table into a table partitioned by month
+
+Older versions created messages as a plain table. This script renames it,
+creates the partitioned table with one partition per month from the oldest
+message up to MESSAGE_PARTITIONS_AHEAD months from now, copies every row
+over and drops the old table, all in one transaction. Message IDs keep
+counting on from the existing sequence.
+
+Usage:
+    python scripts/partition_messages.py
+"""
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+from app import app, db
+from models import Message
+from bot.archive import _add_months, _is_partitioned, _month_start, create_partition
+from config import MESSAGE_PARTITIONS_AHEAD
+
+def migrate() -> None:
+    db.session.execute(text("LOCK TABLE messages IN ACCESS EXCLUSIVE MODE"))
+    db.session.execute(text("UPDATE messages SET sent_at = timezone('utc', now()) WHERE sent_at IS NULL"))
+
+    # Keep the id sequence, which dropping the old table would otherwise take along
+    db.session.execute(text("ALTER TABLE messages ALTER COLUMN id DROP DEFAULT"))
+    db.session.execute(text("ALTER SEQUENCE messages_id_seq OWNED BY NONE"))
+    db.session.execute(text("ALTER TABLE messages RENAME TO messages_legacy"))
+    db.session.execute(text("ALTER TABLE messages_legacy RENAME CONSTRAINT messages_pkey TO messages_legacy_pkey"))
+    db.session.execute(text("DROP INDEX IF EXISTS ix_messages_match_sent_id"))
+
+    Message.__table__.create(db.session.connection(), checkfirst=True)
+
+    oldest = db.session.execute(text("SELECT min(sent_at) FROM messages_legacy")).scalar() or datetime.utcnow()
+    month = _month_start(oldest)
+    last = _add_months(_month_start(datetime.utcnow()), MESSAGE_PARTITIONS_AHEAD)
+    while month <= last:
+        create_partition(month)
+        month = _add_months(month, 1)
+    db.session.execute(text("CREATE TABLE IF NOT EXISTS messages_default PARTITION OF messages DEFAULT"))
+
+    # Columns added after the table was first created may be missing
+    legacy_columns = set(db.session.execute(text(
+        "SELECT column_name FROM information_schema.columns WHERE table_name = 'messages_legacy'"
+    )).scalars())
+    columns = ", ".join(column.name for column in Message.__table__.columns if column.name in legacy_columns)
+    copied = db.session.execute(text(
+        f"INSERT INTO messages ({columns}) SELECT {columns} FROM messages_legacy"
+    )).rowcount
+
+    db.session.execute(text("DROP TABLE messages_legacy"))
+    db.session.execute(text("ALTER SEQUENCE messages_id_seq OWNED BY messages.id"))
+    db.session.commit()
+    print(f"Copied {copied} messages into the partitioned table")
+
+def main() -> None:
+    with app.app_context():
+        if _is_partitioned():
+            print("The messages table is already partitioned")
+            return
+        migrate()
+
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,10 @@ import traceback
 from flask import Flask, request, jsonify
 from telegram import Update
 from telegram.ext import Application
-import json
 
 # Import bot initialization function
-from bot import initialize_bot
+from bot import run_on_bot_loop, submit_update
+from bot.dedup import update_deduplicator
 
 # Initialize logger
 logger = logging.getLogger(__name__)
@@ -36,12 +36,15 @@ def setup_webhook(app: Flask, bot: Application, token: str):
                 # Get the update data
                 try:
                     update_data = request.get_json(force=True)
-                    logger.info(f"Received update from Telegram")
-                    logger.debug(f"Update data: {json.dumps(update_data, indent=2)}")
                 except Exception as e:
                     logger.error(f"Failed to parse update JSON: {e}")
                     return jsonify({"status": "success", "message": "Could not parse update data"}), 200
                 
+                # Drop updates Telegram sent again before doing any work on them
+                update_id = update_data.get("update_id") if isinstance(update_data, dict) else None
+                if update_id is not None and not update_deduplicator.claim(update_id):
+                    return jsonify({"status": "success", "message": "Duplicate update"}), 200
+                
                 # Convert to a Telegram Update object
                 try:
                     update = Update.de_json(update_data, bot.bot)
@@ -49,24 +52,18 @@ def setup_webhook(app: Flask, bot: Application, token: str):
                     logger.error(f"Failed to convert update: {e}")
                     return jsonify({"status": "success", "message": "Invalid update format"}), 200
                 
-                # Initialize the bot if needed
-                try:
-                    # Use synchronous application method for webhook context
-                    bot.create_task(initialize_bot(bot))
-                    logger.info("Bot initialization task created")
-                except Exception as e:
-                    logger.error(f"Bot initialization error: {e}")
-                    # Continue processing even if initialization has issues
-                
-                # Process the update
+                # Hand the update to the bot's loop; the bot was started once at boot
                 try:
-                    # Use the application's own processing logic
-                    # This avoids the need for manual event loop management
-                    bot.create_task(bot.process_update(update))
-                    logger.info("Update processing task created")
+                    accepted = submit_update(update)
                 except Exception as e:
-                    logger.error(f"Failed to process update: {e}")
-                    # Continue and return success anyway
+                    # The bot's loop did not take the update in time or is shutting down
+                    logger.error(f"Failed to submit update {update_id}: {e}")
+                    update_deduplicator.release(update_id)
+                    return jsonify({"status": "error", "message": "Update could not be queued"}), 503
+                if not accepted:
+                    # The startup buffer or the chat's worker queue is full, so let Telegram retry
+                    update_deduplicator.release(update_id)
+                    return jsonify({"status": "error", "message": "Too many pending updates"}), 503
                 
                 # Always return success to Telegram
                 return jsonify({"status": "success"})
@@ -94,15 +91,12 @@ def setup_webhook(app: Flask, bot: Application, token: str):
         webhook_url = f"{webhook_url.rstrip('/')}{webhook_url_path}"
         
         try:
-            # Use the bot's create_task method to handle async operations
-            # This is more reliable than manually creating event loops
-            future = bot.create_task(bot.bot.set_webhook(url=webhook_url))
-            
-            # Return success immediately rather than waiting for completion
-            logger.info(f"Webhook setting task created for URL: {webhook_url}")
+            # Runs on the bot's own loop when served by the ASGI server
+            run_on_bot_loop(bot.bot.set_webhook(url=webhook_url))
+            logger.info(f"Webhook set to {webhook_url}")
             return jsonify({
                 "status": "success", 
-                "message": f"Setting webhook to {webhook_url}"
+                "message": f"Webhook set to {webhook_url}"
             })
         except Exception as e:
             logger.error(f"Error setting webhook: {e}")
@@ -112,15 +106,11 @@ def setup_webhook(app: Flask, bot: Application, token: str):
     def remove_webhook():
         """Remove the webhook"""
         try:
-            # Use the bot's create_task method to handle async operations
-            # This is more reliable than manually creating event loops
-            future = bot.create_task(bot.bot.delete_webhook())
-            
-            # Return success immediately rather than waiting for completion
-            logger.info("Webhook removal task created")
+            run_on_bot_loop(bot.bot.delete_webhook())
+            logger.info("Webhook removed")
             return jsonify({
                 "status": "success",
-                "message": "Removing webhook"
+                "message": "Webhook removed"
             })
         except Exception as e:
             logger.error(f"Error removing webhook: {e}")